@@ -4,7 +4,14 @@ from flask_cors import CORS
 import urllib.parse
 
 from __init__ import db, login_manager
-from models import User
+from events import event_hub
+from redemptions import redemption_ledger
+from metrics import metrics_registry
+from profiling import request_profiler
+from slow_queries import slow_query_log
+from identity import load_user_snapshot
+from pooling import engine_options
+from rollups import backfill_daily_counts
 
 # Initialize Flask app
 app = Flask(__name__, 
@@ -38,9 +45,72 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# gunicorn workers and request threads per worker (see Procfile)
+app.config['WEB_CONCURRENCY'] = int(os.environ.get('WEB_CONCURRENCY', 1))
+app.config['WEB_THREADS'] = int(os.environ.get('WEB_THREADS', 16))
+
+# Connection pool: 'queue' (default) pools per worker, 'pgbouncer' leaves pooling to PgBouncer
+app.config['DB_POOL_PROFILE'] = os.environ.get('DB_POOL_PROFILE', 'queue')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['DB_POOL_PROFILE'],
+    threads=app.config['WEB_THREADS'],
+    workers=app.config['WEB_CONCURRENCY'],
+    max_connections=int(os.environ.get('DB_MAX_CONNECTIONS', 0)),
+    recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10))
+)
+
+# Signing keys for meal passes, "key_id:secret" pairs, newest first (default: derived from SECRET_KEY)
+app.config['MEAL_PASS_KEYS'] = os.environ.get('MEAL_PASS_KEYS', '')
+
+# How long a worker may serve cached data (schedules etc.) before rechecking its version
+app.config['CACHE_MAX_STALENESS'] = float(os.environ.get('CACHE_MAX_STALENESS', 5))
+
+# Server-Sent Events: 'local' for a single worker, 'database' to fan out across workers
+app.config['EVENT_HUB_BACKEND'] = os.environ.get(
+    'EVENT_HUB_BACKEND', 'database' if app.config['WEB_CONCURRENCY'] > 1 else 'local'
+)
+app.config['EVENT_POLL_INTERVAL'] = float(os.environ.get('EVENT_POLL_INTERVAL', 1))
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+# Streams are closed after this long and the browser reconnects by itself
+app.config['SSE_MAX_STREAM_SECONDS'] = 300
+# Every open stream holds a request thread; past this many per worker, clients fall back to polling
+app.config['SSE_MAX_STREAMS'] = int(os.environ.get('SSE_MAX_STREAMS', max(1, app.config['WEB_THREADS'] // 4)))
+
+# Meal redemptions are written in batches, every REDEMPTION_FLUSH_MS or REDEMPTION_BATCH_SIZE rows
+app.config['REDEMPTION_FLUSH_MS'] = int(os.environ.get('REDEMPTION_FLUSH_MS', 200))
+app.config['REDEMPTION_BATCH_SIZE'] = int(os.environ.get('REDEMPTION_BATCH_SIZE', 500))
+app.config['REDEMPTION_MAX_STALENESS'] = 5
+# Redemptions kept queued while the database can't be reached; the oldest beyond this are dropped
+app.config['REDEMPTION_MAX_PENDING'] = int(os.environ.get('REDEMPTION_MAX_PENDING', 50000))
+
+# Prometheus metrics: with several workers, each writes its totals to METRICS_DIR for /metrics to add up
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_FLUSH_SECONDS'] = 5
+# Bearer token required to scrape /metrics (default: open)
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Request profiling: admins send "X-Profile: 1", or a PROFILE_SAMPLE_RATE share of requests
+# (of PROFILE_ENDPOINTS if set) is sampled; collapsed stacks go to PROFILE_DIR
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_ENDPOINTS'] = os.environ.get('PROFILE_ENDPOINTS')
+app.config['PROFILE_INTERVAL_MS'] = 5
+app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 100))
+
+# Statements slower than SLOW_QUERY_MS are logged and, on PostgreSQL, explained in the background (0 disables)
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 250))
+app.config['SLOW_QUERY_EXPLAIN'] = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+app.config['SLOW_QUERY_EXPLAIN_INTERVAL'] = 300
+
 # Initialize extensions with app
 db.init_app(app)
 login_manager.init_app(app)
+event_hub.init_app(app)
+redemption_ledger.init_app(app)
+metrics_registry.init_app(app)
+request_profiler.init_app(app)
+slow_query_log.init_app(app)
 CORS(app)
 
 # Configure login manager
@@ -48,15 +118,17 @@ login_manager.login_view = 'main.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_user_snapshot(int(user_id))
 
 # Import and register blueprints
 from routes import main_bp
 app.register_blueprint(main_bp)
 
-# Create database tables if they don't exist
+# Create database tables if they don't exist, and fill the daily counts
+# of a deployment that has just been upgraded to them
 with app.app_context():
     db.create_all()
+    backfill_daily_counts()
 
 if __name__ == '__main__':
     # Use PORT environment variable if available (for Railway/Heroku)
@@ -0,0 +1,228 @@
+"""In-memory bitmap index of opt-ins for analytics.
+
+Every (date, meal type) gets a bitmap of the opted-in user ids, stored as a
+Python int (bit ``n`` set means user ``n`` opted in), so set questions
+across meals and dates become integer AND/OR/ANDNOT operations and a
+popcount. A date's bitmaps are read from UserMealOptIn the first time it
+is asked for. Opt-in writes in this worker are applied incrementally once
+they commit. Writes made by other workers show up when the date is
+reloaded, after at most ANALYTICS_MAX_STALENESS seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from __init__ import db
+from caching import register_cache
+from models import UserMealOptIn
+
+# Distinct dates one analytics expression may touch
+MAX_EXPRESSION_DATES = 366
+
+# Nesting of "and"/"or"/"andnot" one analytics expression may use
+MAX_EXPRESSION_DEPTH = 32
+
+class OptInBitmapIndex:
+    """Per-worker bitmaps of opted-in user ids by (date, meal type id)"""
+
+    def __init__(self, name, max_dates, max_staleness):
+        self.name = name
+        self.max_dates = max_dates
+        self.max_staleness = max_staleness
+        self._lock = threading.Lock()
+        # date -> (loaded_at, {meal_type_id: bitmap}), least recently used first
+        self._days = OrderedDict()
+        self.loads = 0
+        self.updates = 0
+        register_cache(name, self)
+
+    def _stale_dates(self, dates):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                d for d in dates
+                if d not in self._days or now - self._days[d][0] >= self.max_staleness
+            ]
+
+    def load(self, dates):
+        """Make sure the bitmaps of ``dates`` are loaded and fresh (one query for all)"""
+        stale = self._stale_dates(dates)
+        if not stale:
+            return
+
+        days = {d: {} for d in stale}
+        loaded_at = time.monotonic()
+        rows = db.session.query(UserMealOptIn.date, UserMealOptIn.meal_type_id, UserMealOptIn.user_id)\
+            .filter(UserMealOptIn.date.in_(stale), UserMealOptIn.opted_in == True)
+        for for_date, meal_type_id, user_id in rows:
+            meals = days[for_date]
+            meals[meal_type_id] = meals.get(meal_type_id, 0) | (1 << user_id)
+
+        with self._lock:
+            for for_date, meals in days.items():
+                self._days[for_date] = (loaded_at, meals)
+                self._days.move_to_end(for_date)
+            while len(self._days) > self.max_dates:
+                self._days.popitem(last=False)
+            self.loads += len(days)
+
+    def bitmap(self, for_date, meal_type_id=None):
+        """Get the bitmap of a loaded date for one meal type, or for any meal type"""
+        with self._lock:
+            entry = self._days.get(for_date)
+            if entry is None:
+                return 0
+            self._days.move_to_end(for_date)
+            # Read under the lock, since apply() changes the dict in place
+            meals = entry[1]
+            if meal_type_id is not None:
+                return meals.get(meal_type_id, 0)
+            result = 0
+            for bitmap in meals.values():
+                result |= bitmap
+            return result
+
+    def apply(self, changes):
+        """Apply committed (user_id, meal_type_id, date, opted_in) changes to loaded dates"""
+        with self._lock:
+            for user_id, meal_type_id, for_date, opted_in in changes:
+                entry = self._days.get(for_date)
+                if entry is None:
+                    continue
+                meals = entry[1]
+                bitmap = meals.get(meal_type_id, 0)
+                meals[meal_type_id] = bitmap | (1 << user_id) if opted_in else bitmap & ~(1 << user_id)
+                self.updates += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'dates': len(self._days),
+                'max_dates': self.max_dates,
+                'bytes': sum(
+                    (bitmap.bit_length() + 7) // 8
+                    for _, meals in self._days.values() for bitmap in meals.values()
+                ),
+                'loads': self.loads,
+                'updates': self.updates
+            }
+
+opt_in_bitmaps = OptInBitmapIndex(
+    'opt_in_bitmaps',
+    int(os.environ.get('ANALYTICS_MAX_DATES', 400)),
+    float(os.environ.get('ANALYTICS_MAX_STALENESS', 60))
+)
+
+def record_bitmap_changes(changes):
+    """Queue opt-in changes for the bitmaps; they are applied if the transaction commits"""
+    db.session.info.setdefault('opt_in_bitmap_changes', []).extend(changes)
+
+@event.listens_for(Session, 'after_commit')
+def _apply_bitmap_changes(session):
+    changes = session.info.pop('opt_in_bitmap_changes', None)
+    if changes:
+        opt_in_bitmaps.apply(changes)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_bitmap_changes(session):
+    session.info.pop('opt_in_bitmap_changes', None)
+
+def user_ids(bitmap):
+    """Yield the user ids set in a bitmap, in ascending order"""
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid date: {value!r}')
+
+def _term_dates(term):
+    """Dates covered by a meal term: one ``date``, or ``start``..``end`` (optionally some weekdays)"""
+    if 'date' in term:
+        return [_parse_date(term['date'])]
+
+    start, end = _parse_date(term.get('start')), _parse_date(term.get('end'))
+    if end < start:
+        raise ValueError('end must not be before start')
+    if (end - start).days >= MAX_EXPRESSION_DATES:
+        raise ValueError(f'A range may cover at most {MAX_EXPRESSION_DATES} days')
+    weekdays = term.get('weekdays')
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return [d for d in dates if weekdays is None or d.weekday() in weekdays]
+
+def _operands(expr, op):
+    operands = expr[op]
+    if not isinstance(operands, list) or not operands:
+        raise ValueError(f'"{op}" needs a non-empty list')
+    if op == 'andnot' and len(operands) != 2:
+        raise ValueError('"andnot" needs exactly two operands')
+    return operands
+
+def _walk(expr, dates, depth=0):
+    if not isinstance(expr, dict):
+        raise ValueError('Every expression must be an object')
+    for op in ('and', 'or', 'andnot'):
+        if op in expr:
+            if depth >= MAX_EXPRESSION_DEPTH:
+                raise ValueError(f'An expression may nest at most {MAX_EXPRESSION_DEPTH} levels')
+            for operand in _operands(expr, op):
+                _walk(operand, dates, depth + 1)
+            return
+    if 'meal' not in expr:
+        raise ValueError('Expected "and", "or", "andnot" or a meal term')
+    meal_type_id = expr['meal']
+    if meal_type_id is not None and (not isinstance(meal_type_id, int) or isinstance(meal_type_id, bool)):
+        raise ValueError('"meal" must be a meal type id or null')
+    weekdays = expr.get('weekdays')
+    if weekdays is not None and not isinstance(weekdays, list):
+        raise ValueError('"weekdays" must be a list of 0 (Monday) to 6 (Sunday)')
+    dates.update(_term_dates(expr))
+
+def _evaluate(expr, index):
+    if 'and' in expr or 'or' in expr or 'andnot' in expr:
+        op = 'and' if 'and' in expr else 'or' if 'or' in expr else 'andnot'
+        bitmaps = [_evaluate(operand, index) for operand in expr[op]]
+        if op == 'andnot':
+            return bitmaps[0] & ~bitmaps[1]
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap if op == 'and' else result | bitmap
+        return result
+
+    # A range term is the users opted in on any of its days, or on every day with "every"
+    meal_type_id = expr['meal']
+    bitmaps = [index.bitmap(d, meal_type_id) for d in _term_dates(expr)]
+    if not bitmaps:
+        return 0
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        result = result & bitmap if expr.get('every') else result | bitmap
+    return result
+
+def evaluate(expr, index=opt_in_bitmaps):
+    """Evaluate a set expression over the bitmaps and return the resulting bitmap.
+
+    Terms are ``{"meal": id or null, "date": ...}`` or ``{"meal": ...,
+    "start": ..., "end": ..., "every": bool, "weekdays": [0-6]}``; a null
+    meal means any meal type. They combine with ``{"and": [...]}``,
+    ``{"or": [...]}`` and ``{"andnot": [a, b]}``. Raises ValueError for a
+    malformed expression.
+    """
+    dates = set()
+    _walk(expr, dates)
+    # More dates than the index holds would evict some of them while loading
+    limit = min(MAX_EXPRESSION_DATES, index.max_dates)
+    if len(dates) > limit:
+        raise ValueError(f'An expression may cover at most {limit} days')
+
+    index.load(dates)
+    return _evaluate(expr, index)
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+from __init__ import db
+from models import CacheVersion
+
+# All caches created in this process, by name (used for the admin stats endpoint)
+_caches = {}
+
+def register_cache(name, cache):
+    """List a cache with a stats() method in the admin cache stats"""
+    _caches[name] = cache
+
+def get_cache_version(name):
+    """Get the shared version number for a named cache (0 if never bumped)"""
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+def bump_cache_version(name):
+    """Increment the shared version for a named cache.
+
+    The bump is part of the caller's transaction, so other workers only see
+    the new version once the change that caused it has been committed.
+    """
+    updated = CacheVersion.query.filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+
+    # The local copy is stale right away, no need to wait for the next check
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate()
+
+def bump_cache_version_in(connection, name):
+    """bump_cache_version() for flush events, which have to use the flushing connection"""
+    table = CacheVersion.__table__
+    updated = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1)
+    ).rowcount
+    if not updated:
+        connection.execute(table.insert().values(name=name, version=1))
+
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate()
+
+class VersionedCache:
+    """Per-process snapshot of database data, revalidated against a shared version.
+
+    Within CACHE_MAX_STALENESS seconds of the last check the snapshot is
+    returned without touching the database. After that a single-row version
+    lookup decides whether the snapshot is still good or has to be reloaded,
+    so every worker picks up a bump within the configured staleness.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.version_checks = 0
+        _caches[name] = self
+
+    def get(self):
+        """Get the cached snapshot, reloading it if its version has changed"""
+        max_staleness = current_app.config.get('CACHE_MAX_STALENESS', 5)
+        now = time.monotonic()
+
+        with self._lock:
+            if self._version is not None and now - self._checked_at < max_staleness:
+                self.hits += 1
+                return self._value
+
+        # Read the version before the data: a bump in between only causes
+        # one extra reload, never a stale snapshot under a newer version
+        version = get_cache_version(self.name)
+        with self._lock:
+            self.version_checks += 1
+            if version == self._version:
+                self._checked_at = now
+                self.hits += 1
+                return self._value
+
+        value = self.loader()
+        with self._lock:
+            self.misses += 1
+            self._value = value
+            self._version = version
+            self._checked_at = now
+        return value
+
+    def peek(self):
+        """Get the last loaded snapshot, even a stale one, without touching the database"""
+        with self._lock:
+            return self._value
+
+    def invalidate(self):
+        """Drop the local snapshot so the next get() reloads it"""
+        with self._lock:
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'version_checks': self.version_checks
+            }
+
+class LRUCache:
+    """Bounded, thread-safe least-recently-used cache with hit/miss counters.
+
+    With ``ttl`` (seconds) entries also expire that long after they were put.
+    """
+
+    def __init__(self, name, maxsize, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        _caches[name] = self
+
+    def get(self, key):
+        """Get the value for ``key``, or None if it is not cached"""
+        with self._lock:
+            try:
+                value, expires_at = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._items[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        """Get the value for ``key``, building and caching it on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when no key is given"""
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired
+            }
+
+def cache_stats():
+    """Get hit/miss counters for every cache in this process"""
+    return [cache.stats() for cache in _caches.values()]
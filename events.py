@@ -0,0 +1,217 @@
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+from __init__ import db
+from models import StreamEvent
+
+logger = logging.getLogger(__name__)
+
+SCHEDULES_CHANNEL = 'schedules'
+
+# How long published events are kept in the stream_event table
+EVENT_RETENTION = timedelta(hours=1)
+
+# Events younger than this are read again by every poll: ids are assigned
+# on insert, so a slow transaction can commit a lower id after a higher one
+EVENT_SETTLE_SECONDS = 10
+
+def opt_in_channel(user_id, for_date):
+    """Channel for opt-in changes of one user on one date"""
+    return f'opt-in:{user_id}:{for_date.isoformat()}'
+
+def daily_qr_channel(for_date):
+    """Channel for daily QR code changes on one date"""
+    return f'daily-qr:{for_date.isoformat()}'
+
+def format_sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class Subscription:
+    """Bounded queue of events for one open stream"""
+
+    def __init__(self, channels, maxsize=100):
+        self.channels = frozenset(channels)
+        self.queue = queue.Queue(maxsize)
+        # Set when events had to be dropped; the client must refetch everything
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Wait up to ``timeout`` seconds for the next (event, data) pair"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventHub:
+    """Fans out published events to the streams open in this worker.
+
+    With the ``local`` backend, publish() delivers straight to this worker's
+    streams, which is enough for a single worker. With the ``database``
+    backend, publish() appends to the stream_event table and one poller
+    thread per worker delivers new rows to that worker's streams, so every
+    gunicorn worker sees every event for one small query per poll interval.
+    The poller rereads the last EVENT_SETTLE_SECONDS of events and skips the
+    ones it has delivered, so an event that commits late is still delivered.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.backend = 'local'
+        self.poll_interval = 1.0
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._poller = None
+        # Every event up to this id has been delivered; above it, the delivered ids
+        self._settled_id = 0
+        self._delivered = set()
+        self._streams = threading.BoundedSemaphore(4)
+        self.rejected_streams = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.get('EVENT_HUB_BACKEND', 'local')
+        self.poll_interval = app.config.get('EVENT_POLL_INTERVAL', 1.0)
+        self._streams = threading.BoundedSemaphore(app.config.get('SSE_MAX_STREAMS', 4))
+        if self.backend not in ('local', 'database'):
+            raise RuntimeError(f"Unknown EVENT_HUB_BACKEND: {self.backend}")
+        if self.backend == 'local' and app.config.get('WEB_CONCURRENCY', 1) > 1:
+            logger.warning(
+                "EVENT_HUB_BACKEND is 'local' with %d workers: live updates only reach "
+                "clients connected to the worker that made the change; use 'database'",
+                app.config['WEB_CONCURRENCY']
+            )
+
+    def acquire_stream(self):
+        """Reserve one of this worker's stream slots; False when all are taken"""
+        if self._streams.acquire(blocking=False):
+            return True
+        self.rejected_streams += 1
+        return False
+
+    def release_stream(self):
+        self._streams.release()
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+            # Started lazily so the thread lives in the forked worker
+            if self.backend == 'database' and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='event-hub-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, event, data):
+        """Publish an event; call this after the change has been committed"""
+        if self.backend == 'local':
+            self._deliver(channel, event, data)
+            return
+
+        with db.engine.begin() as conn:
+            conn.execute(StreamEvent.__table__.insert().values(
+                channel=channel,
+                event=event,
+                payload=json.dumps(data),
+                created_at=datetime.utcnow()
+            ))
+
+    def _deliver(self, channel, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event, data))
+            except queue.Full:
+                subscription.overflowed = True
+
+    def poll(self):
+        """Deliver the events not delivered yet; returns how many there were"""
+        table = StreamEvent.__table__
+        settled_before = datetime.utcnow() - timedelta(seconds=EVENT_SETTLE_SECONDS)
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.channel, table.c.event, table.c.payload, table.c.created_at)
+                .where(table.c.id > self._settled_id)
+                .order_by(table.c.id)
+            ).all()
+
+        delivered = 0
+        settled = True
+        for row in rows:
+            if row.id not in self._delivered:
+                self._delivered.add(row.id)
+                self._deliver(row.channel, row.event, json.loads(row.payload))
+                delivered += 1
+            # Stop before the first unsettled event: a lower id may still commit
+            settled = settled and row.created_at < settled_before
+            if settled:
+                self._settled_id = row.id
+        self._delivered = {event_id for event_id in self._delivered if event_id > self._settled_id}
+        return delivered
+
+    def _poll(self):
+        table = StreamEvent.__table__
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                self._settled_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+
+            polls = 0
+            while True:
+                time.sleep(self.poll_interval)
+                polls += 1
+                try:
+                    self.poll()
+
+                    # Every worker prunes; the delete is idempotent and rare
+                    if polls % 300 == 0:
+                        with db.engine.begin() as conn:
+                            conn.execute(table.delete().where(
+                                table.c.created_at < datetime.utcnow() - EVENT_RETENTION
+                            ))
+                except Exception:
+                    logger.exception("Polling stream events failed")
+
+event_hub = EventHub()
+
+def event_stream(channels, heartbeat, max_age):
+    """Yield SSE messages for the given channels until ``max_age`` seconds pass.
+
+    Clients refetch their state whenever the stream (re)opens, so events
+    missed while disconnected need no replay. A comment line is sent every
+    ``heartbeat`` seconds to keep proxies from closing an idle stream.
+    """
+    # Subscribed before the first message, so nothing committed after the
+    # client's refetch on open can be missed
+    subscription = event_hub.subscribe(channels)
+    try:
+        # Ask the browser to reconnect quickly once the stream ends
+        yield "retry: 3000\n\n"
+        deadline = time.monotonic() + max_age
+        while time.monotonic() < deadline:
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_sse('resync', {})
+            
+            item = subscription.get(timeout=heartbeat)
+            if item is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield format_sse(*item)
+    finally:
+        event_hub.unsubscribe(subscription)
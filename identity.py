@@ -0,0 +1,84 @@
+import os
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from __init__ import db
+from caching import LRUCache, VersionedCache, bump_cache_version_in
+from models import User
+
+USER_VERSION = 'user_identity_version'
+
+# Lightweight copies of users for Flask-Login, so authenticated requests
+# don't need a primary-key lookup each. Entries expire after
+# USER_CACHE_TTL seconds.
+user_cache = LRUCache(
+    'user_identity',
+    int(os.environ.get('USER_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60))
+)
+
+# Changing a cached field of a user bumps this version, and a worker that
+# sees it change drops all its snapshots, within CACHE_MAX_STALENESS
+user_version = VersionedCache(USER_VERSION, user_cache.invalidate)
+
+# Only changes to these fields make snapshots stale
+SNAPSHOT_FIELDS = ('name', 'email', 'is_admin')
+
+class UserSnapshot(UserMixin):
+    """Detached copy of a User with the fields requests rely on; changes to it are not saved"""
+
+    def __init__(self, id, name, email, is_admin):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.is_admin = bool(is_admin)
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.email}>'
+
+def load_user_snapshot(user_id):
+    """Get the cached snapshot of a user, or None if the user doesn't exist"""
+    user_version.get()
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    row = db.session.query(User.id, User.name, User.email, User.is_admin)\
+        .filter(User.id == user_id)\
+        .first()
+    if row is None:
+        return None
+
+    snapshot = UserSnapshot(row.id, row.name, row.email, row.is_admin)
+    user_cache.put(user_id, snapshot)
+    return snapshot
+
+def invalidate_user(user_id):
+    """Drop a user's snapshot in this worker"""
+    user_cache.invalidate(user_id)
+
+# Collect changed users while flushing and drop them once the change is
+# committed, so a concurrent request can't cache the old row again. The
+# version bump is part of the same transaction, for the other workers.
+@event.listens_for(User, 'after_update')
+def _track_user_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in SNAPSHOT_FIELDS):
+        _track_user_change(mapper, connection, target)
+
+@event.listens_for(User, 'after_delete')
+def _track_user_change(mapper, connection, target):
+    bump_cache_version_in(connection, USER_VERSION)
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
@@ -4,6 +4,7 @@ from werkzeug.security import generate_password_hash
 from app import app
 from models import User, MealType, OptInSchedule
 from __init__ import db
+from meal_types import invalidate_meal_types
 
 def init_db():
     """Initialize the database with test users, meal types, and schedules."""
@@ -20,6 +21,7 @@ def init_db():
             db.session.add(breakfast)
             db.session.add(lunch)
             db.session.add(dinner)
+            invalidate_meal_types()
             db.session.commit()
             print("Meal types initialized.")
         
@@ -0,0 +1,86 @@
+"""Expand every user's weekly preferences into UserMealOptIn rows.
+
+Meant to run from cron when an opt-in window opens, so the next day's
+headcount is complete without each user having to visit the app:
+
+    python materialize.py [--date YYYY-MM-DD]
+
+Without --date, every date whose opt-in window is open right now is
+materialized.
+"""
+import argparse
+import sys
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import literal, select
+
+from __init__ import db
+from models import UserMealOptIn, WeeklyOptIn
+from opt_ins import WEEKDAY_COLUMNS
+from bitmaps import record_bitmap_changes
+from rollups import record_opt_in_change
+from roster import record_roster_changes
+from snapshots import discard_snapshots
+from sql_helpers import dialect_insert
+
+def materialize_weekly_opt_ins(target_date):
+    """Opt users in for ``target_date`` according to their weekly preferences.
+
+    One INSERT ... SELECT covers all users. Existing rows for the date are
+    explicit choices (opt-ins or opt-outs) and are left alone. Returns the
+    number of rows created per meal type id.
+    """
+    dow = target_date.weekday()
+    if dow >= len(WEEKDAY_COLUMNS):
+        return {}
+
+    now = datetime.utcnow()
+    selected = select(
+            WeeklyOptIn.user_id,
+            WeeklyOptIn.meal_type_id,
+            literal(target_date).label('date'),
+            literal(True).label('opted_in'),
+            literal(now).label('timestamp')
+        )\
+        .where(getattr(WeeklyOptIn, WEEKDAY_COLUMNS[dow]) == True)
+
+    table = UserMealOptIn.__table__
+    stmt = dialect_insert(table)\
+        .from_select(['user_id', 'meal_type_id', 'date', 'opted_in', 'timestamp'], selected)\
+        .on_conflict_do_nothing(index_elements=[table.c.user_id, table.c.meal_type_id, table.c.date])\
+        .returning(table.c.user_id, table.c.meal_type_id)
+
+    rows = db.session.execute(stmt).all()
+    created = Counter(row.meal_type_id for row in rows)
+    created_values = [(row.user_id, row.meal_type_id, target_date, True) for row in rows]
+    record_bitmap_changes(created_values)
+    record_roster_changes(created_values)
+    for meal_type_id, count in created.items():
+        record_opt_in_change(target_date, meal_type_id, count)
+    if created:
+        discard_snapshots([target_date], force=True)
+
+    db.session.commit()
+    return dict(created)
+
+def main():
+    parser = argparse.ArgumentParser(description='Materialize weekly meal preferences.')
+    parser.add_argument('--date', help='Target date (YYYY-MM-DD), default: dates open for opt-in now')
+    args = parser.parse_args()
+
+    from app import app
+    from schedules import IST, get_timeline
+    with app.app_context():
+        if args.date:
+            target_dates = [datetime.strptime(args.date, '%Y-%m-%d').date()]
+        else:
+            ist_now = datetime.now(IST)
+            target_dates = sorted(get_timeline(ist_now).open_dates(ist_now))
+
+        for target_date in target_dates:
+            created = materialize_weekly_opt_ins(target_date)
+            print(f"{target_date.isoformat()}: {sum(created.values())} opt-ins created")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import hashlib
+from collections import namedtuple
+from types import MappingProxyType
+
+from caching import VersionedCache, bump_cache_version
+from models import MealType
+
+MEAL_TYPE_CACHE = 'meal_types'
+
+# Detached, immutable copy of a MealType row
+MealTypeInfo = namedtuple('MealTypeInfo', ['id', 'name'])
+
+class MealTypeRegistry:
+    """Immutable snapshot of all meal types, ordered by id"""
+
+    def __init__(self, meal_types):
+        self.all = tuple(meal_types)
+        self.by_id = MappingProxyType({m.id: m for m in self.all})
+        self.by_name = MappingProxyType({m.name: m.id for m in self.all})
+        self.etag = hashlib.sha256(repr(self.all).encode()).hexdigest()[:32]
+
+    def find(self, meal_type_id):
+        """Get a meal type by id (int or numeric string), or None"""
+        try:
+            return self.by_id.get(int(meal_type_id))
+        except (TypeError, ValueError):
+            return None
+
+    def name(self, meal_type_id):
+        meal_type = self.by_id.get(meal_type_id)
+        return meal_type.name if meal_type else None
+
+    def __iter__(self):
+        return iter(self.all)
+
+def load_meal_types():
+    """Load all meal types as an immutable registry"""
+    meal_types = MealType.query.order_by(MealType.id).all()
+    return MealTypeRegistry(MealTypeInfo(m.id, m.name) for m in meal_types)
+
+meal_type_cache = VersionedCache(MEAL_TYPE_CACHE, load_meal_types)
+
+def get_meal_type_registry():
+    """Get the cached meal type registry"""
+    return meal_type_cache.get()
+
+def invalidate_meal_types():
+    """Mark the meal types as changed in every worker"""
+    bump_cache_version(MEAL_TYPE_CACHE)
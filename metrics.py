@@ -0,0 +1,208 @@
+"""Request and database metrics in the Prometheus text format.
+
+Every request records its latency and status under its endpoint name, and
+the number and total time of the SQL statements it ran (counted with
+engine events). Recording is a few dictionary updates under one lock.
+
+With gunicorn each worker only sees its own requests. When METRICS_DIR is
+set, every worker writes its totals to its own file in that directory,
+every METRICS_FLUSH_SECONDS and right before answering a scrape, and
+/metrics adds up the files of all workers. Files of workers that have
+exited are kept so counters never go backwards; point METRICS_DIR at an
+empty directory whenever the app is started.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets: request latency in seconds, statements per request,
+# statement time per request in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+QUERY_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# name -> (type, help, buckets for histograms)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by endpoint, method and status code', None),
+    'http_request_duration_seconds': ('histogram', 'Time until the response was returned', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'SQL statements run per request', QUERY_COUNT_BUCKETS),
+    'http_request_db_seconds': ('histogram', 'Time spent in SQL statements per request', QUERY_TIME_BUCKETS),
+}
+
+class MetricsRegistry:
+    """Counters and histograms of this worker, keyed by metric name and labels"""
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self.flush_interval = 5.0
+        self._lock = threading.Lock()
+        # (name, ((label, value), ...)) -> count, or [bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._path = None
+        self._flusher = None
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_interval = app.config.get('METRICS_FLUSH_SECONDS', 5.0)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
+        app.teardown_request(_teardown_request)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(buckets) + 1) + [0.0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    values[index] += 1
+                    break
+            else:
+                values[len(buckets)] += 1
+            values[-1] += value
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self.directory is None or self._flusher is not None:
+            return
+        with self._lock:
+            # Started lazily so the thread lives in the forked worker
+            if self._flusher is None:
+                self._path = os.path.join(self.directory, f'metrics_{os.getpid()}_{time.time_ns()}.json')
+                self._flusher = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        """Write this worker's totals to its file in METRICS_DIR"""
+        if self._path is None:
+            return
+        with self._lock:
+            data = [[name, labels, values] for (name, labels), values in self._values.items()]
+        temp_path = f'{self._path}.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self._path)
+        except OSError:
+            logger.exception("Writing metrics to %s failed", self._path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def collect(self):
+        """Get the totals of every worker (or just this one without METRICS_DIR)"""
+        if self.directory is None:
+            with self._lock:
+                return {key: list(values) if isinstance(values, list) else values
+                        for key, values in self._values.items()}
+
+        self.flush()
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, values in data:
+                key = (name, tuple(tuple(label) for label in labels))
+                if isinstance(values, list):
+                    current = totals.setdefault(key, [0] * len(values))
+                    totals[key] = [a + b for a, b in zip(current, values)]
+                else:
+                    totals[key] = totals.get(key, 0) + values
+        return totals
+
+    def render(self):
+        """Format the collected totals in the Prometheus text exposition format"""
+        by_name = {}
+        for (name, labels), values in self.collect().items():
+            by_name.setdefault(name, []).append((labels, values))
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, values in sorted(by_name.get(name, ())):
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {values}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(pairs) + '}'
+
+metrics_registry = MetricsRegistry()
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+
+def _record(status):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    # Unmatched URLs share one label so 404 scans can't add label values
+    endpoint = request.endpoint or 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method))
+    metrics_registry.inc('http_requests_total', labels + (('status', str(status)),))
+    metrics_registry.observe('http_request_duration_seconds', labels, time.perf_counter() - started)
+    metrics_registry.observe('http_request_db_queries', labels, g.metrics_queries)
+    metrics_registry.observe('http_request_db_seconds', labels, g.metrics_query_seconds)
+
+def _finish_request(response):
+    _record(response.status_code)
+    return response
+
+def _teardown_request(exception):
+    # Covers exceptions that skipped after_request; _record() runs once per request
+    if exception is not None:
+        _record(500)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info['metrics_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started', None)
+    if started is not None and has_request_context() and 'metrics_started' in g:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += time.perf_counter() - started
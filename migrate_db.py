@@ -1,96 +1,240 @@
+"""Copy the SQLite database into PostgreSQL.
+
+Run after deploying and setting up PostgreSQL (with the tables already
+created by the app), but before using the application in production:
+
+    python migrate_db.py [--sqlite PATH] [--chunk-size N] [--restart]
+
+Tables are copied parents first, following their foreign keys. Each table
+is read in rowid order, CHUNK_SIZE rows at a time, and every chunk is loaded
+with COPY into a staging table and moved over with INSERT ... ON CONFLICT
+DO NOTHING in its own transaction. The same transaction records the last
+copied rowid in a checkpoint table, so an interrupted run picks up where it
+stopped. Rows already in PostgreSQL are left alone. Sequences are moved
+past the copied ids at the end.
+"""
+import argparse
+import io
 import os
 import sqlite3
+import sys
+import time
+from graphlib import TopologicalSorter
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2 import sql
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
 load_dotenv()
 
-def migrate_sqlite_to_postgres():
+# Rows read, copied and committed at a time
+CHUNK_SIZE = 5000
+
+# Last copied rowid per table, kept in PostgreSQL next to the data
+CHECKPOINT_TABLE = 'migration_checkpoint'
+
+def sort_tables(sqlite_conn, tables):
+    """Order tables so that every table comes after the tables it references"""
+    graph = {}
+    for table in tables:
+        references = {row[2] for row in sqlite_conn.execute(f'PRAGMA foreign_key_list("{table}")')}
+        graph[table] = {ref for ref in references if ref in tables and ref != table}
+    return list(TopologicalSorter(graph).static_order())
+
+def copy_value(value):
+    """Format a SQLite value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        # bytea hex input, with the backslash escaped for COPY
+        return '\\\\x' + value.hex()
+    return str(value)\
+        .replace('\\', '\\\\')\
+        .replace('\t', '\\t')\
+        .replace('\n', '\\n')\
+        .replace('\r', '\\r')
+
+def fix_sequences(pg_cursor, table, columns):
+    """Move the table's sequences past the largest copied value"""
+    for column in columns:
+        pg_cursor.execute("SELECT pg_get_serial_sequence(%s, %s);", (table, column))
+        sequence = pg_cursor.fetchone()[0]
+        if not sequence:
+            continue
+        pg_cursor.execute(
+            sql.SQL("SELECT setval(%s, COALESCE(MAX({column}), 0) + 1, false) FROM {table};").format(
+                column=sql.Identifier(column), table=sql.Identifier(table)
+            ),
+            (sequence,)
+        )
+
+def migrate_table(sqlite_conn, pg_conn, table, chunk_size):
+    """Copy one table chunk by chunk, resuming after its checkpoint.
+
+    Returns (rows read, rows inserted, seconds).
+    """
+    sqlite_columns = [row[1] for row in sqlite_conn.execute(f'PRAGMA table_info("{table}")')]
+    with pg_conn, pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            "SELECT column_name FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = %s;",
+            (table,)
+        )
+        pg_columns = {row[0] for row in pg_cursor.fetchall()}
+        pg_cursor.execute(
+            sql.SQL("SELECT last_rowid FROM {} WHERE table_name = %s;").format(sql.Identifier(CHECKPOINT_TABLE)),
+            (table,)
+        )
+        checkpoint = pg_cursor.fetchone()
+
+    if not pg_columns:
+        print(f"  Table {table} does not exist in PostgreSQL, skipping...")
+        return 0, 0, 0.0
+    columns = [column for column in sqlite_columns if column in pg_columns]
+    missing = [column for column in sqlite_columns if column not in pg_columns]
+    if missing:
+        print(f"  Columns missing in PostgreSQL, not copied: {', '.join(missing)}")
+
+    last_rowid = checkpoint[0] if checkpoint else 0
+    total = sqlite_conn.execute(f'SELECT COUNT(*) FROM "{table}" WHERE rowid > ?', (last_rowid,)).fetchone()[0]
+    if checkpoint:
+        print(f"  Resuming after rowid {last_rowid}, {total} rows left")
+    if not total:
+        print(f"  No data left in table {table}, skipping...")
+        return 0, 0, 0.0
+
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    stage = sql.Identifier(f'migrate_stage_{table}')
+    select = 'SELECT rowid, {} FROM "{}" WHERE rowid > ? ORDER BY rowid LIMIT ?'.format(
+        ', '.join(f'"{column}"' for column in columns), table
+    )
+
+    read = inserted = 0
+    started = time.monotonic()
+    with pg_conn, pg_conn.cursor() as pg_cursor:
+        # Emptied at every commit, so each chunk starts with a clean stage
+        pg_cursor.execute(
+            sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {stage} AS SELECT {columns} FROM {table} WITH NO DATA;").format(
+                stage=stage, columns=column_list, table=sql.Identifier(table)
+            )
+        )
+        pg_cursor.execute(sql.SQL("TRUNCATE {};").format(stage))
+
+    while True:
+        rows = sqlite_conn.execute(select, (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(value) for value in row[1:]))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        last_rowid = rows[-1][0]
+        with pg_conn, pg_conn.cursor() as pg_cursor:
+            pg_cursor.copy_expert(
+                sql.SQL("COPY {stage} ({columns}) FROM STDIN;").format(stage=stage, columns=column_list),
+                buffer
+            )
+            pg_cursor.execute(
+                sql.SQL("INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} ON CONFLICT DO NOTHING;").format(
+                    table=sql.Identifier(table), columns=column_list, stage=stage
+                )
+            )
+            inserted += pg_cursor.rowcount
+            pg_cursor.execute(sql.SQL("TRUNCATE {};").format(stage))
+            pg_cursor.execute(
+                sql.SQL(
+                    "INSERT INTO {checkpoints} (table_name, last_rowid) VALUES (%s, %s)"
+                    " ON CONFLICT (table_name) DO UPDATE SET last_rowid = EXCLUDED.last_rowid;"
+                ).format(checkpoints=sql.Identifier(CHECKPOINT_TABLE)),
+                (table, last_rowid)
+            )
+
+        read += len(rows)
+        elapsed = time.monotonic() - started
+        print(f"  {read}/{total} rows ({read * 100 // total}%), {read / elapsed:.0f} rows/s", flush=True)
+
+    with pg_conn, pg_conn.cursor() as pg_cursor:
+        fix_sequences(pg_cursor, table, columns)
+    return read, inserted, time.monotonic() - started
+
+def migrate_sqlite_to_postgres(sqlite_path='instance/lunch_track.db', chunk_size=CHUNK_SIZE, restart=False):
     """
     Migrate data from SQLite to PostgreSQL
-    
-    This script should be run after deploying to Railway and setting up PostgreSQL,
-    but before using the application in production.
-    
+
     Make sure to set the DATABASE_URL environment variable before running this script.
+    Returns True once every table has been copied.
     """
     # Get PostgreSQL connection string from environment variable
     database_url = os.environ.get('DATABASE_URL')
-    
+
     if not database_url:
         print("Error: DATABASE_URL environment variable not set.")
         print("Please set the DATABASE_URL environment variable to your PostgreSQL connection string.")
-        return
-    
+        return False
+
     # Convert Heroku/Railway style postgres:// URLs to postgresql://
     if database_url.startswith('postgres://'):
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
-    
+
     # Connect to SQLite database
-    sqlite_conn = sqlite3.connect('instance/lunch_track.db')
-    sqlite_cursor = sqlite_conn.cursor()
-    
+    sqlite_conn = sqlite3.connect(sqlite_path)
+
     # Connect to PostgreSQL database
     try:
         pg_conn = psycopg2.connect(database_url)
-        pg_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        pg_cursor = pg_conn.cursor()
     except Exception as e:
         print(f"Error connecting to PostgreSQL: {e}")
-        return
-    
-    # Get all tables from SQLite
-    sqlite_cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = sqlite_cursor.fetchall()
-    
-    # Migrate each table
-    for table in tables:
-        table_name = table[0]
-        
-        # Skip SQLite internal tables
-        if table_name.startswith('sqlite_'):
-            continue
-        
-        print(f"Migrating table: {table_name}")
-        
-        # Get table schema
-        sqlite_cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = sqlite_cursor.fetchall()
-        column_names = [column[1] for column in columns]
-        
-        # Get all data from SQLite table
-        sqlite_cursor.execute(f"SELECT * FROM {table_name};")
-        rows = sqlite_cursor.fetchall()
-        
-        if not rows:
-            print(f"  No data in table {table_name}, skipping...")
-            continue
-        
-        # Insert data into PostgreSQL table
-        for row in rows:
-            # Create placeholders for the SQL query
-            placeholders = ', '.join(['%s'] * len(row))
-            columns_str = ', '.join(column_names)
-            
-            # Insert the row into PostgreSQL
-            try:
-                pg_cursor.execute(
-                    f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders}) ON CONFLICT DO NOTHING;",
-                    row
-                )
-            except Exception as e:
-                print(f"  Error inserting row into {table_name}: {e}")
-                continue
-        
-        print(f"  Migrated {len(rows)} rows from {table_name}")
-    
-    # Close connections
-    sqlite_conn.close()
-    pg_conn.close()
-    
-    print("Migration completed successfully!")
+        return False
+
+    with pg_conn, pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            sql.SQL("CREATE TABLE IF NOT EXISTS {} (table_name TEXT PRIMARY KEY, last_rowid BIGINT NOT NULL);")
+                .format(sql.Identifier(CHECKPOINT_TABLE))
+        )
+        if restart:
+            pg_cursor.execute(sql.SQL("DELETE FROM {};").format(sql.Identifier(CHECKPOINT_TABLE)))
+
+    # Get all tables from SQLite, skipping its internal tables
+    tables = {
+        row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        if not row[0].startswith('sqlite_')
+    }
+
+    started = time.monotonic()
+    total_read = total_inserted = 0
+    try:
+        for table_name in sort_tables(sqlite_conn, tables):
+            print(f"Migrating table: {table_name}")
+            read, inserted, elapsed = migrate_table(sqlite_conn, pg_conn, table_name, chunk_size)
+            total_read += read
+            total_inserted += inserted
+            if read:
+                print(f"  Migrated {inserted} rows from {table_name} "
+                      f"({read - inserted} already present) in {elapsed:.1f}s")
+    except Exception as e:
+        print(f"Error migrating data: {e}")
+        print("Run the script again to resume from the last copied chunk.")
+        return False
+    finally:
+        sqlite_conn.close()
+        pg_conn.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Migration completed successfully! {total_inserted} of {total_read} rows inserted "
+          f"in {elapsed:.1f}s ({total_read / elapsed if elapsed else 0:.0f} rows/s)")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the SQLite database into PostgreSQL.')
+    parser.add_argument('--sqlite', default='instance/lunch_track.db', help='SQLite database file')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'Rows per chunk (default {CHUNK_SIZE})')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoints of an earlier run')
+    args = parser.parse_args()
+
+    return 0 if migrate_sqlite_to_postgres(args.sqlite, args.chunk_size, args.restart) else 1
 
 if __name__ == "__main__":
-    migrate_sqlite_to_postgres()
+    sys.exit(main())
@@ -33,6 +33,24 @@ class DailyQRCode(db.Model):
     def __repr__(self):
         return f'<DailyQRCode {self.date}>'
 
+class DailyQRImage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    daily_qr_code_id = db.Column(db.Integer, db.ForeignKey('daily_qr_code.id'), nullable=False, unique=True)
+    image_data = db.Column(db.LargeBinary, nullable=False)
+    content_type = db.Column(db.String(50), nullable=False, default='image/png')
+    etag = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    daily_qr_code = db.relationship(
+        'DailyQRCode',
+        backref=db.backref('image', uselist=False, cascade='all, delete-orphan'),
+        lazy=True
+    )
+    
+    def __repr__(self):
+        return f'<DailyQRImage qr={self.daily_qr_code_id}>'
+
 class UserMealOptIn(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -47,6 +65,8 @@ class UserMealOptIn(db.Model):
     # Composite unique constraint
     __table_args__ = (
         db.UniqueConstraint('user_id', 'meal_type_id', 'date', name='unique_user_meal_date'),
+        # Per-date listings ordered by (meal type, user)
+        db.Index('ix_user_meal_opt_in_date_meal_user', 'date', 'meal_type_id', 'user_id'),
     )
     
     def __repr__(self):
@@ -84,3 +104,80 @@ class OptInSchedule(db.Model):
     
     def __repr__(self):
         return f'<OptInSchedule day={self.day_of_week} open={self.open_time} close={self.close_time}>'
+
+class CacheVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class StreamEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(100), nullable=False)
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<StreamEvent {self.id} {self.channel}>'
+
+class DailyMealCount(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    meal_type_id = db.Column(db.Integer, db.ForeignKey('meal_type.id'), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Composite unique constraint
+    __table_args__ = (
+        db.UniqueConstraint('date', 'meal_type_id', name='unique_date_meal'),
+    )
+    
+    def __repr__(self):
+        return f'<DailyMealCount date={self.date} meal={self.meal_type_id} count={self.count}>'
+
+class OptInSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, unique=True)
+    # Packed per-meal arrays of opted-in user ids and opt-in times (see snapshots.py)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<OptInSnapshot date={self.date}>'
+
+class MealRedemption(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    meal_type_id = db.Column(db.Integer, db.ForeignKey('meal_type.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    redeemed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Who confirmed the redemption, if not the user themselves
+    scanned_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    
+    # A meal can be served once per user and day
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'meal_type_id', 'date', name='unique_user_meal_redemption'),
+        db.Index('ix_meal_redemption_date_meal', 'date', 'meal_type_id'),
+    )
+    
+    def __repr__(self):
+        return f'<MealRedemption user={self.user_id} meal={self.meal_type_id} date={self.date}>'
+
+class RosterChange(db.Model):
+    # The id doubles as the roster version offline scanners sync from
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    meal_type_id = db.Column(db.Integer, db.ForeignKey('meal_type.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    opted_in = db.Column(db.Boolean, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_roster_change_date_meal_id', 'date', 'meal_type_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<RosterChange {self.id} date={self.date} meal={self.meal_type_id} user={self.user_id}>'
@@ -0,0 +1,107 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+
+from __init__ import db
+from models import UserMealOptIn, WeeklyOptIn
+from bitmaps import record_bitmap_changes
+from rollups import record_opt_in_change
+from roster import record_roster_changes
+from snapshots import discard_snapshots
+from sql_helpers import dialect_insert
+
+# WeeklyOptIn column for each weekday (0=Monday); weekends have none
+WEEKDAY_COLUMNS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+
+def set_opt_ins(user_id, changes):
+    """Set ``opted_in`` for many (meal_type_id, date) pairs of one user.
+
+    Safe under concurrent requests for the same rows: missing rows are
+    created with INSERT ... ON CONFLICT DO NOTHING, then a conditional
+    UPDATE flips only the rows whose value differs. The UPDATE locks each
+    row, so concurrent toggles apply one after the other, and its RETURNING
+    rows are exactly the changes the daily counts need. The timestamp is
+    only moved when the value actually changes.
+
+    Does not commit. Returns the set of (meal_type_id, date) keys that changed.
+    """
+    if not changes:
+        return set()
+
+    now = datetime.utcnow()
+    table = UserMealOptIn.__table__
+
+    # Sorted, so concurrent batches lock rows in the same order
+    keys = sorted(changes)
+    stmt = dialect_insert(table).values([
+        {
+            'user_id': user_id,
+            'meal_type_id': meal_type_id,
+            'date': for_date,
+            'opted_in': False,
+            'timestamp': now
+        }
+        for meal_type_id, for_date in keys
+    ])
+    db.session.execute(stmt.on_conflict_do_nothing(
+        index_elements=[table.c.user_id, table.c.meal_type_id, table.c.date]
+    ))
+
+    changed = set()
+    for opted_in in (True, False):
+        targets = [key for key in keys if changes[key] == opted_in]
+        if not targets:
+            continue
+
+        result = db.session.execute(
+            table.update()
+            .where(
+                table.c.user_id == user_id,
+                tuple_(table.c.meal_type_id, table.c.date).in_(targets),
+                # NULL counts as opted out
+                table.c.opted_in.is_distinct_from(True) if opted_in else table.c.opted_in == True
+            )
+            .values(opted_in=opted_in, timestamp=now)
+            .returning(table.c.meal_type_id, table.c.date)
+        )
+        for meal_type_id, for_date in result:
+            changed.add((meal_type_id, for_date))
+            # Rows created above start opted out, so a flip to False was opted in before
+            record_opt_in_change(for_date, meal_type_id, 1 if opted_in else -1)
+
+    changed_values = [
+        (user_id, meal_type_id, for_date, changes[(meal_type_id, for_date)])
+        for meal_type_id, for_date in sorted(changed)
+    ]
+    record_bitmap_changes(changed_values)
+    record_roster_changes(changed_values)
+
+    # Changes after the cutoff (overrides) make a frozen date stale
+    discard_snapshots({for_date for _, for_date in changed})
+    return changed
+
+def set_weekly_preferences(user_id, meal_type_id, days):
+    """Create or update a user's weekly preferences for one meal type.
+
+    Days missing from ``days`` keep their current value. Does not commit.
+    Returns the updated WeeklyOptIn row.
+    """
+    table = WeeklyOptIn.__table__
+    now = datetime.utcnow()
+    db.session.execute(
+        dialect_insert(table)
+        .values(user_id=user_id, meal_type_id=meal_type_id, created_at=now, updated_at=now,
+                **{day: False for day in WEEKDAY_COLUMNS})
+        .on_conflict_do_nothing(index_elements=[table.c.user_id, table.c.meal_type_id])
+    )
+
+    values = {day: bool(days[day]) for day in WEEKDAY_COLUMNS if day in days}
+    values['updated_at'] = now
+    db.session.execute(
+        table.update()
+        .where(table.c.user_id == user_id, table.c.meal_type_id == meal_type_id)
+        .values(**values)
+    )
+
+    return WeeklyOptIn.query.filter_by(user_id=user_id, meal_type_id=meal_type_id)\
+        .populate_existing()\
+        .one()
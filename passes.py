@@ -0,0 +1,99 @@
+"""Signed daily meal passes that can be verified without the database.
+
+A pass encodes a user id, a date and the bitmask of meal types the user is
+opted in to, followed by a truncated HMAC-SHA256 signature:
+
+    <key id>.<base64url(user_id, date, meal mask, signature)>
+
+MEAL_PASS_KEYS is a comma-separated list of ``key_id:secret`` pairs. The
+first key signs new passes and every key is accepted when verifying, so a
+key is rotated by putting a new one in front and dropping the old one once
+its passes have expired (a day later). Without it, passes are signed with
+key id ``0`` and SECRET_KEY as the secret; list ``0:<SECRET_KEY>`` after a
+new key to keep those passes valid during the first rotation.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+from collections import namedtuple
+from datetime import date
+from flask import current_app
+
+# user id, date ordinal, meal type bitmask
+_PAYLOAD = struct.Struct('>IIQ')
+_SIGNATURE_SIZE = 16
+
+# Meal type ids are bit positions in the 64-bit mask
+MAX_PASS_MEAL_TYPE_ID = 63
+
+MealPass = namedtuple('MealPass', ['user_id', 'date', 'meal_type_ids'])
+
+# Parsed keys, by the config values they were parsed from
+_keyrings = {}
+
+def _derive_key(secret):
+    return hmac.new(secret.encode(), b'meal-pass', hashlib.sha256).digest()
+
+def _get_keyring():
+    """Get (signing key id, {key id: key}) for the current app config"""
+    config = (current_app.config.get('MEAL_PASS_KEYS') or '', current_app.config['SECRET_KEY'])
+    keyring = _keyrings.get(config)
+    if keyring is None:
+        keys = {}
+        signing_key_id = None
+        for entry in config[0].split(','):
+            key_id, sep, secret = entry.strip().partition(':')
+            if not sep or not key_id or not secret or '.' in key_id:
+                continue
+            keys[key_id] = _derive_key(secret)
+            signing_key_id = signing_key_id or key_id
+        if not keys:
+            signing_key_id = '0'
+            keys[signing_key_id] = _derive_key(config[1])
+        keyring = _keyrings[config] = (signing_key_id, keys)
+    return keyring
+
+def _sign(key, payload):
+    return hmac.new(key, payload, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def issue_pass(user_id, for_date, meal_type_ids):
+    """Sign a pass for the meals a user is opted in to on ``for_date``"""
+    mask = 0
+    for meal_type_id in meal_type_ids:
+        if not 0 <= meal_type_id <= MAX_PASS_MEAL_TYPE_ID:
+            raise ValueError(f'Meal type id {meal_type_id} does not fit in a pass')
+        mask |= 1 << meal_type_id
+
+    key_id, keys = _get_keyring()
+    payload = _PAYLOAD.pack(user_id, for_date.toordinal(), mask)
+    return f"{key_id}.{_b64encode(payload + _sign(keys[key_id], payload))}"
+
+def verify_pass(token):
+    """Check a pass's signature and decode it, or return None if it isn't valid"""
+    key_id, sep, body = token.partition('.')
+    key = _get_keyring()[1].get(key_id)
+    if not sep or key is None:
+        return None
+
+    try:
+        data = _b64decode(body)
+    except (binascii.Error, ValueError):
+        return None
+    if len(data) != _PAYLOAD.size + _SIGNATURE_SIZE:
+        return None
+
+    payload, signature = data[:_PAYLOAD.size], data[_PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _sign(key, payload)):
+        return None
+
+    user_id, date_ordinal, mask = _PAYLOAD.unpack(payload)
+    meal_type_ids = tuple(i for i in range(MAX_PASS_MEAL_TYPE_ID + 1) if mask >> i & 1)
+    return MealPass(user_id, date.fromordinal(date_ordinal), meal_type_ids)
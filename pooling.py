@@ -0,0 +1,176 @@
+"""Database connection pool profiles and per-worker pool metrics.
+
+DB_POOL_PROFILE picks how each worker holds connections:
+
+- ``queue`` (default): a pool per worker sized to its threads, with
+  pre-ping and recycling so connections dropped while idle are replaced
+  instead of failing the next request. With DB_MAX_CONNECTIONS set, the
+  connections are split across WEB_CONCURRENCY workers so that all of them
+  together stay within the server's limit.
+- ``pgbouncer``: no pool in the worker; every checkout opens a connection
+  to PgBouncer, which does the pooling. Works with transaction pooling,
+  since the app keeps no session state (SET, prepared statements, advisory
+  locks) between transactions.
+- ``default``: SQLAlchemy's defaults, as before.
+"""
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+POOL_PROFILES = ('queue', 'pgbouncer', 'default')
+
+# Connections for the background threads (event poller, redemption flusher)
+BACKGROUND_CONNECTIONS = 2
+
+class PoolCounters:
+    """Connection and checkout counters of one engine's pool, kept across dispose()"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds, 6),
+                'wait_seconds_max': round(self.max_wait_seconds, 6)
+            }
+
+class PoolMetricsMixin:
+    """Counts checkouts and the time spent waiting for a connection.
+
+    Only public pool API is used: the connect/checkout/invalidate events,
+    the TimeoutError raised by connect() and the pool's status methods.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = PoolCounters()
+        # A recreated pool shares its predecessor's listeners and counters
+        if '_dispatch' not in kwargs:
+            event.listen(self, 'connect', self.counters.on_connect)
+            event.listen(self, 'checkout', self.counters.on_checkout)
+            event.listen(self, 'invalidate', self.counters.on_invalidate)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.counters = self.counters
+        return pool
+
+    def exhausted(self):
+        """Whether a checkout now would have to wait for a connection"""
+        return False
+
+    def connect(self):
+        exhausted = self.exhausted()
+        started = time.perf_counter()
+        counters = self.counters
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with counters.lock:
+                counters.timeouts += 1
+            raise
+        finally:
+            if exhausted:
+                waited = time.perf_counter() - started
+                with counters.lock:
+                    counters.waits += 1
+                    counters.wait_seconds += waited
+                    counters.max_wait_seconds = max(counters.max_wait_seconds, waited)
+
+    def metrics(self):
+        return self.counters.as_dict()
+
+class MeteredQueuePool(PoolMetricsMixin, QueuePool):
+    """QueuePool that also counts checkouts that had to wait for a free connection"""
+
+    def __init__(self, *args, max_overflow=10, **kwargs):
+        # Kept here since QueuePool has no public accessor for it
+        self.max_overflow = max_overflow
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+
+    def exhausted(self):
+        # No idle connection and no room to open another one
+        return self.checkedin() == 0 and self.max_overflow > -1 and self.overflow() >= self.max_overflow
+
+    def metrics(self):
+        result = super().metrics()
+        result.update({
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': self.overflow(),
+            'max_overflow': self.max_overflow,
+            'timeout': self.timeout()
+        })
+        return result
+
+class MeteredNullPool(PoolMetricsMixin, NullPool):
+    """NullPool with checkout counters, for when PgBouncer does the pooling"""
+
+def engine_options(profile, threads, workers=1, max_connections=None, recycle=1800, timeout=10):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for a pool profile.
+
+    ``threads`` and ``workers`` are the request threads per worker and the
+    number of workers; ``max_connections`` caps the connections of all
+    workers together. Raises ValueError for an unknown profile.
+    """
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"Unknown DB_POOL_PROFILE {profile!r}, expected one of {', '.join(POOL_PROFILES)}")
+
+    if profile == 'default':
+        return {}
+    if profile == 'pgbouncer':
+        return {'poolclass': MeteredNullPool}
+
+    pool_size = threads
+    max_overflow = BACKGROUND_CONNECTIONS
+    if max_connections:
+        per_worker = max(1, max_connections // max(1, workers))
+        pool_size = min(threads, per_worker)
+        max_overflow = per_worker - pool_size
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': timeout,
+        'pool_recycle': recycle,
+        'pool_pre_ping': True
+    }
+
+def pool_stats(engine):
+    """Describe an engine's pool: its class, status and, if metered, its counters"""
+    pool = engine.pool
+    stats = {
+        'class': type(pool).__name__,
+        'status': pool.status()
+    }
+    if isinstance(pool, PoolMetricsMixin):
+        stats.update(pool.metrics())
+    return stats
@@ -0,0 +1,177 @@
+"""Sampling profiler for individual requests.
+
+A request is profiled when an admin sends ``X-Profile: 1``, or at random
+with probability PROFILE_SAMPLE_RATE (optionally only for the endpoints in
+PROFILE_ENDPOINTS). While profiled requests are running, one sampler
+thread per worker records their stacks every PROFILE_INTERVAL_MS, so
+requests that aren't profiled pay nothing and profiled ones only pay for
+the samples.
+
+Each profile is written to PROFILE_DIR in the collapsed-stack format
+("outer;inner;leaf count" per line) that flamegraph.pl and speedscope read.
+Only the newest PROFILE_MAX_FILES files are kept.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SUFFIX = '.folded'
+
+class RequestProfiler:
+    """Samples the stacks of the request threads being profiled in this worker"""
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self.sample_rate = 0.0
+        self.endpoints = None
+        self.interval = 0.005
+        self.max_files = 100
+        self._lock = threading.Lock()
+        # thread id -> Counter of collapsed stacks
+        self._active = {}
+        self._sampler = None
+        self._wakeup = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        endpoints = app.config.get('PROFILE_ENDPOINTS')
+        self.endpoints = frozenset(e.strip() for e in endpoints.split(',') if e.strip()) if endpoints else None
+        self.interval = app.config.get('PROFILE_INTERVAL_MS', 5) / 1000
+        self.max_files = app.config.get('PROFILE_MAX_FILES', 100)
+        app.before_request(_start_profile)
+        app.after_request(_finish_profile)
+        app.teardown_request(_teardown_profile)
+
+    def should_profile(self):
+        if request.headers.get(PROFILE_HEADER) == '1' \
+                and current_user.is_authenticated and current_user.is_admin:
+            return True
+        if not self.sample_rate:
+            return False
+        if self.endpoints is not None and request.endpoint not in self.endpoints:
+            return False
+        return random.random() < self.sample_rate
+
+    def start(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = Counter()
+            # Started lazily so the thread lives in the forked worker
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._sampler.start()
+            self._wakeup.set()
+        return thread_id
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                thread_ids = list(self._active)
+                if not thread_ids:
+                    self._wakeup.clear()
+                    continue
+
+            frames = sys._current_frames()
+            stacks = {thread_id: _collapse(frames[thread_id]) for thread_id in thread_ids if thread_id in frames}
+            del frames
+            with self._lock:
+                for thread_id, stack in stacks.items():
+                    samples = self._active.get(thread_id)
+                    if samples is not None:
+                        samples[stack] += 1
+            time.sleep(self.interval)
+
+    def save(self, samples, endpoint, duration):
+        """Write one profile and drop the oldest files beyond PROFILE_MAX_FILES; returns its name"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}-{endpoint}-{round(duration * 1000)}ms{PROFILE_SUFFIX}"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+        profiles = self.list_profiles()
+        for old in profiles[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, old['name']))
+            except OSError:
+                pass
+        return name
+
+    def list_profiles(self):
+        """Get the stored profiles, newest first"""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(PROFILE_SUFFIX)]
+        except FileNotFoundError:
+            return []
+        profiles = []
+        for name in sorted(names, reverse=True):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            profiles.append({
+                'name': name,
+                'size': stat.st_size,
+                'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+            })
+        return profiles
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+def _collapse(frame):
+    """Format a stack as "outer;...;inner" """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+request_profiler = RequestProfiler()
+
+def _start_profile():
+    if request_profiler.should_profile():
+        g.profile_thread = request_profiler.start()
+        g.profile_started = time.perf_counter()
+
+def _save_profile():
+    thread_id = g.pop('profile_thread', None)
+    if thread_id is None:
+        return None
+    samples = request_profiler.stop(thread_id)
+    duration = time.perf_counter() - g.pop('profile_started')
+    try:
+        return request_profiler.save(samples, request.endpoint or 'unmatched', duration)
+    except OSError:
+        logger.exception("Writing a request profile failed")
+        return None
+
+def _finish_profile(response):
+    name = _save_profile()
+    if name:
+        response.headers['X-Profile-Id'] = name
+    return response
+
+def _teardown_profile(exception):
+    # Covers exceptions that skipped after_request
+    if 'profile_thread' in g:
+        _save_profile()
@@ -0,0 +1,42 @@
+import hashlib
+import os
+from io import BytesIO
+import qrcode
+import qrcode.image.svg
+
+from caching import LRUCache
+
+# Rendered per-user QR codes, keyed on everything the image depends on
+qr_code_cache = LRUCache('user_qr_code', int(os.environ.get('QR_CACHE_SIZE', 1024)))
+
+# Stored daily QR images, keyed on (date, token); a new token means a new image
+daily_qr_image_cache = LRUCache('daily_qr_image', 64)
+
+def _make_qr(data):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+def render_qr_png(data):
+    """Render a QR code for ``data`` as PNG bytes"""
+    img = _make_qr(data).make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def render_qr_svg(data):
+    """Render a QR code for ``data`` as SVG bytes"""
+    img = _make_qr(data).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    buffered = BytesIO()
+    img.save(buffered)
+    return buffered.getvalue()
+
+def content_etag(body):
+    """Strong ETag for a response body"""
+    return hashlib.sha256(body).hexdigest()[:32]
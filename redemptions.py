@@ -0,0 +1,266 @@
+"""Ledger of meals actually served, written behind the scan path.
+
+redeem() decides against this worker's in-memory view of a date's
+redemptions and queues the new row, so a scan never waits on a commit. A
+flusher thread bulk-inserts the queue every REDEMPTION_FLUSH_MS or as soon
+as REDEMPTION_BATCH_SIZE rows are waiting. When the database can't be
+reached the batch stays queued and is retried, up to REDEMPTION_MAX_PENDING
+rows, beyond which the oldest are dropped. Any other failure splits the
+batch in halves until the rows that can't be written are found; those are
+logged and dropped, so one bad row can't hold up the rest. The insert
+ignores rows that already exist, so at most one row is kept per (user, meal
+type, date). Queued rows are also flushed on shutdown; a worker that dies
+outright loses at most one flush interval.
+
+Each worker reloads a date's redemptions after REDEMPTION_MAX_STALENESS
+seconds. A second scan of the same meal in another worker within that
+window is accepted here but stored only once.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import func
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from __init__ import db
+from caching import register_cache
+from models import DailyMealCount, MealRedemption, UserMealOptIn
+from sql_helpers import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Dates whose redemptions each worker keeps in memory
+REDEMPTION_DATES = 7
+
+# Failures that say nothing about the rows, so the batch is kept and retried
+RETRYABLE_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+class RedemptionLedger:
+    """Per-worker view of redemptions plus the write-behind queue"""
+
+    def __init__(self, name):
+        self.name = name
+        self.app = None
+        self.flush_interval = 0.2
+        self.batch_size = 500
+        self.max_staleness = 5.0
+        self.max_pending = 50000
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # date -> (loaded_at, {user_id: {meal_type_id}}), least recently used first
+        self._redeemed = OrderedDict()
+        self._pending = []
+        self._flushing = []
+        self._flusher = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        register_cache(name, self)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('REDEMPTION_FLUSH_MS', 200) / 1000
+        self.batch_size = app.config.get('REDEMPTION_BATCH_SIZE', 500)
+        self.max_staleness = app.config.get('REDEMPTION_MAX_STALENESS', 5.0)
+        self.max_pending = app.config.get('REDEMPTION_MAX_PENDING', 50000)
+
+    def _load(self, for_date):
+        """Get the redeemed meal type ids of a date by user, reloading them when stale"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._redeemed.get(for_date)
+            if entry is not None and now - entry[0] < self.max_staleness:
+                self._redeemed.move_to_end(for_date)
+                return entry[1]
+            # Taken before the query, so a row flushed while it runs is in one or the other
+            queued = [
+                (row['user_id'], row['meal_type_id'])
+                for row in self._flushing + self._pending if row['date'] == for_date
+            ]
+
+        rows = db.session.query(MealRedemption.user_id, MealRedemption.meal_type_id)\
+            .filter(MealRedemption.date == for_date)\
+            .all()
+        with self._lock:
+            # Redemptions are never removed, so merge into the current view:
+            # it also holds the scans accepted here since the snapshot
+            entry = self._redeemed.get(for_date)
+            redeemed = entry[1] if entry is not None else {}
+            for user_id, meal_type_id in chain(rows, queued):
+                redeemed.setdefault(user_id, set()).add(meal_type_id)
+            self._redeemed[for_date] = (now, redeemed)
+            self._redeemed.move_to_end(for_date)
+            while len(self._redeemed) > REDEMPTION_DATES:
+                self._redeemed.popitem(last=False)
+            return redeemed
+
+    def redeemed_meal_type_ids(self, user_id, for_date):
+        """Get the ids of the meal types a user has redeemed on a date"""
+        redeemed = self._load(for_date)
+        with self._lock:
+            return set(redeemed.get(user_id, ()))
+
+    def redeem(self, user_id, meal_type_id, for_date, scanned_by=None, redeemed_at=None):
+        """Record that a meal was served; returns the time, or None if it already was"""
+        redeemed = self._load(for_date)
+        redeemed_at = redeemed_at or datetime.utcnow()
+        with self._lock:
+            meal_type_ids = redeemed.setdefault(user_id, set())
+            if meal_type_id in meal_type_ids:
+                self.duplicates += 1
+                return None
+            meal_type_ids.add(meal_type_id)
+            self._pending.append({
+                'user_id': user_id,
+                'meal_type_id': meal_type_id,
+                'date': for_date,
+                'redeemed_at': redeemed_at,
+                'scanned_by': scanned_by
+            })
+            self.accepted += 1
+
+            # Started lazily so the thread lives in the forked worker
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='redemption-flusher', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+        return redeemed_at
+
+    def _insert(self, rows):
+        table = MealRedemption.__table__
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(
+                    dialect_insert(table).values(rows).on_conflict_do_nothing(
+                        index_elements=[table.c.user_id, table.c.meal_type_id, table.c.date]
+                    )
+                )
+
+    def _write(self, rows):
+        """Insert rows, splitting them to isolate the ones that fail; returns (written, dropped).
+
+        RETRYABLE_ERRORS are raised, since splitting wouldn't help with them.
+        """
+        try:
+            self._insert(rows)
+            return len(rows), 0
+        except RETRYABLE_ERRORS:
+            raise
+        except Exception:
+            if len(rows) == 1:
+                logger.exception("Dropping a meal redemption that can't be written: %r", rows[0])
+                return 0, 1
+
+        middle = len(rows) // 2
+        written, dropped = self._write(rows[:middle])
+        more_written, more_dropped = self._write(rows[middle:])
+        return written + more_written, dropped + more_dropped
+
+    def flush(self):
+        """Write every queued redemption now; returns the number written"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._flushing = self._flushing + batch
+        if not batch:
+            return 0
+
+        in_batch = {id(row) for row in batch}
+        try:
+            written, dropped = self._write(batch)
+        except RETRYABLE_ERRORS:
+            logger.exception("Writing %d meal redemptions failed, keeping them queued", len(batch))
+            with self._lock:
+                self._flushing = [row for row in self._flushing if id(row) not in in_batch]
+                self._pending[:0] = batch
+                self.failures += 1
+                overflow = len(self._pending) - self.max_pending
+                if overflow > 0:
+                    del self._pending[:overflow]
+                    self.dropped += overflow
+            if overflow > 0:
+                logger.error("Dropped the %d oldest queued meal redemptions over REDEMPTION_MAX_PENDING", overflow)
+            return 0
+
+        with self._lock:
+            self._flushing = [row for row in self._flushing if id(row) not in in_batch]
+            self.flushed += written
+            self.dropped += dropped
+            self.batches += 1
+            if dropped:
+                self.failures += 1
+        return written
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._pending) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'dates': len(self._redeemed),
+                'pending': len(self._pending),
+                'accepted': self.accepted,
+                'duplicates': self.duplicates,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failures': self.failures,
+                'dropped': self.dropped
+            }
+
+redemption_ledger = RedemptionLedger('meal_redemptions')
+
+def reconciliation_report(start_date, end_date):
+    """Opted-in versus redeemed counts per day and meal type.
+
+    Opted-in counts come from the daily rollup; redeemed ones split into
+    opted-in users and walk-ins. Returns rows ordered by date and meal type.
+    """
+    report = {}
+    for for_date, meal_type_id, count in db.session.query(
+            DailyMealCount.date, DailyMealCount.meal_type_id, DailyMealCount.count
+        ).filter(DailyMealCount.date.between(start_date, end_date), DailyMealCount.count > 0):
+        report[(for_date, meal_type_id)] = {'opted_in': count, 'redeemed': 0, 'walk_ins': 0}
+
+    redeemed_rows = db.session.query(
+            MealRedemption.date,
+            MealRedemption.meal_type_id,
+            func.count(MealRedemption.id),
+            func.count(UserMealOptIn.id)
+        )\
+        .outerjoin(UserMealOptIn, db.and_(
+            UserMealOptIn.user_id == MealRedemption.user_id,
+            UserMealOptIn.meal_type_id == MealRedemption.meal_type_id,
+            UserMealOptIn.date == MealRedemption.date,
+            UserMealOptIn.opted_in == True
+        ))\
+        .filter(MealRedemption.date.between(start_date, end_date))\
+        .group_by(MealRedemption.date, MealRedemption.meal_type_id)
+    for for_date, meal_type_id, redeemed, redeemed_opted_in in redeemed_rows:
+        row = report.setdefault((for_date, meal_type_id), {'opted_in': 0, 'redeemed': 0, 'walk_ins': 0})
+        row['redeemed'] = redeemed
+        row['walk_ins'] = redeemed - redeemed_opted_in
+
+    return [
+        {
+            'date': for_date.isoformat(),
+            'meal_type_id': meal_type_id,
+            'opted_in': row['opted_in'],
+            'redeemed': row['redeemed'],
+            'walk_ins': row['walk_ins'],
+            'no_shows': row['opted_in'] - (row['redeemed'] - row['walk_ins'])
+        }
+        for (for_date, meal_type_id), row in sorted(report.items())
+    ]
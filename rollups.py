@@ -0,0 +1,136 @@
+"""Daily opted-in counts per meal type, kept in step with UserMealOptIn.
+
+Every write path that changes ``UserMealOptIn.opted_in`` calls
+record_opt_in_change() in the same transaction. The app fills the table
+at startup while it is still empty, so an upgraded deployment has its
+history right away. The table can be rebuilt from scratch and checked
+against the source rows from the command line:
+
+    python rollups.py rebuild [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python rollups.py check [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from __init__ import db
+from models import DailyMealCount, UserMealOptIn
+from sql_helpers import dialect_insert
+
+def record_opt_in_change(for_date, meal_type_id, delta):
+    """Add ``delta`` (+1 opted in, -1 opted out) to a day's count for a meal"""
+    if not delta:
+        return
+
+    table = DailyMealCount.__table__
+    stmt = dialect_insert(table).values(date=for_date, meal_type_id=meal_type_id, count=delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.date, table.c.meal_type_id],
+        set_={'count': table.c.count + stmt.excluded.count}
+    )
+    db.session.execute(stmt)
+
+def _source_counts(start_date=None, end_date=None):
+    query = select(
+            UserMealOptIn.date,
+            UserMealOptIn.meal_type_id,
+            func.count(UserMealOptIn.id).label('count')
+        )\
+        .where(UserMealOptIn.opted_in == True)\
+        .group_by(UserMealOptIn.date, UserMealOptIn.meal_type_id)
+
+    if start_date:
+        query = query.where(UserMealOptIn.date >= start_date)
+    if end_date:
+        query = query.where(UserMealOptIn.date <= end_date)
+    return query
+
+def _range_filter(query, start_date, end_date):
+    if start_date:
+        query = query.filter(DailyMealCount.date >= start_date)
+    if end_date:
+        query = query.filter(DailyMealCount.date <= end_date)
+    return query
+
+def rebuild_daily_counts(start_date=None, end_date=None):
+    """Recompute the counts for a date range (everything by default)"""
+    _range_filter(DailyMealCount.query, start_date, end_date).delete(synchronize_session=False)
+
+    table = DailyMealCount.__table__
+    db.session.execute(
+        table.insert().from_select(['date', 'meal_type_id', 'count'], _source_counts(start_date, end_date))
+    )
+    db.session.commit()
+
+def backfill_daily_counts():
+    """Build the counts when the table is empty but opt-ins exist; returns True if it did"""
+    if db.session.query(DailyMealCount.id).first() is not None:
+        return False
+    if db.session.query(UserMealOptIn.id).filter(UserMealOptIn.opted_in == True).first() is None:
+        return False
+
+    try:
+        rebuild_daily_counts()
+    except IntegrityError:
+        # Another worker starting at the same time built them first
+        db.session.rollback()
+        return False
+    return True
+
+def check_daily_counts(start_date=None, end_date=None):
+    """Compare the counts with UserMealOptIn and list every mismatch"""
+    expected = {
+        (row.date, row.meal_type_id): row.count
+        for row in db.session.execute(_source_counts(start_date, end_date))
+    }
+    actual = {
+        (row.date, row.meal_type_id): row.count
+        for row in _range_filter(DailyMealCount.query, start_date, end_date)
+    }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual)):
+        if expected.get(key, 0) != actual.get(key, 0):
+            mismatches.append({
+                'date': key[0].isoformat(),
+                'meal_type_id': key[1],
+                'expected': expected.get(key, 0),
+                'actual': actual.get(key, 0)
+            })
+    return mismatches
+
+def period_start(day, granularity):
+    """First day of the day/week/month period that contains ``day``"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the daily meal count rollup.')
+    parser.add_argument('command', choices=['rebuild', 'check'])
+    parser.add_argument('--start', help='First date (YYYY-MM-DD), default: no limit')
+    parser.add_argument('--end', help='Last date (YYYY-MM-DD), default: no limit')
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, '%Y-%m-%d').date() if args.start else None
+    end_date = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+
+    from app import app
+    with app.app_context():
+        if args.command == 'rebuild':
+            rebuild_daily_counts(start_date, end_date)
+            print("Daily meal counts rebuilt.")
+            return 0
+
+        mismatches = check_daily_counts(start_date, end_date)
+        for m in mismatches:
+            print(f"{m['date']} meal {m['meal_type_id']}: expected {m['expected']}, found {m['actual']}")
+        print(f"{len(mismatches)} mismatches found.")
+        return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
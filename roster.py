@@ -0,0 +1,115 @@
+"""Opted-in rosters for scanners that verify offline.
+
+Every opt-in change is appended to RosterChange, whose ids serve as
+roster versions. A scanner downloads the full roster of a date and meal
+type once, then asks only for the changes after the version it holds.
+
+Ids are assigned when a change is written, not when it commits, so a slow
+transaction can commit a lower id after a higher one was already sent. A
+returned version therefore never passes changes younger than
+ROSTER_SETTLE_SECONDS; those are sent again with the next delta, and
+replaying a change is harmless. Run daily to keep the log short:
+
+    python roster.py prune [--days N]
+
+deletes the changes of dates more than N days old (default 14).
+"""
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+
+from __init__ import db
+from models import RosterChange, User, UserMealOptIn
+
+ROSTER_RETENTION_DAYS = 14
+ROSTER_SETTLE_SECONDS = 10
+
+def record_roster_changes(changes):
+    """Append (user_id, meal_type_id, date, opted_in) changes to the log. Does not commit."""
+    rows = [
+        {'user_id': user_id, 'meal_type_id': meal_type_id, 'date': for_date, 'opted_in': opted_in}
+        for user_id, meal_type_id, for_date, opted_in in changes
+    ]
+    if rows:
+        db.session.execute(RosterChange.__table__.insert(), rows)
+
+def get_roster_version():
+    """Get the latest settled roster version (0 before any change)"""
+    settled_before = datetime.utcnow() - timedelta(seconds=ROSTER_SETTLE_SECONDS)
+    return db.session.query(func.max(RosterChange.id))\
+        .filter(RosterChange.created_at < settled_before)\
+        .scalar() or 0
+
+def get_full_roster(for_date, meal_type_id):
+    """Get (version, [(user_id, name)]) of everyone opted in to a meal on a date.
+
+    Changes committed while this runs are sent again with the next delta.
+    """
+    version = get_roster_version()
+    users = db.session.query(User.id, User.name)\
+        .join(UserMealOptIn, UserMealOptIn.user_id == User.id)\
+        .filter(
+            UserMealOptIn.date == for_date,
+            UserMealOptIn.meal_type_id == meal_type_id,
+            UserMealOptIn.opted_in == True
+        )\
+        .order_by(User.id)\
+        .all()
+    return version, [(u.id, u.name) for u in users]
+
+def get_roster_delta(for_date, meal_type_id, since):
+    """Get (version, added [(user_id, name)], removed [user_id]) after version ``since``"""
+    settled_before = datetime.utcnow() - timedelta(seconds=ROSTER_SETTLE_SECONDS)
+    rows = db.session.query(
+            RosterChange.id,
+            RosterChange.user_id,
+            RosterChange.opted_in,
+            RosterChange.created_at,
+            User.name
+        )\
+        .join(User, User.id == RosterChange.user_id)\
+        .filter(
+            RosterChange.date == for_date,
+            RosterChange.meal_type_id == meal_type_id,
+            RosterChange.id > since
+        )\
+        .order_by(RosterChange.id)\
+        .all()
+
+    # The last change per user wins; the version stops before unsettled changes
+    latest = {}
+    version = since
+    settled = True
+    for row in rows:
+        latest[row.user_id] = row
+        settled = settled and row.created_at < settled_before
+        if settled:
+            version = row.id
+
+    added = sorted((user_id, row.name) for user_id, row in latest.items() if row.opted_in)
+    removed = sorted(user_id for user_id, row in latest.items() if not row.opted_in)
+    return version, added, removed
+
+def prune_roster_changes(days=ROSTER_RETENTION_DAYS):
+    """Delete the changes of dates older than ``days`` days"""
+    deleted = RosterChange.query.filter(RosterChange.date < date.today() - timedelta(days=days))\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the roster change log.')
+    parser.add_argument('command', choices=['prune'])
+    parser.add_argument('--days', type=int, default=ROSTER_RETENTION_DAYS,
+                        help=f'Keep changes for dates this many days back (default {ROSTER_RETENTION_DAYS})')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        deleted = prune_roster_changes(args.days)
+        print(f"{deleted} roster changes deleted.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
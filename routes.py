@@ -1,20 +1,53 @@
 from datetime import datetime, date, time, timedelta
-from flask import Blueprint, request, jsonify, render_template, send_from_directory, current_app, url_for
+from itertools import islice
+from flask import Blueprint, Response, request, jsonify, render_template, send_from_directory, current_app, url_for, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
-import qrcode
-from io import BytesIO
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
 import base64
+import csv
+import hmac
+import json
 import os
 import uuid
 import pytz
 
 from __init__ import db
-from models import User, MealType, DailyQRCode, UserMealOptIn, WeeklyOptIn, OptInSchedule
+from models import User, DailyQRCode, DailyQRImage, UserMealOptIn, WeeklyOptIn, OptInSchedule, DailyMealCount
+from caching import cache_stats
+from pooling import pool_stats
+from metrics import metrics_registry
+from profiling import request_profiler, PROFILE_SUFFIX
+from slow_queries import slow_query_log
+from bitmaps import MAX_EXPRESSION_DEPTH, evaluate as evaluate_opt_ins, user_ids as bitmap_user_ids
+from meal_types import get_meal_type_registry, meal_type_cache
+from identity import load_user_snapshot
+from schedules import get_timeline, invalidate_schedules
+from events import event_hub, event_stream, opt_in_channel, daily_qr_channel, SCHEDULES_CHANNEL
+from rollups import period_start
+from redemptions import redemption_ledger, reconciliation_report
+from roster import get_full_roster, get_roster_delta
+from snapshots import get_frozen_day, freeze_date, discard_snapshots
+from verification import is_valid_daily_qr, get_user_meal_status, invalidate_daily_qr_tokens
+from passes import issue_pass, verify_pass
+from opt_ins import set_opt_ins, set_weekly_preferences, WEEKDAY_COLUMNS
+from qr_images import qr_code_cache, daily_qr_image_cache, render_qr_png, render_qr_svg, content_etag
 
 # Create blueprint
 main_bp = Blueprint('main', __name__)
 
+# Columns of /api/admin/export, and how many rows it fetches per round trip
+EXPORT_COLUMNS = ['date', 'meal_type', 'user_id', 'name', 'email', 'opt_in_time']
+EXPORT_CHUNK_SIZE = 1000
+
+# How long browsers may reuse /api/meals before revalidating it
+MEAL_TYPES_MAX_AGE = 300
+
+# Page sizes of /api/admin/opted-meals
+OPTED_MEALS_PAGE_SIZE = 500
+OPTED_MEALS_MAX_PAGE_SIZE = 2000
+
 # Routes
 @main_bp.route('/')
 def index():
@@ -81,29 +114,68 @@ def opt_in():
 @main_bp.route('/api/qr-code', methods=['GET'])
 @login_required
 def get_qr_code():
-    # Generate QR code with the verification URL
-    verification_url = f"{request.host_url}api/verify/{current_user.id}"
-    
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(verification_url)
-    qr.make(fit=True)
+    """Get the current user's QR code as base64 JSON, raw PNG or SVG.
+    
+    With variant=pass, the code holds a signed meal pass for ``date``
+    (default today) instead, available once opt-in for that date has closed.
+    """
+    image_format = request.args.get('format', 'json')
+    if image_format not in ('json', 'png', 'svg'):
+        return jsonify({'success': False, 'message': 'Invalid format. Use json, png or svg.'}), 400
+    
+    variant = request.args.get('variant', 'user')
+    if variant == 'pass':
+        date_str = request.args.get('date')
+        try:
+            pass_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else get_ist_now().date()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        
+        if not is_opt_in_final(pass_date):
+            return jsonify({
+                'success': False,
+                'message': 'Meal passes are available once opt-in for the date has closed'
+            }), 409
+        
+        meal_type_ids = [
+            meal_type_id for (meal_type_id,) in db.session.query(UserMealOptIn.meal_type_id).filter(
+                UserMealOptIn.user_id == current_user.id,
+                UserMealOptIn.date == pass_date,
+                UserMealOptIn.opted_in == True
+            )
+        ]
+        pass_token = issue_pass(current_user.id, pass_date, meal_type_ids)
+        verification_url = f"{request.host_url}api/verify-pass/{pass_token}"
+    elif variant == 'user':
+        # Generate QR code with the verification URL
+        verification_url = f"{request.host_url}api/verify/{current_user.id}"
+    else:
+        return jsonify({'success': False, 'message': 'Invalid variant. Use user or pass.'}), 400
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    def render():
+        if image_format == 'svg':
+            body = render_qr_svg(verification_url)
+        else:
+            body = render_qr_png(verification_url)
+        
+        if image_format == 'json':
+            # Convert to base64 for embedding in HTML
+            img_str = base64.b64encode(body).decode()
+            body = current_app.json.dumps({
+                'qr_code': f"data:image/png;base64,{img_str}",
+                'verification_url': verification_url
+            }).encode()
+        
+        return body, content_etag(body)
     
-    # Convert to base64 for embedding in HTML
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    # The image only depends on the URL it encodes, so render it once
+    body, etag = qr_code_cache.get_or_create((verification_url, image_format), render)
     
-    return jsonify({
-        'qr_code': f"data:image/png;base64,{img_str}",
-        'verification_url': verification_url
-    })
+    mimetypes = {'json': 'application/json', 'png': 'image/png', 'svg': 'image/svg+xml'}
+    response = Response(body, mimetype=mimetypes[image_format])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 # Legacy verify route - redirects to new verification system
 @main_bp.route('/api/verify/<int:user_id>', methods=['GET'])
@@ -155,9 +227,92 @@ def export_csv():
     
     return jsonify({
         'success': False,
-        'message': 'This endpoint is deprecated. Please use the export feature in the admin dashboard.'
+        'message': 'This endpoint is deprecated. Please use /api/admin/export instead.'
     }), 400
 
+class _EchoBuffer:
+    """File-like object whose write() hands the data straight back, for csv.writer"""
+    def write(self, value):
+        return value
+
+@main_bp.route('/api/admin/export', methods=['GET'])
+@login_required
+def export_opt_ins():
+    """Stream opted-in meals for a date range as CSV or NDJSON"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    # Get date range, default to today
+    try:
+        start_date_str = request.args.get('start_date')
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else date.today()
+        end_date_str = request.args.get('end_date')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else start_date
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Invalid format. Use csv or ndjson.'}), 400
+    
+    # Get meal type filter if provided, checked before streaming starts
+    meal_types = get_meal_type_registry()
+    meal_type_id = None
+    if request.args.get('meal_type_id'):
+        meal_type = meal_types.find(request.args.get('meal_type_id'))
+        if not meal_type:
+            return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+        meal_type_id = meal_type.id
+    
+    # Plain columns only, fetched through a server-side cursor in chunks
+    query = db.select(
+            UserMealOptIn.date,
+            UserMealOptIn.meal_type_id,
+            User.id.label('user_id'),
+            User.name,
+            User.email,
+            UserMealOptIn.timestamp
+        )\
+        .join(User, User.id == UserMealOptIn.user_id)\
+        .where(
+            UserMealOptIn.date.between(start_date, end_date),
+            UserMealOptIn.opted_in == True
+        )\
+        .order_by(UserMealOptIn.date, UserMealOptIn.meal_type_id, UserMealOptIn.user_id)\
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    
+    if meal_type_id:
+        query = query.where(UserMealOptIn.meal_type_id == meal_type_id)
+    
+    def generate_rows():
+        for row in db.session.execute(query):
+            yield {
+                'date': row.date.isoformat(),
+                'meal_type': meal_types.name(row.meal_type_id),
+                'user_id': row.user_id,
+                'name': row.name,
+                'email': row.email,
+                'opt_in_time': row.timestamp.isoformat() if row.timestamp else ''
+            }
+    
+    if export_format == 'csv':
+        def generate():
+            writer = csv.writer(_EchoBuffer())
+            yield writer.writerow(EXPORT_COLUMNS)
+            for row in generate_rows():
+                yield writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        mimetype = 'text/csv'
+    else:
+        def generate():
+            for row in generate_rows():
+                yield json.dumps(row) + '\n'
+        mimetype = 'application/x-ndjson'
+    
+    filename = f"meal-opt-ins-{start_date.isoformat()}-{end_date.isoformat()}.{export_format}"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
 # Helper functions for meal opt-in system
 def get_ist_now():
     """Get current datetime in IST timezone"""
@@ -168,50 +323,43 @@ def get_ist_now():
 
 def is_opt_in_open(target_date=None):
     """Check if opt-in is currently open for the given date"""
-    # Always get fresh schedule data from the database
-    db.session.expire_all()  # Invalidate any cached data
-    
     ist_now = get_ist_now()
     
     # Default to checking for tomorrow if no date specified
     if target_date is None:
         target_date = (ist_now + timedelta(days=1)).date()
     
-    # Get day of week (0=Monday, 6=Sunday)
-    today_dow = ist_now.weekday()
-    target_dow = target_date.weekday()
-    
-    # Get current time
-    current_time = ist_now.time()
-    
-    # Check if it's a weekend
-    is_weekend = today_dow >= 4  # Friday, Saturday, Sunday
-    
-    if is_weekend:
-        # Weekend rules
-        weekend_schedule = OptInSchedule.query.filter_by(is_weekend_rule=True).first()
-        if weekend_schedule:
-            # Friday 8 PM to Sunday 4 PM for weekend meals
-            if today_dow == 4:  # Friday
-                # After 8 PM on Friday
-                return current_time >= weekend_schedule.open_time
-            elif today_dow == 5:  # Saturday
-                # All day Saturday
-                return True
-            elif today_dow == 6:  # Sunday
-                # Before 4 PM on Sunday
-                return current_time < weekend_schedule.close_time
-    else:
-        # Weekday rules
-        weekday_schedule = OptInSchedule.query.filter_by(day_of_week=today_dow, is_weekend_rule=False).first()
-        if weekday_schedule:
-            # 8 PM to 9 AM next day
-            if current_time >= weekday_schedule.open_time or current_time < weekday_schedule.close_time:
-                # Check if target date is tomorrow
-                tomorrow = (ist_now + timedelta(days=1)).date()
-                return target_date == tomorrow
+    return get_timeline(ist_now).is_open(target_date, ist_now)
+
+def is_opt_in_final(target_date):
+    """Check if opt-in for the given date has closed and won't reopen"""
+    ist_now = get_ist_now()
+    
+    # Only dates up to tomorrow are settled enough to look this far ahead
+    if target_date > ist_now.date() + timedelta(days=1):
+        return False
     
-    return False
+    return get_timeline(ist_now).is_final(target_date, ist_now)
+
+def get_open_opt_in_dates():
+    """Get all target dates whose opt-in window is currently open"""
+    ist_now = get_ist_now()
+    return get_timeline(ist_now).open_dates(ist_now)
+
+def get_next_opt_in_transition(target_date):
+    """Get when the opt-in window for the given date next opens or closes"""
+    ist_now = get_ist_now()
+    return get_timeline(ist_now).next_transition(ist_now, target_date)
+
+def build_daily_qr_image(qr_code):
+    """Render the PNG for a daily QR code, ready to be stored with it"""
+    verification_url = f"{request.host_url}verify-meal/{qr_code.date.isoformat()}/{qr_code.token}"
+    png = render_qr_png(verification_url)
+    return DailyQRImage(image_data=png, content_type='image/png', etag=content_etag(png))
+
+def daily_qr_image_url(qr_code):
+    """URL of the stored image for a daily QR code (changes with the token)"""
+    return url_for('main.get_daily_qr_image', date_str=qr_code.date.isoformat(), token=qr_code.token)
 
 def generate_daily_qr_code(for_date=None):
     """Generate QR code for a specific date"""
@@ -226,55 +374,55 @@ def generate_daily_qr_code(for_date=None):
     # Generate a unique token
     token = str(uuid.uuid4())
     
-    # Create verification URL
-    verification_url = f"{request.host_url}verify-meal/{for_date.isoformat()}/{token}"
-    
-    # Generate QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(verification_url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Create directory for QR codes if it doesn't exist
-    qr_dir = os.path.join(current_app.static_folder, 'qr_codes')
-    if not os.path.exists(qr_dir):
-        os.makedirs(qr_dir)
-    
-    # Save QR code image
-    filename = f"qr_{for_date.isoformat()}.png"
-    filepath = os.path.join(qr_dir, filename)
-    img.save(filepath)
-    
-    # Save to database
-    relative_path = f"qr_codes/{filename}"
+    # Save to database, image included, so every instance can serve it
     new_qr = DailyQRCode(
         date=for_date,
-        qr_image_path=relative_path,
         token=token,
         created_at=datetime.utcnow()
     )
-    
+    new_qr.image = build_daily_qr_image(new_qr)
     db.session.add(new_qr)
-    db.session.commit()
+    
+    try:
+        # Flushes the insert, so a duplicate date can already fail here
+        invalidate_daily_qr_tokens()
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request generated the code for this date first
+        db.session.rollback()
+        return DailyQRCode.query.filter_by(date=for_date).one()
     
     return new_qr
 
 # New meal opt-in routes
+# Largest number of items accepted by /api/meals/opt-in/batch
+MAX_OPT_IN_BATCH = 100
+
+# Offline scans accepted per upload
+MAX_SCAN_BATCH = 500
+
+# Users listed by /api/admin/analytics with include_users
+ANALYTICS_USERS_LIMIT = 100
+ANALYTICS_MAX_USERS_LIMIT = 1000
+
+# Days, starting today, covered by /api/me/dashboard
+DASHBOARD_DAYS = 7
+DASHBOARD_MAX_DAYS = 14
+
 @main_bp.route('/api/meals', methods=['GET'])
 @login_required
 def get_meal_types():
     """Get all available meal types"""
-    meal_types = MealType.query.all()
-    return jsonify({
+    meal_types = get_meal_type_registry()
+    response = jsonify({
         'success': True,
         'meal_types': [{'id': m.id, 'name': m.name} for m in meal_types]
     })
+    
+    # Meal types almost never change; let browsers reuse and revalidate them
+    response.set_etag(meal_types.etag)
+    response.headers['Cache-Control'] = f"private, max-age={MEAL_TYPES_MAX_AGE}"
+    return response.make_conditional(request)
 
 @main_bp.route('/api/meals/opt-in-status', methods=['GET'])
 @login_required
@@ -288,11 +436,15 @@ def get_opt_in_status():
         except ValueError:
             return jsonify({'success': False, 'message': 'Invalid date format'}), 400
     else:
-        # Default to tomorrow
-        target_date = (get_ist_now() + timedelta(days=1)).date()
+        # Default to the earliest date open for opt-in, or tomorrow if none is
+        open_dates = get_open_opt_in_dates()
+        if open_dates:
+            target_date = min(open_dates)
+        else:
+            target_date = (get_ist_now() + timedelta(days=1)).date()
     
     # Get all meal types
-    meal_types = MealType.query.all()
+    meal_types = get_meal_type_registry()
     
     # Get user's opt-ins for the target date
     user_opt_ins = UserMealOptIn.query.filter_by(
@@ -303,8 +455,9 @@ def get_opt_in_status():
     # Create a map of meal_type_id to opt_in status
     opt_in_map = {oi.meal_type_id: oi.opted_in for oi in user_opt_ins}
     
-    # Check if opt-in is currently open
+    # Check if opt-in is currently open, and until when
     is_open = is_opt_in_open(target_date)
+    next_transition = get_next_opt_in_transition(target_date)
     
     # Format response
     meals_data = []
@@ -320,6 +473,7 @@ def get_opt_in_status():
         'success': True,
         'date': target_date.isoformat(),
         'is_opt_in_open': is_open,
+        'next_transition': next_transition.isoformat() if next_transition else None,
         'meals': meals_data
     })
 
@@ -333,9 +487,10 @@ def meal_opt_in():
     opted_in = data.get('opted_in', False)
     
     # Validate meal type
-    meal_type = MealType.query.get(meal_type_id)
+    meal_type = get_meal_type_registry().find(meal_type_id)
     if not meal_type:
         return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+    meal_type_id = meal_type.id
     
     # Parse date
     try:
@@ -350,28 +505,18 @@ def meal_opt_in():
             'message': 'Opt-in is closed for this date'
         }), 403
     
-    # Get or create user meal opt-in record
-    user_opt_in = UserMealOptIn.query.filter_by(
-        user_id=current_user.id,
-        meal_type_id=meal_type_id,
-        date=target_date
-    ).first()
-    
-    if user_opt_in:
-        user_opt_in.opted_in = opted_in
-        user_opt_in.timestamp = datetime.utcnow()
-    else:
-        user_opt_in = UserMealOptIn(
-            user_id=current_user.id,
-            meal_type_id=meal_type_id,
-            date=target_date,
-            opted_in=opted_in,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(user_opt_in)
-    
+    # Race-free upsert; double clicks and retries just find nothing to change
+    opted_in = bool(opted_in)
+    changed = set_opt_ins(current_user.id, {(meal_type_id, target_date): opted_in})
     db.session.commit()
     
+    if changed:
+        event_hub.publish(opt_in_channel(current_user.id, target_date), 'opt-in', {
+            'meal_type_id': meal_type_id,
+            'date': target_date.isoformat(),
+            'opted_in': opted_in
+        })
+    
     return jsonify({
         'success': True,
         'meal_type_id': meal_type_id,
@@ -379,6 +524,75 @@ def meal_opt_in():
         'opted_in': opted_in
     })
 
+@main_bp.route('/api/meals/opt-in/batch', methods=['POST'])
+@login_required
+def meal_opt_in_batch():
+    """Opt in/out for many (meal, date) pairs in one transaction"""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'items must be a non-empty list'}), 400
+    if len(items) > MAX_OPT_IN_BATCH:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_OPT_IN_BATCH} items are allowed per batch'
+        }), 400
+    
+    # Validate everything in memory against the cached meal types and timeline
+    meal_types = get_meal_type_registry()
+    open_dates = get_open_opt_in_dates()
+    
+    results = []
+    changes = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'message': 'Invalid item'})
+            continue
+        
+        meal_type = meal_types.find(item.get('meal_type_id'))
+        opted_in = bool(item.get('opted_in', False))
+        if not meal_type:
+            results.append({'index': index, 'success': False, 'message': 'Invalid meal type'})
+            continue
+        meal_type_id = meal_type.id
+        
+        try:
+            target_date = datetime.strptime(item.get('date'), '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            results.append({'index': index, 'success': False, 'message': 'Invalid date format'})
+            continue
+        
+        if target_date not in open_dates:
+            results.append({'index': index, 'success': False, 'message': 'Opt-in is closed for this date'})
+            continue
+        
+        # The last item for the same meal and date wins
+        changes[(meal_type_id, target_date)] = opted_in
+        results.append({
+            'index': index,
+            'success': True,
+            'meal_type_id': meal_type_id,
+            'date': target_date.isoformat(),
+            'opted_in': opted_in
+        })
+    
+    if changes:
+        changed = set_opt_ins(current_user.id, changes)
+        db.session.commit()
+        
+        for meal_type_id, target_date in sorted(changed):
+            event_hub.publish(opt_in_channel(current_user.id, target_date), 'opt-in', {
+                'meal_type_id': meal_type_id,
+                'date': target_date.isoformat(),
+                'opted_in': changes[(meal_type_id, target_date)]
+            })
+    
+    return jsonify({
+        'success': True,
+        'applied': len(changes),
+        'results': results
+    })
+
 @main_bp.route('/api/meals/weekly-opt-in', methods=['POST'])
 @login_required
 def weekly_opt_in():
@@ -388,80 +602,40 @@ def weekly_opt_in():
     days = data.get('days', {})
     
     # Validate meal type
-    meal_type = MealType.query.get(meal_type_id)
+    meal_type = get_meal_type_registry().find(meal_type_id)
     if not meal_type:
         return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+    meal_type_id = meal_type.id
     
-    # Get or create weekly opt-in record
-    weekly = WeeklyOptIn.query.filter_by(
-        user_id=current_user.id,
-        meal_type_id=meal_type_id
-    ).first()
-    
-    if not weekly:
-        weekly = WeeklyOptIn(
-            user_id=current_user.id,
-            meal_type_id=meal_type_id
-        )
-        db.session.add(weekly)
-    
-    # Update days
-    weekly.monday = days.get('monday', weekly.monday)
-    weekly.tuesday = days.get('tuesday', weekly.tuesday)
-    weekly.wednesday = days.get('wednesday', weekly.wednesday)
-    weekly.thursday = days.get('thursday', weekly.thursday)
-    weekly.friday = days.get('friday', weekly.friday)
-    weekly.updated_at = datetime.utcnow()
-    
-    db.session.commit()
+    # Create or update the weekly preferences
+    weekly = set_weekly_preferences(current_user.id, meal_type_id, days)
     
     # Apply weekly preferences to future dates that are open for opt-in
     ist_now = get_ist_now()
-    for i in range(1, 6):  # Look ahead 5 days
+    open_dates = get_open_opt_in_dates()
+    changes = {}
+    for i in range(0, 6):  # Today (before the morning cutoff) and 5 days ahead
         future_date = (ist_now + timedelta(days=i)).date()
         future_dow = future_date.weekday()  # 0=Monday, 6=Sunday
         
         # Skip weekends
-        if future_dow > 4:  # Saturday or Sunday
+        if future_dow >= len(WEEKDAY_COLUMNS):  # Saturday or Sunday
             continue
         
-        # Check if this day is selected in weekly preferences
-        is_selected = False
-        if future_dow == 0 and weekly.monday:
-            is_selected = True
-        elif future_dow == 1 and weekly.tuesday:
-            is_selected = True
-        elif future_dow == 2 and weekly.wednesday:
-            is_selected = True
-        elif future_dow == 3 and weekly.thursday:
-            is_selected = True
-        elif future_dow == 4 and weekly.friday:
-            is_selected = True
-        
-        # Check if opt-in is open for this date
-        if is_selected and is_opt_in_open(future_date):
-            # Get or create user meal opt-in record
-            user_opt_in = UserMealOptIn.query.filter_by(
-                user_id=current_user.id,
-                meal_type_id=meal_type_id,
-                date=future_date
-            ).first()
-            
-            if user_opt_in:
-                user_opt_in.opted_in = True
-                user_opt_in.timestamp = datetime.utcnow()
-            else:
-                user_opt_in = UserMealOptIn(
-                    user_id=current_user.id,
-                    meal_type_id=meal_type_id,
-                    date=future_date,
-                    opted_in=True,
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(user_opt_in)
+        # Check if this day is selected and opt-in is open for this date
+        if getattr(weekly, WEEKDAY_COLUMNS[future_dow]) and future_date in open_dates:
+            changes[(meal_type_id, future_date)] = True
     
+    changed = set_opt_ins(current_user.id, changes)
     db.session.commit()
     
+    for _, applied_date in sorted(changed):
+        event_hub.publish(opt_in_channel(current_user.id, applied_date), 'opt-in', {
+            'meal_type_id': meal_type_id,
+            'date': applied_date.isoformat(),
+            'opted_in': True
+        })
+    
     return jsonify({
         'success': True,
         'meal_type_id': meal_type_id,
@@ -474,47 +648,94 @@ def weekly_opt_in():
         }
     })
 
+def get_weekly_preferences(user_id, meal_types):
+    """Get a user's weekly preferences for every meal type with one query"""
+    rows = db.session.query(
+            WeeklyOptIn.meal_type_id,
+            *(getattr(WeeklyOptIn, day) for day in WEEKDAY_COLUMNS)
+        )\
+        .filter(WeeklyOptIn.user_id == user_id)\
+        .all()
+    days_by_meal = {row.meal_type_id: row for row in rows}
+    
+    result = []
+    for meal in meal_types:
+        weekly = days_by_meal.get(meal.id)
+        result.append({
+            'meal_type_id': meal.id,
+            'name': meal.name,
+            'days': {day: bool(weekly and getattr(weekly, day)) for day in WEEKDAY_COLUMNS}
+        })
+    return result
+
 @main_bp.route('/api/meals/weekly-status', methods=['GET'])
 @login_required
 def get_weekly_status():
     """Get weekly opt-in preferences for current user"""
-    meal_types = MealType.query.all()
-    result = []
+    meal_types = get_meal_type_registry()
     
-    for meal in meal_types:
-        weekly = WeeklyOptIn.query.filter_by(
-            user_id=current_user.id,
-            meal_type_id=meal.id
-        ).first()
-        
-        if weekly:
-            result.append({
-                'meal_type_id': meal.id,
-                'name': meal.name,
-                'days': {
-                    'monday': weekly.monday,
-                    'tuesday': weekly.tuesday,
-                    'wednesday': weekly.wednesday,
-                    'thursday': weekly.thursday,
-                    'friday': weekly.friday
-                }
-            })
-        else:
-            result.append({
-                'meal_type_id': meal.id,
-                'name': meal.name,
-                'days': {
-                    'monday': False,
-                    'tuesday': False,
-                    'wednesday': False,
-                    'thursday': False,
-                    'friday': False
+    return jsonify({
+        'success': True,
+        'weekly_preferences': get_weekly_preferences(current_user.id, meal_types)
+    })
+
+@main_bp.route('/api/me/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    """Get everything the opt-in page needs in one request"""
+    try:
+        days = int(request.args.get('days', DASHBOARD_DAYS))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid days'}), 400
+    days = max(1, min(days, DASHBOARD_MAX_DAYS))
+    
+    # Meal types and opt-in windows come from caches; only the two
+    # per-user queries below hit the database, however many meal types exist
+    meal_types = get_meal_type_registry()
+    ist_now = get_ist_now()
+    timeline = get_timeline(ist_now)
+    open_dates = timeline.open_dates(ist_now)
+    
+    first_date = ist_now.date()
+    last_date = first_date + timedelta(days=days - 1)
+    default_date = min(open_dates) if open_dates else first_date + timedelta(days=1)
+    
+    opt_in_rows = db.session.query(
+            UserMealOptIn.date,
+            UserMealOptIn.meal_type_id,
+            UserMealOptIn.opted_in
+        )\
+        .filter(
+            UserMealOptIn.user_id == current_user.id,
+            UserMealOptIn.date.between(first_date, last_date)
+        )\
+        .all()
+    opt_in_map = {(row.date, row.meal_type_id): bool(row.opted_in) for row in opt_in_rows}
+    
+    days_data = []
+    for offset in range(days):
+        day = first_date + timedelta(days=offset)
+        next_transition = timeline.next_transition(ist_now, day)
+        days_data.append({
+            'date': day.isoformat(),
+            'is_opt_in_open': day in open_dates,
+            'next_transition': next_transition.isoformat() if next_transition else None,
+            'meals': [
+                {
+                    'meal_type_id': meal.id,
+                    'name': meal.name,
+                    'opted_in': opt_in_map.get((day, meal.id), False)
                 }
-            })
+                for meal in meal_types
+            ]
+        })
     
     return jsonify({
         'success': True,
-        'weekly_preferences': result
+        'date': default_date.isoformat(),
+        'meal_types': [{'id': m.id, 'name': m.name} for m in meal_types],
+        'days': days_data,
+        'weekly_preferences': get_weekly_preferences(current_user.id, meal_types)
     })
 
 # Daily QR code routes
@@ -524,6 +745,16 @@ def verify_meal(date_str, token):
     # Render the verification page
     return render_template('index.html')
 
+def get_scanned_user_id(user_id=None):
+    """Get the user a scan is for: the given or ``user_id`` query parameter, else the current user"""
+    user_id = user_id or request.args.get('user_id')
+    if not user_id:
+        return current_user.id if current_user.is_authenticated else None
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
 @main_bp.route('/api/verify-meal/<date_str>/<token>', methods=['GET'])
 def api_verify_meal(date_str, token):
     """API endpoint for meal verification"""
@@ -532,21 +763,15 @@ def api_verify_meal(date_str, token):
     except ValueError:
         return jsonify({'success': False, 'message': 'Invalid date format'}), 400
     
-    # Find QR code for this date and token
-    qr_code = DailyQRCode.query.filter_by(date=verify_date, token=token).first()
-    if not qr_code:
+    # Check the token against the cached daily codes
+    if not is_valid_daily_qr(verify_date, token):
         return jsonify({'success': False, 'message': 'Invalid QR code'}), 404
     
-    # Get user ID from request if available
-    user_id = request.args.get('user_id')
-    user = None
-    
-    if user_id:
-        user = User.query.get(user_id)
-    elif current_user.is_authenticated:
-        user = current_user
+    # User and opt-ins for the date in one query
+    user_id = get_scanned_user_id()
+    status = get_user_meal_status(user_id, verify_date) if user_id else None
     
-    if not user:
+    if not status:
         return jsonify({
             'success': True,
             'date': verify_date.isoformat(),
@@ -554,38 +779,155 @@ def api_verify_meal(date_str, token):
             'requires_login': True
         })
     
-    # Get user's meal opt-ins for this date
-    user_opt_ins = UserMealOptIn.query.filter_by(
-        user_id=user.id,
-        date=verify_date
-    ).all()
-    
-    # Get all meal types
-    meal_types = MealType.query.all()
-    
-    # Create a map of meal_type_id to opt_in status
-    opt_in_map = {oi.meal_type_id: oi.opted_in for oi in user_opt_ins}
+    user_name, user_email, opt_in_map = status
+    redeemed = redemption_ledger.redeemed_meal_type_ids(user_id, verify_date)
     
     # Format response
     meals_data = []
-    for meal in meal_types:
-        opted_in = opt_in_map.get(meal.id, False)
+    for meal in get_meal_type_registry():
         meals_data.append({
             'meal_type_id': meal.id,
             'name': meal.name,
-            'opted_in': opted_in
+            'opted_in': opt_in_map.get(meal.id, False),
+            'redeemed': meal.id in redeemed
         })
     
     return jsonify({
         'success': True,
         'date': verify_date.isoformat(),
         'user': {
-            'name': user.name,
-            'email': user.email
+            'name': user_name,
+            'email': user_email
         },
         'meals': meals_data
     })
 
+@main_bp.route('/api/verify-meal/<date_str>/<token>/redeem', methods=['POST'])
+@login_required
+def redeem_meal(date_str, token):
+    """Record a meal as served at the counter; each meal can be redeemed once"""
+    try:
+        verify_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    if not is_valid_daily_qr(verify_date, token):
+        return jsonify({'success': False, 'message': 'Invalid QR code'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    meal_type = get_meal_type_registry().find(data.get('meal_type_id'))
+    if not meal_type:
+        return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+    
+    # Staff may redeem for someone else, everyone else only for themselves
+    user_id = get_scanned_user_id(data.get('user_id'))
+    if user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    status = get_user_meal_status(user_id, verify_date) if user_id else None
+    if not status:
+        return jsonify({'success': False, 'message': 'User not found'}), 404
+    
+    # Queued for a batched write, so this never waits on a commit
+    redeemed_at = redemption_ledger.redeem(
+        user_id, meal_type.id, verify_date,
+        scanned_by=current_user.id if current_user.id != user_id else None
+    )
+    if not redeemed_at:
+        return jsonify({
+            'success': False,
+            'message': f"{meal_type.name} has already been redeemed"
+        }), 409
+    
+    return jsonify({
+        'success': True,
+        'date': verify_date.isoformat(),
+        'meal_type_id': meal_type.id,
+        'opted_in': status[2].get(meal_type.id, False),
+        'redeemed_at': redeemed_at.isoformat()
+    })
+
+@main_bp.route('/api/verify-pass/<pass_token>', methods=['GET'])
+def api_verify_pass(pass_token):
+    """Verify a signed meal pass without looking anything up in the database"""
+    meal_pass = verify_pass(pass_token)
+    if not meal_pass:
+        return jsonify({'success': False, 'message': 'Invalid pass'}), 404
+    
+    date_str = request.args.get('date')
+    try:
+        verify_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else get_ist_now().date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    if meal_pass.date != verify_date:
+        return jsonify({
+            'success': False,
+            'message': f"This pass is for {meal_pass.date.isoformat()}"
+        }), 409
+    
+    # Names come from the registry this worker last loaded, if any: checking
+    # whether it is current would query the database
+    meal_types = meal_type_cache.peek()
+    meal_type_ids = set(meal_pass.meal_type_ids).union(meal_types.by_id if meal_types else ())
+    meals_data = []
+    for meal_type_id in sorted(meal_type_ids):
+        meals_data.append({
+            'meal_type_id': meal_type_id,
+            'name': meal_types.name(meal_type_id) if meal_types else None,
+            'opted_in': meal_type_id in meal_pass.meal_type_ids
+        })
+    
+    return jsonify({
+        'success': True,
+        'date': meal_pass.date.isoformat(),
+        'user_id': meal_pass.user_id,
+        'meals': meals_data
+    })
+
+# Push updates
+@main_bp.route('/api/events', methods=['GET'])
+@login_required
+def stream_events():
+    """Server-Sent Events stream of changes relevant to one date"""
+    date_str = request.args.get('date')
+    if date_str:
+        try:
+            target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    else:
+        target_date = get_ist_now().date()
+    
+    channels = [
+        opt_in_channel(current_user.id, target_date),
+        daily_qr_channel(target_date),
+        SCHEDULES_CHANNEL
+    ]
+    
+    # Each stream holds a request thread, so only a few may be open per
+    # worker; the others refetch and retry later
+    if not event_hub.acquire_stream():
+        response = jsonify({'success': False, 'message': 'Too many open event streams, retry later'})
+        response.headers['Retry-After'] = str(current_app.config['SSE_MAX_STREAM_SECONDS'])
+        return response, 503
+    
+    # The stream must not hold a database connection while it is open
+    db.session.close()
+    
+    stream = event_stream(
+        channels,
+        current_app.config['SSE_HEARTBEAT_SECONDS'],
+        current_app.config['SSE_MAX_STREAM_SECONDS']
+    )
+    response = Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs even if the client goes away before the first message
+    response.call_on_close(event_hub.release_stream)
+    return response
+
 # Enhanced admin routes
 @main_bp.route('/api/admin/daily-qr', methods=['GET'])
 @login_required
@@ -610,7 +952,7 @@ def get_daily_qr():
         qr_code = generate_daily_qr_code(target_date)
     
     # Generate URL for QR code image
-    qr_image_url = url_for('static', filename=qr_code.qr_image_path)
+    qr_image_url = daily_qr_image_url(qr_code)
     verification_url = f"{request.host_url}verify-meal/{target_date.isoformat()}/{qr_code.token}"
     
     return jsonify({
@@ -620,6 +962,44 @@ def get_daily_qr():
         'verification_url': verification_url
     })
 
+@main_bp.route('/api/admin/daily-qr/<date_str>/<token>.png', methods=['GET'])
+@login_required
+def get_daily_qr_image(date_str, token):
+    """Serve the stored image of a daily QR code"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    # A (date, token) pair always maps to the same image, so cache it per worker
+    cached = daily_qr_image_cache.get((target_date, token))
+    if cached is None:
+        qr_code = DailyQRCode.query.filter_by(date=target_date, token=token).first()
+        if not qr_code:
+            return jsonify({'success': False, 'message': 'QR code not found'}), 404
+        
+        # Codes generated before images were stored in the database
+        if qr_code.image is None:
+            qr_code.image = build_daily_qr_image(qr_code)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                qr_code = DailyQRCode.query.filter_by(date=target_date, token=token).one()
+        
+        image = qr_code.image
+        cached = (image.image_data, image.content_type, image.etag)
+        daily_qr_image_cache.put((target_date, token), cached)
+    
+    image_data, content_type, etag = cached
+    response = Response(image_data, mimetype=content_type)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response.make_conditional(request)
+
 @main_bp.route('/api/admin/regenerate-qr', methods=['POST'])
 @login_required
 def regenerate_daily_qr():
@@ -635,23 +1015,25 @@ def regenerate_daily_qr():
     except (ValueError, TypeError):
         return jsonify({'success': False, 'message': 'Invalid date format'}), 400
     
-    # Delete existing QR code if it exists
+    # Delete existing QR code (and its stored image) if it exists
     existing_qr = DailyQRCode.query.filter_by(date=target_date).first()
     if existing_qr:
-        # Delete the image file if it exists
+        # Delete the image file left by older versions if it exists
         if existing_qr.qr_image_path:
             file_path = os.path.join(current_app.static_folder, existing_qr.qr_image_path)
             if os.path.exists(file_path):
                 os.remove(file_path)
         
         db.session.delete(existing_qr)
+        invalidate_daily_qr_tokens()
         db.session.commit()
     
     # Generate new QR code
     new_qr = generate_daily_qr_code(target_date)
+    event_hub.publish(daily_qr_channel(target_date), 'daily-qr', {'date': target_date.isoformat()})
     
     # Generate URL for QR code image
-    qr_image_url = url_for('static', filename=new_qr.qr_image_path)
+    qr_image_url = daily_qr_image_url(new_qr)
     verification_url = f"{request.host_url}verify-meal/{target_date.isoformat()}/{new_qr.token}"
     
     return jsonify({
@@ -662,6 +1044,26 @@ def regenerate_daily_qr():
         'message': 'QR code regenerated successfully'
     })
 
+def query_opted_meals(target_date, meal_type_id, after, limit):
+    """Get opted-in users of a date as plain rows, ordered by the (meal type, user) key"""
+    query = db.session.query(
+            UserMealOptIn.meal_type_id,
+            User.id,
+            User.name,
+            User.email,
+            UserMealOptIn.timestamp
+        )\
+        .join(User, User.id == UserMealOptIn.user_id)\
+        .filter(UserMealOptIn.date == target_date, UserMealOptIn.opted_in == True)\
+        .order_by(UserMealOptIn.meal_type_id, UserMealOptIn.user_id)
+    
+    if meal_type_id:
+        query = query.filter(UserMealOptIn.meal_type_id == meal_type_id)
+    if after:
+        query = query.filter(tuple_(UserMealOptIn.meal_type_id, UserMealOptIn.user_id) > tuple_(*after))
+    
+    return query.limit(limit).all()
+
 @main_bp.route('/api/admin/opted-meals', methods=['GET'])
 @login_required
 def get_opted_meals():
@@ -682,38 +1084,137 @@ def get_opted_meals():
     # Get meal type filter if provided
     meal_type_id = request.args.get('meal_type_id')
     
-    # Query for opted-in users
-    query = db.session.query(User, UserMealOptIn, MealType)\
-        .join(UserMealOptIn, User.id == UserMealOptIn.user_id)\
-        .join(MealType, UserMealOptIn.meal_type_id == MealType.id)\
-        .filter(UserMealOptIn.date == target_date, UserMealOptIn.opted_in == True)
-    
+    meal_types = get_meal_type_registry()
+    frozen = get_frozen_day(target_date)
     if meal_type_id:
-        query = query.filter(UserMealOptIn.meal_type_id == meal_type_id)
+        try:
+            meal_type_id = int(meal_type_id)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+    
+    # Per-meal totals from the frozen snapshot, or else the daily rollup
+    if frozen:
+        totals = {
+            meal_id: frozen.count(meal_id)
+            for meal_id in frozen.meals
+            if frozen.count(meal_id) and (not meal_type_id or meal_id == meal_type_id)
+        }
+    else:
+        totals_query = db.session.query(DailyMealCount.meal_type_id, DailyMealCount.count)\
+            .filter(DailyMealCount.date == target_date, DailyMealCount.count > 0)\
+            .order_by(DailyMealCount.meal_type_id)
+        if meal_type_id:
+            totals_query = totals_query.filter(DailyMealCount.meal_type_id == meal_type_id)
+        totals = dict(totals_query.all())
+    
+    if request.args.get('counts_only', '').lower() in ('1', 'true', 'yes'):
+        return jsonify({
+            'success': True,
+            'date': target_date.isoformat(),
+            'meal_types': [
+                {'id': meal_id, 'name': meal_types.name(meal_id), 'count': count}
+                for meal_id, count in totals.items()
+            ]
+        })
     
-    results = query.all()
+    try:
+        limit = min(int(request.args.get('limit', OPTED_MEALS_PAGE_SIZE)), OPTED_MEALS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    if limit < 1:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    
+    # Keyset pagination: continue right after the last (meal type, user) returned
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = tuple(int(part) for part in cursor.split(':'))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        if len(after) != 2:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    # One extra row tells whether there is another page
+    next_cursor = None
+    if frozen:
+        # Page through the frozen user ids, then fetch just those users
+        entries = list(islice(frozen.entries(meal_type_id or None, after), limit + 1))
+        if len(entries) > limit:
+            entries = entries[:limit]
+            # Taken before deleted users are dropped, so a short page still has a cursor
+            next_cursor = f"{entries[-1][0]}:{entries[-1][1]}"
+        users = {
+            row.id: row for row in db.session.query(User.id, User.name, User.email)
+            .filter(User.id.in_({user_id for _, user_id, _ in entries}))
+        } if entries else {}
+        results = [
+            (meal_id, user_id, users[user_id].name, users[user_id].email, timestamp)
+            for meal_id, user_id, timestamp in entries if user_id in users
+        ]
+    else:
+        results = query_opted_meals(target_date, meal_type_id, after, limit + 1)
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = f"{results[-1][0]}:{results[-1][1]}"
     
     # Organize results by meal type
-    meal_types = {}
-    for user, opt_in, meal_type in results:
-        if meal_type.id not in meal_types:
-            meal_types[meal_type.id] = {
-                'id': meal_type.id,
-                'name': meal_type.name,
+    opted_meals = {}
+    for meal_id, user_id, user_name, user_email, timestamp in results:
+        if meal_id not in opted_meals:
+            opted_meals[meal_id] = {
+                'id': meal_id,
+                'name': meal_types.name(meal_id),
+                'total': totals.get(meal_id, 0),
                 'users': []
             }
         
-        meal_types[meal_type.id]['users'].append({
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'opt_in_time': opt_in.timestamp.isoformat() if opt_in.timestamp else None
+        opted_meals[meal_id]['users'].append({
+            'id': user_id,
+            'name': user_name,
+            'email': user_email,
+            'opt_in_time': timestamp.isoformat() if timestamp else None
         })
     
     return jsonify({
         'success': True,
         'date': target_date.isoformat(),
-        'meal_types': list(meal_types.values())
+        'meal_types': list(opted_meals.values()),
+        'next_cursor': next_cursor
+    })
+
+@main_bp.route('/api/admin/snapshots/<date_str>', methods=['POST', 'DELETE'])
+@login_required
+def manage_snapshot(date_str):
+    """Freeze a date's opt-ins after the cutoff, or discard its snapshot"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    if request.method == 'DELETE':
+        discarded = discard_snapshots([target_date], force=True)
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'date': target_date.isoformat(),
+            'message': 'Snapshot discarded' if discarded else 'No snapshot for this date'
+        })
+    
+    if not is_opt_in_final(target_date):
+        return jsonify({'success': False, 'message': 'Opt-in for this date has not closed yet'}), 409
+    
+    frozen = freeze_date(target_date)
+    return jsonify({
+        'success': True,
+        'date': target_date.isoformat(),
+        'meal_types': [
+            {'id': meal_id, 'count': frozen.count(meal_id)}
+            for meal_id in frozen.meals
+        ]
     })
 
 @main_bp.route('/api/admin/schedules', methods=['GET'])
@@ -778,9 +1279,12 @@ def update_schedule(schedule_id):
     # Update schedule
     schedule.open_time = open_time
     schedule.close_time = close_time
+    invalidate_schedules()
     
     db.session.commit()
     
+    event_hub.publish(SCHEDULES_CHANNEL, 'schedules', {'schedule_id': schedule.id})
+    
     return jsonify({
         'success': True,
         'schedule': {
@@ -793,60 +1297,326 @@ def update_schedule(schedule_id):
         }
     })
 
+@main_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request and database metrics of all workers in the Prometheus text format"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/api/admin/slow-queries', methods=['GET', 'DELETE'])
+@login_required
+def slow_queries():
+    """Get this worker's slow query fingerprints by total time, or clear them"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    if request.method == 'DELETE':
+        slow_query_log.reset()
+        return jsonify({'success': True, 'message': 'Slow query log cleared'})
+    
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'threshold_ms': current_app.config['SLOW_QUERY_MS'],
+        'plans_captured': slow_query_log.explained,
+        'plan_failures': slow_query_log.explain_failures,
+        'queries': slow_query_log.report()
+    })
+
+@main_bp.route('/api/admin/profiles', methods=['GET'])
+@login_required
+def list_profiles():
+    """List the stored request profiles, newest first"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    return jsonify({
+        'success': True,
+        'profiles': request_profiler.list_profiles()
+    })
+
+@main_bp.route('/api/admin/profiles/<name>', methods=['GET'])
+@login_required
+def download_profile(name):
+    """Download one request profile as collapsed stacks"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    if not name.endswith(PROFILE_SUFFIX):
+        return jsonify({'success': False, 'message': 'Profile not found'}), 404
+    
+    return send_from_directory(request_profiler.directory, name, mimetype='text/plain', as_attachment=True)
+
+@main_bp.route('/api/admin/pool-stats', methods=['GET'])
+@login_required
+def get_pool_stats():
+    """Get this worker's database connection pool usage and wait counters"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'profile': current_app.config['DB_POOL_PROFILE'],
+        'pool': pool_stats(db.engine)
+    })
+
+@main_bp.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """Get hit/miss counters for this worker's in-process caches"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'caches': cache_stats()
+    })
+
+@main_bp.route('/api/admin/analytics', methods=['POST'])
+@login_required
+def run_analytics():
+    """Count (and optionally list) the users matching a set expression over opt-ins"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        data = request.get_json(silent=True) or {}
+    except RecursionError:
+        # The JSON decoder gives up on very deep nesting before the depth check runs
+        return jsonify({'success': False, 'message': f'An expression may nest at most {MAX_EXPRESSION_DEPTH} levels'}), 400
+    try:
+        limit = min(int(data.get('limit', ANALYTICS_USERS_LIMIT)), ANALYTICS_MAX_USERS_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    
+    try:
+        result = evaluate_opt_ins(data.get('expr'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    response = {
+        'success': True,
+        'count': result.bit_count()
+    }
+    
+    if data.get('include_users'):
+        ids = list(islice(bitmap_user_ids(result), limit))
+        users = db.session.query(User.id, User.name, User.email)\
+            .filter(User.id.in_(ids))\
+            .order_by(User.id)\
+            .all() if ids else []
+        response['users'] = [{'id': u.id, 'name': u.name, 'email': u.email} for u in users]
+    
+    return jsonify(response)
+
+@main_bp.route('/api/admin/roster', methods=['GET'])
+@login_required
+def get_roster():
+    """Get the opted-in users of a meal for offline scanning, in full or since a version"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    date_str = request.args.get('date')
+    try:
+        target_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else get_ist_now().date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    meal_type = get_meal_type_registry().find(request.args.get('meal_type_id'))
+    if not meal_type:
+        return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+    
+    response = {
+        'success': True,
+        'date': target_date.isoformat(),
+        'meal_type_id': meal_type.id
+    }
+    
+    since = request.args.get('since')
+    if since:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid version'}), 400
+        version, added, removed = get_roster_delta(target_date, meal_type.id, since)
+        response.update({'full': False, 'version': version, 'added': added, 'removed': removed})
+    else:
+        version, users = get_full_roster(target_date, meal_type.id)
+        response.update({'full': True, 'version': version, 'users': users})
+    
+    return jsonify(response)
+
+@main_bp.route('/api/admin/scans', methods=['POST'])
+@login_required
+def upload_scans():
+    """Record a batch of scans made offline; uploading the same scan again is harmless"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    scans = data.get('scans')
+    if not isinstance(scans, list) or not scans:
+        return jsonify({'success': False, 'message': 'No scans provided'}), 400
+    if len(scans) > MAX_SCAN_BATCH:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_SCAN_BATCH} scans are allowed per batch'
+        }), 400
+    
+    meal_types = get_meal_type_registry()
+    results = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            results.append({'index': index, 'status': 'invalid', 'message': 'Invalid scan'})
+            continue
+        
+        meal_type = meal_types.find(scan.get('meal_type_id'))
+        try:
+            user_id = int(scan.get('user_id'))
+            scan_date = datetime.strptime(scan.get('date'), '%Y-%m-%d').date()
+            scanned_at = datetime.fromisoformat(scan['scanned_at'].replace('Z', '+00:00')) \
+                if scan.get('scanned_at') else None
+        except (AttributeError, TypeError, ValueError):
+            results.append({'index': index, 'status': 'invalid', 'message': 'Invalid user, date or time'})
+            continue
+        if not meal_type:
+            results.append({'index': index, 'status': 'invalid', 'message': 'Invalid meal type'})
+            continue
+        if not load_user_snapshot(user_id):
+            results.append({'index': index, 'status': 'invalid', 'message': 'User not found'})
+            continue
+        
+        # Stored as naive UTC like every other timestamp
+        if scanned_at and scanned_at.tzinfo:
+            scanned_at = scanned_at.astimezone(pytz.utc).replace(tzinfo=None)
+        
+        redeemed_at = redemption_ledger.redeem(
+            user_id, meal_type.id, scan_date,
+            scanned_by=current_user.id,
+            redeemed_at=scanned_at
+        )
+        results.append({'index': index, 'status': 'recorded' if redeemed_at else 'duplicate'})
+    
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
+@main_bp.route('/api/admin/reconciliation', methods=['GET'])
+@login_required
+def get_reconciliation():
+    """Get opted-in versus redeemed meals per day (default: past 2 weeks)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        end_date_str = request.args.get('end_date')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else date.today()
+        start_date_str = request.args.get('start_date')
+        if start_date_str:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = end_date - timedelta(days=13)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    # Recent scans may still be queued in this worker
+    redemption_ledger.flush()
+    
+    meal_types = get_meal_type_registry()
+    report = reconciliation_report(start_date, end_date)
+    for row in report:
+        row['name'] = meal_types.name(row['meal_type_id'])
+    
+    return jsonify({
+        'success': True,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'report': report
+    })
+
 @main_bp.route('/api/admin/historical-data', methods=['GET'])
 @login_required
 def get_historical_data():
-    """Get historical data for the past 2 months"""
+    """Get opt-in counts per day, week or month (default: past 2 months by day)"""
     if not current_user.is_admin:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
-    # Calculate date range (today - 2 months)
-    end_date = date.today()
-    start_date = end_date - timedelta(days=60)  # Approximately 2 months
+    # Calculate date range (default: today - 2 months)
+    try:
+        end_date_str = request.args.get('end_date')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else date.today()
+        start_date_str = request.args.get('start_date')
+        if start_date_str:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = end_date - timedelta(days=60)  # Approximately 2 months
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
     
-    # Get meal type filter if provided
-    meal_type_id = request.args.get('meal_type_id')
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'success': False, 'message': 'Invalid granularity. Use day, week or month.'}), 400
     
-    # Query for historical data
+    # Get meal type filter if provided
+    meal_types = get_meal_type_registry()
+    meal_type_id = None
+    if request.args.get('meal_type_id'):
+        meal_type = meal_types.find(request.args.get('meal_type_id'))
+        if not meal_type:
+            return jsonify({'success': False, 'message': 'Invalid meal type'}), 400
+        meal_type_id = meal_type.id
+    
+    # Read the precomputed daily counts instead of scanning UserMealOptIn
     query = db.session.query(
-            UserMealOptIn.date,
-            MealType.id,
-            MealType.name,
-            db.func.count(UserMealOptIn.id).label('total_opt_ins')
+            DailyMealCount.date,
+            DailyMealCount.meal_type_id,
+            DailyMealCount.count
         )\
-        .join(MealType, UserMealOptIn.meal_type_id == MealType.id)\
         .filter(
-            UserMealOptIn.date.between(start_date, end_date),
-            UserMealOptIn.opted_in == True
+            DailyMealCount.date.between(start_date, end_date),
+            DailyMealCount.count > 0
         )\
-        .group_by(UserMealOptIn.date, MealType.id, MealType.name)
+        .order_by(DailyMealCount.date, DailyMealCount.meal_type_id)
     
     if meal_type_id:
-        query = query.filter(UserMealOptIn.meal_type_id == meal_type_id)
+        query = query.filter(DailyMealCount.meal_type_id == meal_type_id)
     
     results = query.all()
     
-    # Organize results by date
+    # Organize results by period
     historical_data = {}
-    for result_date, meal_id, meal_name, count in results:
-        date_str = result_date.isoformat()
+    for result_date, meal_id, count in results:
+        date_str = period_start(result_date, granularity).isoformat()
         if date_str not in historical_data:
             historical_data[date_str] = {
                 'date': date_str,
-                'meals': []
+                'meals': {}
             }
         
-        historical_data[date_str]['meals'].append({
-            'meal_type_id': meal_id,
-            'name': meal_name,
-            'count': count
-        })
+        meals = historical_data[date_str]['meals']
+        if meal_id not in meals:
+            meals[meal_id] = {
+                'meal_type_id': meal_id,
+                'name': meal_types.name(meal_id),
+                'count': 0
+            }
+        meals[meal_id]['count'] += count
     
     return jsonify({
         'success': True,
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
-        'data': list(historical_data.values())
+        'granularity': granularity,
+        'data': [
+            {'date': period['date'], 'meals': list(period['meals'].values())}
+            for period in historical_data.values()
+        ]
     })
 
 # Serve React static files
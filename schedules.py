@@ -0,0 +1,164 @@
+from bisect import bisect_right
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+import pytz
+
+from caching import VersionedCache, bump_cache_version
+from models import OptInSchedule
+
+SCHEDULE_CACHE = 'opt_in_schedule'
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Rolling horizon of a compiled timeline: from yesterday to this many days ahead
+TIMELINE_DAYS = 14
+# Recompile once fewer than this many days of look-ahead are left
+TIMELINE_MIN_LOOKAHEAD = timedelta(days=7)
+
+# Detached, immutable copy of an OptInSchedule row
+ScheduleRule = namedtuple('ScheduleRule', ['id', 'day_of_week', 'open_time', 'close_time', 'is_weekend_rule'])
+
+def load_schedule_rules():
+    """Load all opt-in schedules as an immutable snapshot"""
+    schedules = OptInSchedule.query.order_by(OptInSchedule.id).all()
+    return tuple(
+        ScheduleRule(s.id, s.day_of_week, s.open_time, s.close_time, s.is_weekend_rule)
+        for s in schedules
+    )
+
+schedule_cache = VersionedCache(SCHEDULE_CACHE, load_schedule_rules)
+
+def get_schedule_rules():
+    """Get the cached opt-in schedules"""
+    return schedule_cache.get()
+
+def invalidate_schedules():
+    """Mark the opt-in schedules as changed in every worker"""
+    bump_cache_version(SCHEDULE_CACHE)
+
+class OptInTimeline:
+    """Opt-in windows compiled into absolute IST change points.
+
+    ``points`` is the sorted list of instants at which the set of open target
+    dates changes. ``open_sets[i]`` is the set of target dates open from
+    ``points[i - 1]`` (inclusive) up to ``points[i]``, so every lookup is a
+    single binary search.
+    """
+
+    def __init__(self, rules, windows, start, end):
+        self.rules = rules
+        self.start = start
+        self.end = end
+
+        # Sweep over open/close events, counting overlapping windows per date
+        events = []
+        for opens_at, closes_at, target_dates in windows:
+            events.append((opens_at, 1, target_dates))
+            events.append((closes_at, -1, target_dates))
+        events.sort(key=lambda e: e[0])
+
+        self.points = []
+        self.open_sets = [frozenset()]
+        counts = Counter()
+        for when, delta, target_dates in events:
+            for target_date in target_dates:
+                counts[target_date] += delta
+            open_set = frozenset(d for d, n in counts.items() if n > 0)
+            if self.points and self.points[-1] == when:
+                self.open_sets[-1] = open_set
+            elif open_set != self.open_sets[-1]:
+                self.points.append(when)
+                self.open_sets.append(open_set)
+
+    def covers(self, at):
+        """Check if ``at`` is inside the horizon with enough look-ahead left"""
+        return self.start <= at and at + TIMELINE_MIN_LOOKAHEAD <= self.end
+
+    def open_dates(self, at):
+        """Get the target dates whose opt-in window is open at ``at``"""
+        return self.open_sets[bisect_right(self.points, at)]
+
+    def is_open(self, target_date, at):
+        """Check if opt-in for ``target_date`` is open at ``at``"""
+        return target_date in self.open_dates(at)
+
+    def is_final(self, target_date, at):
+        """Check if opt-in for ``target_date`` is closed at ``at`` and won't reopen.
+
+        Only meaningful for dates whose windows fall inside the horizon.
+        """
+        return not self.is_open(target_date, at) and self.next_transition(at, target_date) is None
+
+    def next_transition(self, at, target_date=None):
+        """Get the next time the window for ``target_date`` opens or closes.
+
+        Without a target date, returns the next time any window changes.
+        Returns None if nothing changes within the compiled horizon.
+        """
+        index = bisect_right(self.points, at)
+        if target_date is None:
+            return self.points[index] if index < len(self.points) else None
+        
+        was_open = target_date in self.open_sets[index]
+        for i in range(index, len(self.points)):
+            if (target_date in self.open_sets[i + 1]) != was_open:
+                return self.points[i]
+        return None
+
+def _at(day, time_of_day):
+    return IST.localize(datetime.combine(day, time_of_day))
+
+def compile_timeline(rules, start_date, days=TIMELINE_DAYS):
+    """Compile schedule rules into an OptInTimeline starting at ``start_date``.
+
+    A weekday rule for day D opens at ``open_time`` on D and closes at the
+    next ``close_time`` (on D + 1 when it is not later than ``open_time``),
+    for the meals of D + 1. The first weekend rule covers Saturday, Sunday
+    and the following Monday: it opens at ``open_time`` the day before its
+    ``day_of_week`` and closes at ``close_time`` the day after, or at the end
+    of the target date if that is earlier. Any other weekend rule only marks
+    a closed period and opens no window.
+    """
+    weekday_rules = [r for r in rules if not r.is_weekend_rule]
+    weekend_rule = next((r for r in rules if r.is_weekend_rule), None)
+
+    windows = []
+    # Start early so windows that opened before start_date are included
+    for offset in range(-2, days + 1):
+        day = start_date + timedelta(days=offset)
+        dow = day.weekday()
+        
+        for rule in weekday_rules:
+            if rule.day_of_week != dow:
+                continue
+            close_day = day + timedelta(days=1) if rule.close_time <= rule.open_time else day
+            windows.append((
+                _at(day, rule.open_time),
+                _at(close_day, rule.close_time),
+                (day + timedelta(days=1),)
+            ))
+        
+        if weekend_rule and weekend_rule.day_of_week == dow:
+            opens_at = _at(day - timedelta(days=1), weekend_rule.open_time)
+            closes_at = _at(day + timedelta(days=1), weekend_rule.close_time)
+            for i in range(3):
+                # A date never stays open once it has passed
+                target_date = day + timedelta(days=i)
+                date_ends_at = _at(target_date + timedelta(days=1), datetime.min.time())
+                windows.append((opens_at, min(closes_at, date_ends_at), (target_date,)))
+    
+    start = _at(start_date, datetime.min.time())
+    end = start + timedelta(days=days)
+    return OptInTimeline(rules, windows, start, end)
+
+_timeline = None
+
+def get_timeline(at):
+    """Get the compiled timeline for the cached schedules around ``at``"""
+    global _timeline
+    rules = get_schedule_rules()
+    timeline = _timeline
+    if timeline is None or timeline.rules is not rules or not timeline.covers(at):
+        timeline = compile_timeline(rules, at.date() - timedelta(days=1))
+        _timeline = timeline
+    return timeline
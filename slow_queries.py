@@ -0,0 +1,202 @@
+"""Slow query log with query fingerprints and captured plans.
+
+Every statement is timed with engine events. Statements slower than
+SLOW_QUERY_MS are logged with their normalized SQL, the shape of their
+bind parameters (types only, never values) and the endpoint that ran them,
+and are added up per fingerprint: the normalized SQL, with literals and
+placeholders replaced by ``?`` and IN lists collapsed, so that the same
+query with other values counts as one shape.
+
+On PostgreSQL the plan of a slow SELECT is captured with
+``EXPLAIN (ANALYZE, BUFFERS)`` by a background thread, at most once per
+fingerprint every SLOW_QUERY_EXPLAIN_INTERVAL seconds, so the request that
+ran the query doesn't wait for it. Statements other than SELECT are never
+explained, since ANALYZE executes them.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from __init__ import db
+
+logger = logging.getLogger(__name__)
+
+# Fingerprints kept per worker, least recently seen dropped first
+SLOW_QUERY_MAX_FINGERPRINTS = 500
+
+# Plans waiting to be captured; more slow queries than this are not explained
+EXPLAIN_QUEUE_SIZE = 20
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<![:\w]):[A-Za-z_]\w*|\$\d+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+def fingerprint(statement):
+    """Normalize SQL so that statements differing only in values look the same"""
+    sql = _STRING.sub('?', statement)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    sql = _ROWS.sub(r'\1', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+def parameter_shape(parameters, executemany=False):
+    """Describe bind parameters by type, e.g. {date_1: date, id_1: int}"""
+    if executemany:
+        rows = list(parameters or ())
+        return f"{len(rows)} x {parameter_shape(rows[0]) if rows else '[]'}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '[' + ', '.join(type(value).__name__ for value in parameters) + ']'
+    return type(parameters).__name__
+
+class SlowQueryLog:
+    """Slow statements of this worker, aggregated by fingerprint"""
+
+    def __init__(self):
+        self.app = None
+        self.threshold = 0.25
+        self.explain = True
+        self.explain_interval = 300.0
+        self._lock = threading.Lock()
+        self._fingerprints = OrderedDict()
+        self._explain_queue = queue.Queue(EXPLAIN_QUEUE_SIZE)
+        self._explainer = None
+        self.explained = 0
+        self.explain_failures = 0
+
+    def init_app(self, app):
+        self.app = app
+        threshold_ms = app.config.get('SLOW_QUERY_MS', 250)
+        self.threshold = threshold_ms / 1000 if threshold_ms else None
+        self.explain = app.config.get('SLOW_QUERY_EXPLAIN', True)
+        self.explain_interval = app.config.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+
+    def record(self, conn, statement, parameters, executemany, duration):
+        key = fingerprint(statement)
+        endpoint = (request.endpoint or 'unmatched') if has_request_context() else threading.current_thread().name
+        shape = parameter_shape(parameters, executemany)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._fingerprints.get(key)
+            if entry is None:
+                entry = self._fingerprints[key] = {
+                    'count': 0,
+                    'total_seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'endpoints': Counter(),
+                    'parameters': shape,
+                    'plan': None,
+                    'explained_at': None
+                }
+            self._fingerprints.move_to_end(key)
+            while len(self._fingerprints) > SLOW_QUERY_MAX_FINGERPRINTS:
+                self._fingerprints.popitem(last=False)
+            entry['count'] += 1
+            entry['total_seconds'] += duration
+            entry['max_seconds'] = max(entry['max_seconds'], duration)
+            entry['endpoints'][endpoint] += 1
+            entry['parameters'] = shape
+            entry['last_seen'] = datetime.utcnow().isoformat()
+
+            explain = self.explain and conn.dialect.name == 'postgresql' \
+                and key[:6].upper() == 'SELECT' and not executemany \
+                and (entry['explained_at'] is None or now - entry['explained_at'] >= self.explain_interval)
+            if explain:
+                entry['explained_at'] = now
+
+        logger.warning("Slow query (%.0f ms) in %s: %s params=%s", duration * 1000, endpoint, key, shape)
+        if explain:
+            self._queue_explain(key, statement, parameters)
+
+    def _queue_explain(self, key, statement, parameters):
+        try:
+            self._explain_queue.put_nowait((key, statement, parameters))
+        except queue.Full:
+            return
+        with self._lock:
+            # Started lazily so the thread lives in the forked worker
+            if self._explainer is None:
+                self._explainer = threading.Thread(target=self._run, name='slow-query-explainer', daemon=True)
+                self._explainer.start()
+
+    def _run(self):
+        while True:
+            key, statement, parameters = self._explain_queue.get()
+            try:
+                plan = self._capture_plan(statement, parameters)
+            except Exception:
+                logger.exception("EXPLAIN of a slow query failed")
+                with self._lock:
+                    self.explain_failures += 1
+                continue
+
+            with self._lock:
+                entry = self._fingerprints.get(key)
+                if entry is not None:
+                    entry['plan'] = plan
+                self.explained += 1
+            logger.info("Plan of slow query %s:\n%s", key, plan)
+
+    def _capture_plan(self, statement, parameters):
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                conn.info['slow_query_skip'] = True
+                try:
+                    conn.exec_driver_sql("SET LOCAL statement_timeout = 30000")
+                    rows = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters).all()
+                finally:
+                    # Nothing is kept from the analyzed run
+                    conn.rollback()
+                    conn.info.pop('slow_query_skip', None)
+        return '\n'.join(row[0] for row in rows)
+
+    def report(self):
+        """Get the fingerprints by total time spent, slowest first"""
+        with self._lock:
+            entries = [
+                {
+                    'fingerprint': key,
+                    'count': entry['count'],
+                    'total_ms': round(entry['total_seconds'] * 1000, 1),
+                    'mean_ms': round(entry['total_seconds'] * 1000 / entry['count'], 1),
+                    'max_ms': round(entry['max_seconds'] * 1000, 1),
+                    'endpoints': dict(entry['endpoints'].most_common()),
+                    'parameters': entry['parameters'],
+                    'last_seen': entry['last_seen'],
+                    'plan': entry['plan']
+                }
+                for key, entry in self._fingerprints.items()
+            ]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+
+slow_query_log = SlowQueryLog()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['slow_query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('slow_query_started', None)
+    if started is None or conn.info.get('slow_query_skip'):
+        return
+    duration = time.perf_counter() - started
+    if slow_query_log.threshold is not None and duration >= slow_query_log.threshold:
+        slow_query_log.record(conn, statement, parameters, executemany, duration)
@@ -0,0 +1,201 @@
+"""Frozen opt-ins for dates whose opt-in window has closed for good.
+
+After the cutoff a date's opt-ins no longer change, so they are frozen into
+one OptInSnapshot row per date: for every meal type, the sorted ids of the
+opted-in users and their opt-in times. Each worker keeps the snapshots of
+recent dates in memory and serves reads for those dates from them.
+
+Run from cron after the cutoff, or freeze and discard by hand:
+
+    python snapshots.py freeze [--date YYYY-MM-DD]
+    python snapshots.py discard --date YYYY-MM-DD
+
+Without --date, freeze covers every date up to tomorrow whose window has
+closed for good. Opt-in changes made through set_opt_ins() or the
+materializer discard the snapshot of their date.
+"""
+import argparse
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+
+from __init__ import db
+from caching import VersionedCache, bump_cache_version
+from models import OptInSnapshot, UserMealOptIn
+
+SNAPSHOT_CACHE = 'opt_in_snapshots'
+
+# Frozen dates kept in memory, counting back from today
+SNAPSHOT_DAYS = 7
+
+# Per meal type: meal type id and number of users, then the user ids and
+# the opt-in times (microseconds since the epoch) as two packed arrays
+_MEAL_HEADER = struct.Struct('>II')
+_EPOCH = datetime(1970, 1, 1)
+_NO_TIME = -2 ** 63
+
+# Sorted user ids and the matching opt-in times for one meal type
+FrozenMeal = namedtuple('FrozenMeal', ['user_ids', 'opt_in_times'])
+
+class FrozenDay:
+    """Read-only opt-ins of one date, by meal type id"""
+
+    def __init__(self, for_date, meals):
+        self.date = for_date
+        self.meals = MappingProxyType(dict(sorted(meals.items())))
+
+    def count(self, meal_type_id):
+        meal = self.meals.get(meal_type_id)
+        return len(meal.user_ids) if meal else 0
+
+    def opt_in_map(self, user_id):
+        """Get {meal_type_id: True} for every meal the user is opted in to"""
+        result = {}
+        for meal_type_id, meal in self.meals.items():
+            index = bisect_left(meal.user_ids, user_id)
+            if index < len(meal.user_ids) and meal.user_ids[index] == user_id:
+                result[meal_type_id] = True
+        return result
+
+    def entries(self, meal_type_id=None, after=None):
+        """Yield (meal_type_id, user_id, opt_in_time) in key order, after the ``after`` key"""
+        for meal_id, meal in self.meals.items():
+            if meal_type_id is not None and meal_id != meal_type_id:
+                continue
+            if after is not None and meal_id < after[0]:
+                continue
+
+            start = bisect_right(meal.user_ids, after[1]) if after is not None and meal_id == after[0] else 0
+            for index in range(start, len(meal.user_ids)):
+                yield meal_id, meal.user_ids[index], meal.opt_in_times[index]
+
+def _to_micros(timestamp):
+    return (timestamp - _EPOCH) // timedelta(microseconds=1) if timestamp else _NO_TIME
+
+def _from_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros) if micros != _NO_TIME else None
+
+def pack_meals(meals):
+    """Encode {meal_type_id: FrozenMeal} for storage"""
+    parts = []
+    for meal_type_id, meal in sorted(meals.items()):
+        count = len(meal.user_ids)
+        parts.append(_MEAL_HEADER.pack(meal_type_id, count))
+        parts.append(struct.pack(f'>{count}I', *meal.user_ids))
+        parts.append(struct.pack(f'>{count}q', *(_to_micros(t) for t in meal.opt_in_times)))
+    return b''.join(parts)
+
+def unpack_meals(data):
+    """Decode the output of pack_meals()"""
+    meals = {}
+    offset = 0
+    while offset < len(data):
+        meal_type_id, count = _MEAL_HEADER.unpack_from(data, offset)
+        offset += _MEAL_HEADER.size
+        user_ids = struct.unpack_from(f'>{count}I', data, offset)
+        offset += 4 * count
+        times = struct.unpack_from(f'>{count}q', data, offset)
+        offset += 8 * count
+        meals[meal_type_id] = FrozenMeal(user_ids, tuple(_from_micros(t) for t in times))
+    return meals
+
+def build_frozen_day(for_date):
+    """Read a date's opt-ins from UserMealOptIn, one query, plain columns"""
+    rows = db.session.query(
+            UserMealOptIn.meal_type_id,
+            UserMealOptIn.user_id,
+            UserMealOptIn.timestamp
+        )\
+        .filter(UserMealOptIn.date == for_date, UserMealOptIn.opted_in == True)\
+        .order_by(UserMealOptIn.meal_type_id, UserMealOptIn.user_id)\
+        .all()
+
+    columns = {}
+    for meal_type_id, user_id, timestamp in rows:
+        user_ids, times = columns.setdefault(meal_type_id, ([], []))
+        user_ids.append(user_id)
+        times.append(timestamp)
+    return FrozenDay(for_date, {
+        meal_type_id: FrozenMeal(tuple(user_ids), tuple(times))
+        for meal_type_id, (user_ids, times) in columns.items()
+    })
+
+def freeze_date(for_date):
+    """Store the snapshot of a date whose opt-in window has closed for good"""
+    frozen = build_frozen_day(for_date)
+    OptInSnapshot.query.filter_by(date=for_date).delete(synchronize_session=False)
+    db.session.add(OptInSnapshot(date=for_date, data=pack_meals(frozen.meals)))
+    bump_cache_version(SNAPSHOT_CACHE)
+    db.session.commit()
+    return frozen
+
+def discard_snapshots(dates, force=False):
+    """Delete the snapshots of dates whose opt-ins changed. Does not commit.
+
+    Only dates this worker knows to be frozen are deleted unless ``force``
+    is set, so the opt-in write path stays free of extra queries.
+    """
+    if not force:
+        frozen = snapshot_cache.get()
+        dates = [d for d in dates if d in frozen]
+    if not dates:
+        return 0
+
+    deleted = OptInSnapshot.query.filter(OptInSnapshot.date.in_(list(dates)))\
+        .delete(synchronize_session=False)
+    if deleted:
+        bump_cache_version(SNAPSHOT_CACHE)
+    return deleted
+
+def load_snapshots():
+    """Load the snapshots of recent dates, by date"""
+    rows = db.session.query(OptInSnapshot.date, OptInSnapshot.data)\
+        .filter(OptInSnapshot.date >= date.today() - timedelta(days=SNAPSHOT_DAYS))\
+        .all()
+    return MappingProxyType({row.date: FrozenDay(row.date, unpack_meals(row.data)) for row in rows})
+
+snapshot_cache = VersionedCache(SNAPSHOT_CACHE, load_snapshots)
+
+def get_frozen_day(for_date):
+    """Get the in-memory snapshot of a date, or None if it isn't frozen"""
+    return snapshot_cache.get().get(for_date)
+
+def main():
+    parser = argparse.ArgumentParser(description='Freeze or discard opt-in snapshots.')
+    parser.add_argument('command', choices=['freeze', 'discard'])
+    parser.add_argument('--date', help='Target date (YYYY-MM-DD), default for freeze: dates closed for good')
+    args = parser.parse_args()
+
+    from app import app
+    from schedules import IST, get_timeline
+    with app.app_context():
+        ist_now = datetime.now(IST)
+        today = ist_now.date()
+        timeline = get_timeline(ist_now)
+        if args.date:
+            target_dates = [datetime.strptime(args.date, '%Y-%m-%d').date()]
+        elif args.command == 'freeze':
+            target_dates = [d for d in (today, today + timedelta(days=1)) if timeline.is_final(d, ist_now)]
+        else:
+            parser.error('discard needs --date')
+
+        for target_date in target_dates:
+            if args.command == 'discard':
+                discard_snapshots([target_date], force=True)
+                db.session.commit()
+                print(f"{target_date.isoformat()}: snapshot discarded")
+                continue
+
+            if target_date > today + timedelta(days=1) or not timeline.is_final(target_date, ist_now):
+                print(f"{target_date.isoformat()}: opt-in is not closed yet, skipped")
+                continue
+            frozen = freeze_date(target_date)
+            counts = ', '.join(f"meal {m}: {frozen.count(m)}" for m in frozen.meals) or 'no opt-ins'
+            print(f"{target_date.isoformat()}: frozen ({counts})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+from __init__ import db
+
+def dialect_insert(table):
+    """INSERT construct with ON CONFLICT support for the current database"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
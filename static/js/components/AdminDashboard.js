@@ -70,22 +70,45 @@ const AdminDashboard = () => {
     }
   }, [activeTab, selectedDate, selectedMealType]);
   
-  // Set up auto-refresh interval for QR code
+  // Listen for QR code changes while the QR code tab is open
   React.useEffect(() => {
-    let refreshInterval;
+    // Stream retries start after about 3 seconds and back off to a minute
+    const minRetryDelay = 3000;
+    const maxRetryDelay = 60000;
+    let events;
+    let retryTimer;
+    let retryDelay = minRetryDelay;
     
-    if (activeTab === 'qrcode') {
-      // Auto-refresh QR code every 5 seconds
-      refreshInterval = setInterval(() => {
+    const connect = () => {
+      // Refetch on reconnect too, in case the code changed while offline
+      events = new EventSource(`/api/events?date=${selectedDate}`);
+      events.onopen = () => {
+        retryDelay = minRetryDelay;
+        fetchQRCode(true);
+      };
+      ['daily-qr', 'resync'].forEach(type => {
+        events.addEventListener(type, () => fetchQRCode(true));
+      });
+      // The server refuses streams when it is busy: refetch once, then try
+      // the stream again with jittered, doubling delays
+      events.onerror = () => {
+        if (events.readyState !== EventSource.CLOSED) return;
         fetchQRCode(true);
-      }, 5000);
+        retryTimer = setTimeout(connect, retryDelay * (0.5 + Math.random()));
+        retryDelay = Math.min(retryDelay * 2, maxRetryDelay);
+      };
+    };
+    
+    if (activeTab === 'qrcode') {
+      connect();
     }
     
-    // Clean up interval on component unmount or tab change
+    // Close the stream on component unmount or tab change
     return () => {
-      if (refreshInterval) {
-        clearInterval(refreshInterval);
+      if (events) {
+        events.close();
       }
+      clearTimeout(retryTimer);
     };
   }, [activeTab, selectedDate]);
   
@@ -116,18 +139,33 @@ const AdminDashboard = () => {
     }).format(date);
   };
   
-  // Fetch opted-in meals
-  const fetchOptedMeals = async () => {
+  // Fetch opted-in meals, one page at a time
+  const fetchOptedMeals = async (loadMore = false) => {
     setLoading(true);
     setError(null);
     setSuccess(null);
     
     try {
-      const response = await fetch(`/api/admin/opted-meals?date=${selectedDate}`);
+      const cursorParam = loadMore && optedMeals.next_cursor ? `&cursor=${optedMeals.next_cursor}` : '';
+      const response = await fetch(`/api/admin/opted-meals?date=${selectedDate}${cursorParam}`);
       
       if (response.ok) {
         const data = await response.json();
-        setOptedMeals(data);
+        if (loadMore) {
+          // Append this page's users to the meal types already shown
+          const merged = optedMeals.meal_types.map(m => ({ ...m, users: [...m.users] }));
+          data.meal_types.forEach(mealType => {
+            const existing = merged.find(m => m.id === mealType.id);
+            if (existing) {
+              existing.users.push(...mealType.users);
+            } else {
+              merged.push(mealType);
+            }
+          });
+          setOptedMeals({ ...data, meal_types: merged });
+        } else {
+          setOptedMeals(data);
+        }
       } else {
         const errorData = await response.json();
         setError(errorData.message || 'Failed to fetch opted-in meals');
@@ -378,22 +416,11 @@ const AdminDashboard = () => {
         mealTypes.find(m => m.id === selectedMealType)?.name || 'all' : 
         'all';
       
-      // Create CSV content from the opted meals data
-      let csvContent = "name,email,meal_type,opt_in_time\n";
-      
-      if (optedMeals.meal_types) {
-        optedMeals.meal_types.forEach(mealType => {
-          mealType.users.forEach(user => {
-            csvContent += `"${user.name}","${user.email}","${mealType.name}","${user.opt_in_time || ''}"\n`;
-          });
-        });
+      // The server streams the CSV, so the download works for any number of users
+      let url = `/api/admin/export?format=csv&start_date=${selectedDate}&end_date=${selectedDate}`;
+      if (selectedMealType) {
+        url += `&meal_type_id=${selectedMealType}`;
       }
-      
-      // Create a Blob with the CSV data
-      const blob = new Blob([csvContent], { type: 'text/csv' });
-      const url = window.URL.createObjectURL(blob);
-      
-      // Create a temporary link element and trigger download
       const link = document.createElement('a');
       link.href = url;
       link.download = `meal-opt-ins-${selectedDate}-${mealTypeName}.csv`;
@@ -401,9 +428,6 @@ const AdminDashboard = () => {
       link.click();
       document.body.removeChild(link);
       
-      // Clean up the URL object
-      window.URL.revokeObjectURL(url);
-      
       setSuccess('CSV exported successfully');
     } catch (err) {
       setError('An error occurred while exporting CSV');
@@ -448,7 +472,7 @@ const AdminDashboard = () => {
           <div className="flex gap-2">
             <button 
               className="btn btn-primary"
-              onClick={fetchOptedMeals}
+              onClick={() => fetchOptedMeals()}
               disabled={loading}
             >
               Refresh
@@ -467,7 +491,7 @@ const AdminDashboard = () => {
         {optedMeals.meal_types.map(mealType => (
           <div key={mealType.id} className="meal-type-section mb-6">
             <h3 className="text-xl font-bold mb-2">
-              {mealType.name} ({mealType.users.length} users)
+              {mealType.name} ({mealType.total ?? mealType.users.length} users)
             </h3>
             
             {mealType.users.length === 0 ? (
@@ -496,6 +520,18 @@ const AdminDashboard = () => {
             )}
           </div>
         ))}
+        
+        {optedMeals.next_cursor && (
+          <div className="text-center">
+            <button 
+              className="btn btn-primary"
+              onClick={() => fetchOptedMeals(true)}
+              disabled={loading}
+            >
+              Load More
+            </button>
+          </div>
+        )}
       </div>
     );
   };
@@ -548,7 +584,7 @@ const AdminDashboard = () => {
               Daily QR Code for {formatDate(qrCodeData.date)}
             </h3>
             <p className="text-sm text-gray-500 mb-2">
-              Auto-refreshes every 5 seconds
+              Updates automatically
             </p>
             
             <div className="qr-image mb-4">
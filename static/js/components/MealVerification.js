@@ -5,6 +5,7 @@ const MealVerification = ({ date, token, userId }) => {
   const [verificationData, setVerificationData] = React.useState(null);
   const [requiresLogin, setRequiresLogin] = React.useState(false);
   const [refreshing, setRefreshing] = React.useState(false);
+  const [redeeming, setRedeeming] = React.useState(null);
   
   // Format date for display
   const formatDate = (dateStr) => {
@@ -57,19 +58,81 @@ const MealVerification = ({ date, token, userId }) => {
     }
   }, [date, token, userId]);
   
-  // Set up auto-refresh interval
+  // Listen for pushed changes instead of polling
   React.useEffect(() => {
-    // Auto-refresh every 5 seconds
-    const refreshInterval = setInterval(() => {
-      if (date && token) {
+    if (!date || !token) return;
+    
+    // Stream retries start after about 3 seconds and back off to a minute
+    const minRetryDelay = 3000;
+    const maxRetryDelay = 60000;
+    let events;
+    let retryTimer;
+    let retryDelay = minRetryDelay;
+    const connect = () => {
+      // Refetch on every (re)connect too, in case something changed while offline
+      events = new EventSource(`/api/events?date=${date}`);
+      events.onopen = () => {
+        retryDelay = minRetryDelay;
         fetchVerificationData();
-      }
-    }, 5000);
+      };
+      ['opt-in', 'daily-qr', 'schedules', 'resync'].forEach(type => {
+        events.addEventListener(type, () => fetchVerificationData());
+      });
+      // The server refuses streams when it is busy: refetch once, then try
+      // the stream again with jittered, doubling delays
+      events.onerror = () => {
+        if (events.readyState !== EventSource.CLOSED) return;
+        fetchVerificationData();
+        retryTimer = setTimeout(connect, retryDelay * (0.5 + Math.random()));
+        retryDelay = Math.min(retryDelay * 2, maxRetryDelay);
+      };
+    };
+    connect();
     
-    // Clean up interval on component unmount
-    return () => clearInterval(refreshInterval);
+    // Close the stream on component unmount
+    return () => {
+      events.close();
+      clearTimeout(retryTimer);
+    };
   }, [date, token, userId]);
   
+  // Mark a meal as served
+  const handleRedeem = async (mealTypeId) => {
+    setRedeeming(mealTypeId);
+    setError(null);
+    
+    try {
+      const response = await fetch(`/api/verify-meal/${date}/${token}/redeem`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+          meal_type_id: mealTypeId,
+          user_id: userId || undefined
+        })
+      });
+      const data = await response.json();
+      
+      if (response.ok || response.status === 409) {
+        setVerificationData(prev => ({
+          ...prev,
+          meals: prev.meals.map(meal =>
+            meal.meal_type_id === mealTypeId ? { ...meal, redeemed: true } : meal
+          )
+        }));
+      }
+      if (!response.ok) {
+        setError(data.message || 'Failed to redeem meal');
+      }
+    } catch (err) {
+      setError('An error occurred while redeeming the meal');
+      console.error('Redeem error:', err);
+    } finally {
+      setRedeeming(null);
+    }
+  };
+  
   // Render meal status with emoji
   const renderMealStatus = (meal) => {
     const emoji = meal.name === 'Breakfast' ? '🍳' : 
@@ -91,6 +154,17 @@ const MealVerification = ({ date, token, userId }) => {
                 ❌ Not Opted In
               </div>
             )}
+            {meal.redeemed ? (
+              <div className="text-sm text-gray-600 mt-1">Served</div>
+            ) : meal.opted_in && (
+              <button
+                className="btn btn-primary mt-2"
+                onClick={() => handleRedeem(meal.meal_type_id)}
+                disabled={redeeming !== null}
+              >
+                {redeeming === meal.meal_type_id ? 'Redeeming...' : 'Redeem'}
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -172,7 +246,7 @@ const MealVerification = ({ date, token, userId }) => {
               {refreshing ? 'Refreshing...' : 'Refresh Status'}
             </button>
             <p className="text-sm text-gray-500 mt-2">
-              Status auto-refreshes every 5 seconds
+              Status updates automatically
             </p>
           </div>
         </>
@@ -8,6 +8,8 @@ const OptIn = ({ user, setUser }) => {
   const [weeklyPreferences, setWeeklyPreferences] = React.useState([]);
   const [selectedDate, setSelectedDate] = React.useState(null);
   const [isOptInOpen, setIsOptInOpen] = React.useState(false);
+  const [nextTransition, setNextTransition] = React.useState(null);
+  const [statusRefresh, setStatusRefresh] = React.useState(0);
   const [activeTab, setActiveTab] = React.useState('daily'); // 'daily' or 'weekly'
   const [dailySubmitted, setDailySubmitted] = React.useState(false);
   const [weeklySubmitted, setWeeklySubmitted] = React.useState(false);
@@ -41,79 +43,50 @@ const OptIn = ({ user, setUser }) => {
     }).format(date);
   };
   
-  // Load meal types on component mount
+  // Load meal types, opt-in status and weekly preferences in one request
   React.useEffect(() => {
-    const fetchMealTypes = async () => {
-      try {
-        const response = await fetch('/api/meals');
-        const data = await response.json();
-        
-        if (response.ok) {
-          setMealTypes(data.meal_types);
-        } else {
-          setError(data.message || 'Failed to load meal types');
-        }
-      } catch (err) {
-        setError('An error occurred while loading meal types');
-        console.error('Meal types error:', err);
-      }
-    };
-    
-    fetchMealTypes();
-  }, []);
-  
-  // Load opt-in status for tomorrow
-  React.useEffect(() => {
-    const fetchOptInStatus = async () => {
+    const fetchDashboard = async () => {
       setLoading(true);
       setError(null);
       
       try {
-        // If selectedDate is null, the API will default to tomorrow
-        const dateParam = selectedDate ? `?date=${selectedDate}` : '';
-        const response = await fetch(`/api/meals/opt-in-status${dateParam}`);
+        const response = await fetch('/api/me/dashboard');
         const data = await response.json();
         
         if (response.ok) {
-          setOptInStatus(data.meals);
-          setSelectedDate(data.date);
-          setIsOptInOpen(data.is_opt_in_open);
+          // Keep the date being edited; the API suggests the earliest open one
+          const date = selectedDate || data.date;
+          const day = data.days.find(d => d.date === date) || data.days[0];
+          
+          setMealTypes(data.meal_types);
+          setWeeklyPreferences(data.weekly_preferences);
+          setOptInStatus(day.meals);
+          setSelectedDate(day.date);
+          setIsOptInOpen(day.is_opt_in_open);
+          setNextTransition(day.next_transition);
         } else {
           setError(data.message || 'Failed to load opt-in status');
         }
       } catch (err) {
         setError('An error occurred while loading opt-in status');
-        console.error('Opt-in status error:', err);
+        console.error('Dashboard error:', err);
       } finally {
         setLoading(false);
       }
     };
     
-    fetchOptInStatus();
-  }, [selectedDate]);
+    fetchDashboard();
+  }, [statusRefresh]);
   
-  // Load weekly preferences
+  // Reload the status once the opt-in window for this date opens or closes
   React.useEffect(() => {
-    const fetchWeeklyPreferences = async () => {
-      try {
-        const response = await fetch('/api/meals/weekly-status');
-        const data = await response.json();
-        
-        if (response.ok) {
-          setWeeklyPreferences(data.weekly_preferences);
-        } else {
-          setError(data.message || 'Failed to load weekly preferences');
-        }
-      } catch (err) {
-        setError('An error occurred while loading weekly preferences');
-        console.error('Weekly preferences error:', err);
-      }
-    };
+    if (!nextTransition) return;
     
-    if (activeTab === 'weekly') {
-      fetchWeeklyPreferences();
-    }
-  }, [activeTab]);
+    const delay = Math.max(new Date(nextTransition).getTime() - Date.now(), 0);
+    const timer = setTimeout(() => setStatusRefresh(n => n + 1), delay + 1000);
+    
+    return () => clearTimeout(timer);
+  }, [nextTransition]);
   
   // Handle meal opt-in toggle
   const handleMealOptInToggle = async (mealTypeId, optedIn) => {
@@ -1,12 +1,145 @@
-// Scanner Component
+// How often the roster and the offline scans are synced
+const ROSTER_SYNC_INTERVAL_MS = 30000;
+const SCAN_QUEUE_KEY = 'scanQueue';
+
+// The two QR codes a user can show: their user id, or a signed meal pass
+const USER_QR_PATH = /^\/api\/verify\/(\d+)$/;
+const PASS_QR_PATH = /^\/api\/verify-pass\/([^/]+)$/;
+
+// Today's date in IST as YYYY-MM-DD
+const getTodayIST = () => new Intl.DateTimeFormat('en-CA', { timeZone: 'Asia/Kolkata' }).format(new Date());
+
+const loadStored = (key, fallback) => {
+  try {
+    const value = localStorage.getItem(key);
+    return value ? JSON.parse(value) : fallback;
+  } catch (err) {
+    return fallback;
+  }
+};
+
+const saveStored = (key, value) => {
+  try {
+    localStorage.setItem(key, JSON.stringify(value));
+  } catch (err) {
+    console.error('Could not save to local storage:', err);
+  }
+};
+
+// Scanner Component: verifies against a locally synced roster, so scanning
+// keeps working without network; scans are uploaded in batches later
 const Scanner = () => {
   const [scanning, setScanning] = React.useState(false);
   const [scanResult, setScanResult] = React.useState(null);
   const [error, setError] = React.useState(null);
   const [loading, setLoading] = React.useState(false);
+  const [mealTypes, setMealTypes] = React.useState([]);
+  const [mealTypeId, setMealTypeId] = React.useState(null);
+  const [roster, setRoster] = React.useState(null);
+  const [pendingScans, setPendingScans] = React.useState(loadStored(SCAN_QUEUE_KEY, []).length);
+  const [lastSync, setLastSync] = React.useState(null);
   
   const scannerRef = React.useRef(null);
   const readerRef = React.useRef(null);
+  const uploadingRef = React.useRef(false);
+  
+  const today = getTodayIST();
+  const rosterKey = mealTypeId ? `roster:${today}:${mealTypeId}` : null;
+  
+  // Load meal types, defaulting to lunch
+  React.useEffect(() => {
+    const fetchMealTypes = async () => {
+      try {
+        const response = await fetch('/api/meals');
+        const data = await response.json();
+        if (response.ok) {
+          setMealTypes(data.meal_types);
+          const lunch = data.meal_types.find(m => m.name === 'Lunch') || data.meal_types[0];
+          setMealTypeId(lunch ? lunch.id : null);
+        }
+      } catch (err) {
+        console.error('Meal types error:', err);
+      }
+    };
+    
+    fetchMealTypes();
+  }, []);
+  
+  // Download the roster in full once, then only the changes since our version
+  const syncRoster = async () => {
+    const stored = loadStored(rosterKey, null);
+    const params = new URLSearchParams({ date: today, meal_type_id: mealTypeId });
+    if (stored) params.set('since', stored.version);
+    
+    const response = await fetch(`/api/admin/roster?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.message || 'Roster sync failed');
+    
+    let users;
+    if (data.full) {
+      users = Object.fromEntries(data.users);
+    } else {
+      users = { ...stored.users };
+      data.added.forEach(([id, name]) => { users[id] = name; });
+      data.removed.forEach(id => { delete users[id]; });
+    }
+    
+    const updated = { version: data.version, users, served: stored ? stored.served : [] };
+    saveStored(rosterKey, updated);
+    setRoster(updated);
+  };
+  
+  // Upload the scans made while offline; the server ignores ones it already has
+  const uploadScans = async () => {
+    const queue = loadStored(SCAN_QUEUE_KEY, []);
+    if (queue.length === 0 || uploadingRef.current) return;
+    
+    uploadingRef.current = true;
+    try {
+      const batch = queue.slice(0, 500);
+      const response = await fetch('/api/admin/scans', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ scans: batch })
+      });
+      if (!response.ok) throw new Error('Scan upload failed');
+      
+      // Scans may have been queued during the upload
+      const remaining = loadStored(SCAN_QUEUE_KEY, []).slice(batch.length);
+      saveStored(SCAN_QUEUE_KEY, remaining);
+      setPendingScans(remaining.length);
+    } finally {
+      uploadingRef.current = false;
+    }
+  };
+  
+  const sync = async () => {
+    if (!rosterKey) return;
+    try {
+      await syncRoster();
+      await uploadScans();
+      setLastSync(new Date().toISOString());
+    } catch (err) {
+      // Offline: keep scanning against the stored roster
+      console.error('Sync error:', err);
+    }
+  };
+  
+  React.useEffect(() => {
+    if (!rosterKey) return;
+    
+    setRoster(loadStored(rosterKey, null));
+    sync();
+    const timer = setInterval(sync, ROSTER_SYNC_INTERVAL_MS);
+    window.addEventListener('online', sync);
+    
+    return () => {
+      clearInterval(timer);
+      window.removeEventListener('online', sync);
+    };
+  }, [rosterKey]);
   
   // Start scanning
   const startScanner = () => {
@@ -49,25 +182,67 @@ const Scanner = () => {
     setLoading(true);
     
     try {
-      // Extract user ID from the URL
-      const url = new URL(decodedText);
-      const pathParts = url.pathname.split('/');
-      const userId = pathParts[pathParts.length - 1];
-      
-      // Verify the user's opt-in status
-      const response = await fetch(`/api/verify/${userId}`);
-      const data = await response.json();
+      const current = loadStored(rosterKey, null);
+      if (!current) {
+        setScanResult({ success: false, message: 'No roster yet. Connect to the network once to download it.' });
+        return;
+      }
       
-      if (response.ok) {
-        setScanResult({
-          success: true,
-          user: data.user
-        });
+      // Only our own verification URLs; any other URL is not a meal QR code
+      const path = new URL(decodedText).pathname;
+      const userMatch = path.match(USER_QR_PATH);
+      const passMatch = path.match(PASS_QR_PATH);
+      let userId;
+      if (userMatch) {
+        userId = parseInt(userMatch[1], 10);
+      } else if (passMatch) {
+        // The pass signature is checked by the server, so passes need the network
+        let response;
+        try {
+          response = await fetch(`/api/verify-pass/${passMatch[1]}?date=${today}`);
+        } catch (err) {
+          setScanResult({ success: false, message: 'Meal passes can only be checked online. Scan the user QR code instead.' });
+          return;
+        }
+        const data = await response.json();
+        if (!response.ok) {
+          setScanResult({ success: false, message: data.message || 'Invalid pass' });
+          return;
+        }
+        userId = data.user_id;
       } else {
-        setScanResult({
-          success: false,
-          message: data.message || 'Verification failed'
+        setScanResult({ success: false, message: 'Invalid QR code' });
+        return;
+      }
+      
+      // Verify against the local roster, no network needed
+      const name = current.users[userId];
+      const alreadyServed = current.served.includes(userId);
+      setScanResult({
+        success: true,
+        alreadyServed,
+        user: {
+          name: name || `User #${userId}`,
+          is_opted_in: Boolean(name)
+        }
+      });
+      
+      // Queue the scan for upload
+      if (name && !alreadyServed) {
+        const updated = { ...current, served: [...current.served, userId] };
+        saveStored(rosterKey, updated);
+        setRoster(updated);
+        
+        const queue = loadStored(SCAN_QUEUE_KEY, []);
+        queue.push({
+          user_id: userId,
+          meal_type_id: mealTypeId,
+          date: today,
+          scanned_at: new Date().toISOString()
         });
+        saveStored(SCAN_QUEUE_KEY, queue);
+        setPendingScans(queue.length);
+        uploadScans().catch(() => {});
       }
     } catch (err) {
       setError('Invalid QR code or verification failed');
@@ -94,6 +269,8 @@ const Scanner = () => {
     };
   }, []);
   
+  const mealName = (mealTypes.find(m => m.id === mealTypeId) || {}).name || 'this meal';
+  
   // Format time for display
   const formatTime = (isoString) => {
     if (!isoString) return 'N/A';
@@ -111,6 +288,24 @@ const Scanner = () => {
         </div>
       )}
       
+      <div className="mb-4">
+        <label className="mr-2">Meal:</label>
+        <select
+          value={mealTypeId || ''}
+          onChange={(e) => setMealTypeId(parseInt(e.target.value, 10))}
+          disabled={scanning}
+        >
+          {mealTypes.map(m => (
+            <option key={m.id} value={m.id}>{m.name}</option>
+          ))}
+        </select>
+        <p className="text-sm text-gray-600 mt-2">
+          {roster ? `${Object.keys(roster.users).length} opted in` : 'Roster not downloaded yet'}
+          {' · '}{pendingScans} scan{pendingScans === 1 ? '' : 's'} waiting to sync
+          {lastSync && <> · Last synced {formatTime(lastSync)}</>}
+        </p>
+      </div>
+      
       {!scanning && !scanResult && (
         <div className="text-center mb-4">
           <button 
@@ -148,18 +343,16 @@ const Scanner = () => {
           
           {scanResult.success ? (
             <div>
-              <div className={`status ${scanResult.user.is_opted_in ? 'status-success' : 'status-danger'} mb-2`}>
-                {scanResult.user.is_opted_in ? (
-                  <>✅ Verified: {scanResult.user.name} is opted in for lunch</>
+              <div className={`status ${scanResult.user.is_opted_in && !scanResult.alreadyServed ? 'status-success' : 'status-danger'} mb-2`}>
+                {!scanResult.user.is_opted_in ? (
+                  <>❌ Not Verified: {scanResult.user.name} has not opted in for {mealName}</>
+                ) : scanResult.alreadyServed ? (
+                  <>⚠️ {scanResult.user.name} has already been served {mealName}</>
                 ) : (
-                  <>❌ Not Verified: {scanResult.user.name} has not opted in for lunch</>
+                  <>✅ Verified: {scanResult.user.name} is opted in for {mealName}</>
                 )}
               </div>
               
-              {scanResult.user.is_opted_in && scanResult.user.opt_in_time && (
-                <p className="mb-2">Opted in at: {formatTime(scanResult.user.opt_in_time)}</p>
-              )}
-              
               <div className="mt-4">
                 <button 
                   className="btn btn-primary"
@@ -200,7 +393,8 @@ const Scanner = () => {
           <li>Click "Start Scanner" to activate the camera</li>
           <li>Point the camera at a user's QR code</li>
           <li>The system will automatically verify their opt-in status</li>
-          <li>Green checkmark means they're verified for lunch</li>
+          <li>Green checkmark means they're verified for the selected meal</li>
+          <li>Scans are checked on this device and synced when the network is available</li>
         </ol>
       </div>
     </div>
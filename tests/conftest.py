@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# The app reads DATABASE_URL when it is imported, so point it at a
+# throwaway file-backed SQLite database before any test imports it
+_db_dir = tempfile.mkdtemp(prefix='food_tracker_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    import init_db
+    init_db.init_db()
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+@pytest.fixture
+def login(app):
+    """Return a test client logged in as the given user"""
+    def _login(email='admin@example.com', password='admin123'):
+        client = app.test_client()
+        response = client.post('/api/login', json={'email': email, 'password': password})
+        assert response.status_code == 200, response.data
+        return client
+    return _login
+
+@pytest.fixture
+def count_statements(app):
+    """Return a context manager that collects the SQL statements run inside it"""
+    from __init__ import db
+
+    @contextmanager
+    def _count_statements():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return _count_statements
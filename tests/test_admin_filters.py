@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+
+from __init__ import db
+from models import UserMealOptIn
+
+@pytest.mark.parametrize('url', [
+    '/api/admin/export?meal_type_id=abc',
+    '/api/admin/export?format=ndjson&meal_type_id=999',
+    '/api/admin/historical-data?meal_type_id=abc',
+])
+def test_invalid_meal_type_is_rejected_before_querying(login, url):
+    response = login().get(url)
+    assert response.status_code == 400
+    assert response.json['message'] == 'Invalid meal type'
+
+def test_valid_meal_type_filters_export(login):
+    response = login().get('/api/admin/export?format=ndjson&meal_type_id=2')
+    assert response.status_code == 200
+
+def test_csv_export_only_has_the_selected_meal_type(app, login):
+    export_date = date(2030, 2, 1)
+    with app.app_context():
+        db.session.add_all(UserMealOptIn(user_id=1, meal_type_id=meal_type_id, date=export_date, opted_in=True)
+                           for meal_type_id in (1, 2))
+        db.session.commit()
+    response = login().get('/api/admin/export?format=csv&start_date=2030-02-01&end_date=2030-02-01&meal_type_id=2')
+    assert response.status_code == 200
+    rows = response.get_data(as_text=True).strip().splitlines()[1:]
+    assert len(rows) == 1
+    assert 'Lunch' in rows[0]
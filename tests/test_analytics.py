@@ -0,0 +1,22 @@
+from datetime import date, timedelta
+
+import pytest
+
+import bitmaps
+
+@pytest.mark.parametrize('depth', [100, 5000])
+def test_deeply_nested_expression_is_rejected(login, depth):
+    # Sent as text, since the test client can't encode this deep either
+    term = f'{{"meal": null, "date": "{date.today().isoformat()}"}}'
+    body = '{"expr": ' + '{"or": [' * depth + term + ']}' * depth + '}'
+    response = login().post('/api/admin/analytics', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['message'] == f'An expression may nest at most {bitmaps.MAX_EXPRESSION_DEPTH} levels'
+
+def test_expression_over_more_dates_than_the_index_holds_is_rejected(login, monkeypatch):
+    monkeypatch.setattr(bitmaps.opt_in_bitmaps, 'max_dates', 10)
+    start = date.today() - timedelta(days=20)
+    expr = {'meal': None, 'start': start.isoformat(), 'end': date.today().isoformat()}
+    response = login().post('/api/admin/analytics', json={'expr': expr})
+    assert response.status_code == 400
+    assert response.json['message'] == 'An expression may cover at most 10 days'
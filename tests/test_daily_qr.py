@@ -0,0 +1,40 @@
+import threading
+from datetime import date
+
+from models import DailyQRCode
+from routes import generate_daily_qr_code
+
+REQUESTS = 8
+
+def test_concurrent_first_requests_create_one_code(app):
+    for_date = date(2030, 6, 1)
+    barrier = threading.Barrier(REQUESTS)
+    tokens = []
+    errors = []
+
+    def generate():
+        try:
+            with app.test_request_context():
+                barrier.wait()
+                tokens.append(generate_daily_qr_code(for_date).token)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=generate) for _ in range(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        codes = DailyQRCode.query.filter_by(date=for_date).all()
+        assert len(codes) == 1
+        assert codes[0].image is not None
+    assert set(tokens) == {codes[0].token}
+
+def test_existing_code_is_returned(app):
+    for_date = date(2030, 6, 2)
+    with app.test_request_context():
+        first = generate_daily_qr_code(for_date)
+        assert generate_daily_qr_code(for_date).token == first.token
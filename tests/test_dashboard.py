@@ -0,0 +1,32 @@
+from __init__ import db
+from meal_types import invalidate_meal_types
+from models import MealType
+
+def dashboard_statements(client, count_statements):
+    # The first request warms the per-worker caches; count the next one
+    assert client.get('/api/me/dashboard').status_code == 200
+    with count_statements() as statements:
+        response = client.get('/api/me/dashboard')
+    assert response.status_code == 200
+    return response, len(statements)
+
+def test_dashboard_query_count_does_not_grow_with_meal_types(app, login, count_statements):
+    client = login('john@example.com', 'password123')
+    response, with_three = dashboard_statements(client, count_statements)
+    assert len(response.json['meal_types']) == 3
+
+    with app.app_context():
+        for i in range(7):
+            db.session.add(MealType(name=f'Snack {i}'))
+        invalidate_meal_types()
+        db.session.commit()
+
+    try:
+        response, with_ten = dashboard_statements(client, count_statements)
+        assert len(response.json['meal_types']) == 10
+        assert with_ten == with_three
+    finally:
+        with app.app_context():
+            MealType.query.filter(MealType.name.like('Snack %')).delete(synchronize_session=False)
+            invalidate_meal_types()
+            db.session.commit()
@@ -0,0 +1,66 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from __init__ import db
+from events import EVENT_SETTLE_SECONDS, EventHub
+from models import StreamEvent
+
+@pytest.fixture
+def hub(app):
+    hub = EventHub()
+    hub.init_app(app)
+    with app.app_context():
+        StreamEvent.query.delete()
+        db.session.commit()
+        yield hub
+        StreamEvent.query.delete()
+        db.session.commit()
+
+def insert_event(event_id, name, created_at=None):
+    db.session.add(StreamEvent(
+        id=event_id,
+        channel='test',
+        event=name,
+        payload=json.dumps({}),
+        created_at=created_at or datetime.utcnow()
+    ))
+    db.session.commit()
+
+def received(subscription):
+    events = []
+    while (item := subscription.get(timeout=0)) is not None:
+        events.append(item[0])
+    return events
+
+def test_event_committed_late_with_a_lower_id_is_delivered(hub):
+    subscription = hub.subscribe(['test'])
+
+    insert_event(10, 'second')
+    assert hub.poll() == 1
+    # A slower transaction commits the id it was given earlier
+    insert_event(9, 'first')
+    assert hub.poll() == 1
+    assert hub.poll() == 0
+    assert received(subscription) == ['second', 'first']
+
+def test_settled_events_are_no_longer_read(hub):
+    settled = datetime.utcnow() - timedelta(seconds=EVENT_SETTLE_SECONDS + 1)
+    insert_event(20, 'old', settled)
+    insert_event(21, 'recent')
+    assert hub.poll() == 2
+    assert hub._settled_id == 20
+    assert hub._delivered == {21}
+
+def test_stream_is_refused_when_every_slot_is_taken(login, monkeypatch):
+    from events import event_hub
+    monkeypatch.setattr(event_hub, '_streams', threading.BoundedSemaphore(1))
+    assert event_hub.acquire_stream()
+    try:
+        response = login().get('/api/events')
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+    finally:
+        event_hub.release_stream()
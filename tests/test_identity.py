@@ -0,0 +1,56 @@
+from sqlalchemy import insert, update
+
+from __init__ import db
+from caching import get_cache_version
+from identity import USER_VERSION, user_cache, user_version
+from models import CacheVersion, User
+
+def test_cached_user_needs_no_lookup(login, count_statements):
+    client = login('jane@example.com', 'password123')
+    assert client.get('/api/me/dashboard').status_code == 200
+
+    hits = user_cache.stats()['hits']
+    with count_statements() as statements:
+        assert client.get('/api/me/dashboard').status_code == 200
+    assert user_cache.stats()['hits'] == hits + 1
+    # Only the user lookup reads is_admin
+    assert not [s for s in statements if 'is_admin' in s]
+
+def test_admin_flag_change_bumps_the_shared_version(app):
+    with app.app_context():
+        before = get_cache_version(USER_VERSION)
+        user = User.query.filter_by(email='jane@example.com').one()
+        user.is_admin = True
+        db.session.commit()
+        user.is_admin = False
+        db.session.commit()
+        assert get_cache_version(USER_VERSION) == before + 2
+
+        # Other columns don't make snapshots stale
+        user.password_hash = user.password_hash
+        user.created_at = user.created_at
+        db.session.commit()
+        assert get_cache_version(USER_VERSION) == before + 2
+
+def test_change_in_another_worker_reaches_this_one(app, login, monkeypatch):
+    client = login('jane@example.com', 'password123')
+    assert client.get('/api/admin/opted-meals').status_code == 403
+
+    # Another worker makes jane an admin: the row and the version change, nothing local
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(update(User).where(User.email == 'jane@example.com').values(is_admin=True))
+            bumped = conn.execute(
+                update(CacheVersion).where(CacheVersion.name == USER_VERSION).values(version=CacheVersion.version + 1)
+            ).rowcount
+            if not bumped:
+                conn.execute(insert(CacheVersion).values(name=USER_VERSION, version=1))
+    try:
+        assert client.get('/api/admin/opted-meals').status_code == 403
+        # Once CACHE_MAX_STALENESS has passed
+        monkeypatch.setattr(user_version, '_checked_at', 0.0)
+        assert client.get('/api/admin/opted-meals').status_code == 200
+    finally:
+        with app.app_context():
+            db.session.execute(update(User).where(User.email == 'jane@example.com').values(is_admin=False))
+            db.session.commit()
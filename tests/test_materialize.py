@@ -0,0 +1,32 @@
+from datetime import date
+
+from __init__ import db
+from materialize import materialize_weekly_opt_ins
+from models import User, UserMealOptIn
+from opt_ins import set_weekly_preferences
+from rollups import check_daily_counts
+
+THURSDAY = date(2031, 6, 5)
+SATURDAY = date(2031, 6, 7)
+MEAL_TYPE_ID = 3
+
+def test_materializing_twice_changes_nothing(app):
+    with app.app_context():
+        user_ids = [user.id for user in User.query.order_by(User.id)]
+        for user_id in user_ids:
+            set_weekly_preferences(user_id, MEAL_TYPE_ID, {'thursday': True})
+        db.session.commit()
+
+        first = materialize_weekly_opt_ins(THURSDAY)
+        rows = UserMealOptIn.query.filter_by(date=THURSDAY, meal_type_id=MEAL_TYPE_ID).count()
+        assert first[MEAL_TYPE_ID] == len(user_ids)
+        assert rows == len(user_ids)
+
+        assert materialize_weekly_opt_ins(THURSDAY) == {}
+        assert UserMealOptIn.query.filter_by(date=THURSDAY, meal_type_id=MEAL_TYPE_ID).count() == rows
+        assert check_daily_counts(THURSDAY, THURSDAY) == []
+
+def test_weekend_is_not_materialized(app):
+    with app.app_context():
+        assert materialize_weekly_opt_ins(SATURDAY) == {}
+        assert UserMealOptIn.query.filter_by(date=SATURDAY).count() == 0
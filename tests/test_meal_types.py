@@ -0,0 +1,28 @@
+from __init__ import db
+from meal_types import invalidate_meal_types
+from models import MealType
+
+def rename_meal_type(app, meal_type_id, name):
+    with app.app_context():
+        db.session.get(MealType, meal_type_id).name = name
+        invalidate_meal_types()
+        db.session.commit()
+
+def test_meal_types_etag_changes_when_meal_types_change(app, login):
+    client = login('john@example.com', 'password123')
+    response = client.get('/api/meals')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get('/api/meals', headers={'If-None-Match': etag}).status_code == 304
+
+    rename_meal_type(app, 3, 'Supper')
+    try:
+        response = client.get('/api/meals', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert {'id': 3, 'name': 'Supper'} in response.json['meal_types']
+    finally:
+        rename_meal_type(app, 3, 'Dinner')
+
+    # Restoring the same meal types restores the same ETag
+    assert client.get('/api/meals', headers={'If-None-Match': etag}).status_code == 304
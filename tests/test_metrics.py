@@ -0,0 +1,69 @@
+import pytest
+
+from metrics import MetricsRegistry
+
+LABELS = (('endpoint', 'main.get_meal_types'), ('method', 'GET'))
+
+def worker(directory):
+    registry = MetricsRegistry()
+    registry.directory = str(directory)
+    # Only the explicit flush in collect() writes during the test
+    registry.flush_interval = 3600
+    return registry
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    for value in (0, 1, 3, 3, 500):
+        registry.observe('http_request_db_queries', LABELS, value)
+    registry.inc('http_requests_total', LABELS + (('status', '200'),), 5)
+
+    lines = registry.render().splitlines()
+    labels = 'endpoint="main.get_meal_types",method="GET"'
+    assert f'http_requests_total{{{labels},status="200"}} 5' in lines
+    buckets = [line for line in lines if line.startswith('http_request_db_queries_bucket')]
+    assert buckets == [
+        f'http_request_db_queries_bucket{{{labels},le="{bound}"}} {count}'
+        for bound, count in [(0, 1), (1, 2), (2, 2), (5, 4), (10, 4), (20, 4), (50, 4), (100, 4), ('+Inf', 5)]
+    ]
+    assert f'http_request_db_queries_sum{{{labels}}} 507.0' in lines
+    assert f'http_request_db_queries_count{{{labels}}} 5' in lines
+    assert '# TYPE http_request_duration_seconds histogram' in lines
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.inc('http_requests_total', (('endpoint', 'a"b\\c\nd'),))
+    assert 'http_requests_total{endpoint="a\\"b\\\\c\\nd"} 1' in registry.render().splitlines()
+
+def test_workers_are_added_up_from_metrics_dir(tmp_path):
+    first, second = worker(tmp_path), worker(tmp_path)
+    first.observe('http_request_db_queries', LABELS, 1)
+    first.inc('http_requests_total', LABELS + (('status', '200'),))
+    second.observe('http_request_db_queries', LABELS, 200)
+    second.inc('http_requests_total', LABELS + (('status', '200'),), 2)
+    second.inc('http_requests_total', LABELS + (('status', '500'),))
+    second.flush()
+
+    totals = first.collect()
+    assert totals[('http_requests_total', LABELS + (('status', '200'),))] == 3
+    assert totals[('http_requests_total', LABELS + (('status', '500'),))] == 1
+    assert totals[('http_request_db_queries', LABELS)] == [0, 1, 0, 0, 0, 0, 0, 0, 1, 201.0]
+    assert len(list(tmp_path.glob('metrics_*.json'))) == 2
+
+    # A worker that exited keeps its totals; unreadable files are skipped
+    del second
+    (tmp_path / 'metrics_broken.json').write_text('{')
+    assert first.collect()[('http_requests_total', LABELS + (('status', '200'),))] == 3
+
+@pytest.fixture
+def metrics_token(app):
+    previous = app.config['METRICS_TOKEN']
+    app.config['METRICS_TOKEN'] = 'secret'
+    yield 'secret'
+    app.config['METRICS_TOKEN'] = previous
+
+def test_scrape_requires_token_when_set(app, metrics_token):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {metrics_token}'})
+    assert response.status_code == 200
+    assert b'# TYPE http_requests_total counter' in response.data
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import migrate_db
+
+def test_copy_value_escapes_copy_text_format():
+    assert migrate_db.copy_value(None) == '\\N'
+    assert migrate_db.copy_value(3) == '3'
+    assert migrate_db.copy_value('a\tb\nc\\d\r') == 'a\\tb\\nc\\\\d\\r'
+    assert migrate_db.copy_value(b'\x00\xff') == '\\\\x00ff'
+
+def test_tables_are_sorted_parents_first():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript('''
+        CREATE TABLE child (id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES parent(id),
+                            other_id INTEGER REFERENCES other(id));
+        CREATE TABLE parent (id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES parent(id));
+        CREATE TABLE other (id INTEGER PRIMARY KEY);
+    ''')
+    order = migrate_db.sort_tables(conn, {'child', 'parent', 'other'})
+    assert order.index('parent') < order.index('child')
+    assert order.index('other') < order.index('child')
+
+# The copy itself needs a PostgreSQL database the test may write to
+TEST_POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+@pytest.fixture
+def pg_conn():
+    if not TEST_POSTGRES_URL:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    conn = psycopg2.connect(TEST_POSTGRES_URL)
+    with conn, conn.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS migrate_test_item;')
+        cursor.execute('CREATE TABLE migrate_test_item (id SERIAL PRIMARY KEY, name TEXT NOT NULL);')
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {migrate_db.CHECKPOINT_TABLE}'
+            ' (table_name TEXT PRIMARY KEY, last_rowid BIGINT NOT NULL);'
+        )
+        cursor.execute(f"DELETE FROM {migrate_db.CHECKPOINT_TABLE} WHERE table_name = 'migrate_test_item';")
+    yield conn
+    with conn, conn.cursor() as cursor:
+        cursor.execute('DROP TABLE migrate_test_item;')
+        cursor.execute(f"DELETE FROM {migrate_db.CHECKPOINT_TABLE} WHERE table_name = 'migrate_test_item';")
+    conn.close()
+
+def test_interrupted_copy_resumes_after_checkpoint(pg_conn, monkeypatch):
+    sqlite_conn = sqlite3.connect(':memory:')
+    sqlite_conn.execute('CREATE TABLE migrate_test_item (id INTEGER PRIMARY KEY, name TEXT NOT NULL);')
+    sqlite_conn.executemany('INSERT INTO migrate_test_item VALUES (?, ?)', [(i, f'item {i}') for i in range(1, 8)])
+    with pg_conn, pg_conn.cursor() as cursor:
+        cursor.execute("INSERT INTO migrate_test_item VALUES (1, 'already there');")
+
+    # Fail while formatting the third chunk
+    copy_value = migrate_db.copy_value
+    def failing_copy_value(value):
+        if value == 'item 5':
+            raise RuntimeError('interrupted')
+        return copy_value(value)
+    monkeypatch.setattr(migrate_db, 'copy_value', failing_copy_value)
+    with pytest.raises(RuntimeError):
+        migrate_db.migrate_table(sqlite_conn, pg_conn, 'migrate_test_item', 2)
+
+    with pg_conn, pg_conn.cursor() as cursor:
+        cursor.execute(f"SELECT last_rowid FROM {migrate_db.CHECKPOINT_TABLE} WHERE table_name = 'migrate_test_item';")
+        assert cursor.fetchone()[0] == 4
+
+    monkeypatch.setattr(migrate_db, 'copy_value', copy_value)
+    read, inserted, _ = migrate_db.migrate_table(sqlite_conn, pg_conn, 'migrate_test_item', 2)
+    assert (read, inserted) == (3, 3)
+
+    with pg_conn, pg_conn.cursor() as cursor:
+        cursor.execute('SELECT id, name FROM migrate_test_item ORDER BY id;')
+        rows = cursor.fetchall()
+        # The sequence was moved past the copied ids
+        cursor.execute("INSERT INTO migrate_test_item (name) VALUES ('new') RETURNING id;")
+        new_id = cursor.fetchone()[0]
+    assert rows == [(1, 'already there')] + [(i, f'item {i}') for i in range(2, 8)]
+    assert new_id == 8
+
+    # Nothing is left to copy
+    assert migrate_db.migrate_table(sqlite_conn, pg_conn, 'migrate_test_item', 2)[0] == 0
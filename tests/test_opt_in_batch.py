@@ -0,0 +1,60 @@
+from datetime import date, datetime
+
+import pytest
+
+import routes
+from models import User, UserMealOptIn
+from rollups import check_daily_counts
+from schedules import IST
+
+# A Tuesday evening, when opt-in for Wednesday is open and Thursday is not yet
+NOW = IST.localize(datetime(2030, 1, 8, 21))
+OPEN_DATE = date(2030, 1, 9)
+CLOSED_DATE = date(2030, 1, 10)
+
+@pytest.fixture
+def client(login, monkeypatch):
+    monkeypatch.setattr(routes, 'get_ist_now', lambda: NOW)
+    return login('jane@example.com', 'password123')
+
+def test_valid_items_are_applied_and_invalid_ones_reported(app, client):
+    response = client.post('/api/meals/opt-in/batch', json={'items': [
+        {'meal_type_id': 1, 'date': OPEN_DATE.isoformat(), 'opted_in': True},
+        'not an item',
+        {'meal_type_id': 999, 'date': OPEN_DATE.isoformat(), 'opted_in': True},
+        {'meal_type_id': 2, 'date': '09/01/2030', 'opted_in': True},
+        {'meal_type_id': 2, 'date': CLOSED_DATE.isoformat(), 'opted_in': True},
+        {'meal_type_id': 3, 'date': OPEN_DATE.isoformat(), 'opted_in': True},
+        # The last item for the same meal and date wins
+        {'meal_type_id': 3, 'date': OPEN_DATE.isoformat(), 'opted_in': False},
+    ]})
+    assert response.status_code == 200
+    assert response.json['applied'] == 2
+    assert [(r['index'], r['success'], r.get('message')) for r in response.json['results']] == [
+        (0, True, None),
+        (1, False, 'Invalid item'),
+        (2, False, 'Invalid meal type'),
+        (3, False, 'Invalid date format'),
+        (4, False, 'Opt-in is closed for this date'),
+        (5, True, None),
+        (6, True, None),
+    ]
+
+    with app.app_context():
+        user_id = User.query.filter_by(email='jane@example.com').one().id
+        opted = {
+            (row.meal_type_id, row.date): row.opted_in
+            for row in UserMealOptIn.query.filter(
+                UserMealOptIn.user_id == user_id,
+                UserMealOptIn.date.in_([OPEN_DATE, CLOSED_DATE])
+            )
+        }
+        assert opted.get((1, OPEN_DATE)) is True
+        assert opted.get((3, OPEN_DATE)) in (None, False)
+        assert (2, CLOSED_DATE) not in opted
+        assert check_daily_counts(OPEN_DATE, CLOSED_DATE) == []
+
+@pytest.mark.parametrize('body', [{}, {'items': []}, {'items': 'x'}, {'items': [{}] * 101}])
+def test_malformed_batch_is_rejected(client, body):
+    response = client.post('/api/meals/opt-in/batch', json=body)
+    assert response.status_code == 400
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import routes
+from models import User, UserMealOptIn, WeeklyOptIn
+from rollups import check_daily_counts
+from schedules import IST
+
+TOGGLES = 400
+
+# As many requests at once as a worker has request threads
+CONCURRENCY = 16
+
+# A Tuesday evening, when opt-in for Wednesday is open
+NOW = IST.localize(datetime(2030, 1, 8, 21))
+TARGET_DATE = date(2030, 1, 9)
+MEAL_TYPE_ID = 2
+
+def test_concurrent_toggles_keep_one_row_and_matching_counts(app, login, monkeypatch):
+    monkeypatch.setattr(routes, 'get_ist_now', lambda: NOW)
+    session_cookie = login('john@example.com', 'password123').get_cookie('session')
+
+    def toggle(i):
+        client = app.test_client()
+        client.set_cookie(session_cookie.key, session_cookie.value)
+        if i % 4 == 3:
+            # Weekly preferences apply to the open Wednesday too
+            return client.post('/api/meals/weekly-opt-in', json={
+                'meal_type_id': MEAL_TYPE_ID,
+                'days': {'wednesday': i % 8 == 3}
+            }).status_code
+        return client.post('/api/meals/opt-in', json={
+            'meal_type_id': MEAL_TYPE_ID,
+            'date': TARGET_DATE.isoformat(),
+            'opted_in': i % 2 == 0
+        }).status_code
+
+    with ThreadPoolExecutor(CONCURRENCY) as executor:
+        statuses = list(executor.map(toggle, range(TOGGLES)))
+
+    assert [status for status in statuses if status >= 500] == []
+    assert set(statuses) == {200}
+    with app.app_context():
+        user_id = User.query.filter_by(email='john@example.com').one().id
+        rows = UserMealOptIn.query.filter_by(user_id=user_id, meal_type_id=MEAL_TYPE_ID, date=TARGET_DATE).all()
+        assert len(rows) == 1
+        assert WeeklyOptIn.query.filter_by(user_id=user_id, meal_type_id=MEAL_TYPE_ID).count() == 1
+        assert check_daily_counts(TARGET_DATE, TARGET_DATE) == []
@@ -0,0 +1,21 @@
+from datetime import date, datetime
+
+import routes
+from snapshots import FrozenDay, FrozenMeal
+
+def test_frozen_page_keeps_cursor_when_users_are_missing(login, monkeypatch):
+    # Users 900001 and 900002 were deleted after the date was frozen
+    opted_at = datetime(2024, 1, 1, 11)
+    frozen = FrozenDay(date(2024, 1, 1), {
+        2: FrozenMeal([1, 900001, 900002], [opted_at] * 3)
+    })
+    monkeypatch.setattr(routes, 'get_frozen_day', lambda for_date: frozen)
+    client = login()
+
+    page = client.get('/api/admin/opted-meals?date=2024-01-01&limit=2&cursor=2:0').json
+    assert [user['id'] for meal in page['meal_types'] for user in meal['users']] == [1]
+    assert page['next_cursor'] == '2:900001'
+
+    page = client.get(f"/api/admin/opted-meals?date=2024-01-01&limit=2&cursor={page['next_cursor']}").json
+    assert page['meal_types'] == []
+    assert page['next_cursor'] is None
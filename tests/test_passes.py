@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+import pytest
+
+import caching
+from meal_types import get_meal_type_registry, meal_type_cache
+from passes import issue_pass, verify_pass
+
+PASS_DATE = date(2030, 3, 4)
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+
+def tampered(token):
+    key_id, body = token.split('.')
+    flipped = 'A' if body[5] != 'A' else 'B'
+    return f'{key_id}.{body[:5]}{flipped}{body[6:]}'
+
+def test_issued_pass_verifies(app_context):
+    meal_pass = verify_pass(issue_pass(7, PASS_DATE, [1, 3]))
+    assert meal_pass == (7, PASS_DATE, (1, 3))
+
+@pytest.mark.parametrize('token', ['', 'no-dot', '0.', '0.!!!', 'unknown.AAAA'])
+def test_malformed_pass_is_rejected(app_context, token):
+    assert verify_pass(token) is None
+
+def test_tampered_pass_is_rejected(app_context):
+    assert verify_pass(tampered(issue_pass(7, PASS_DATE, [1]))) is None
+
+def test_pass_signed_with_another_key_is_rejected(app, app_context, monkeypatch):
+    token = issue_pass(7, PASS_DATE, [1])
+    monkeypatch.setitem(app.config, 'MEAL_PASS_KEYS', 'k2:other-secret')
+    assert verify_pass(token) is None
+
+def test_key_rotation(app, app_context, monkeypatch):
+    # Passes signed with SECRET_KEY stay valid while "0" is still listed
+    old_token = issue_pass(7, PASS_DATE, [1])
+    monkeypatch.setitem(app.config, 'MEAL_PASS_KEYS', f"k1:first-secret, 0:{app.config['SECRET_KEY']}")
+    assert verify_pass(old_token) is not None
+    new_token = issue_pass(7, PASS_DATE, [1])
+    assert new_token.startswith('k1.')
+
+    monkeypatch.setitem(app.config, 'MEAL_PASS_KEYS', 'k2:second-secret,k1:first-secret')
+    assert verify_pass(old_token) is None
+    assert verify_pass(new_token) is not None
+    assert issue_pass(7, PASS_DATE, [1]).startswith('k2.')
+
+def test_meal_type_out_of_range_is_refused(app_context):
+    with pytest.raises(ValueError):
+        issue_pass(7, PASS_DATE, [64])
+
+def test_verify_pass_endpoint(app):
+    with app.app_context():
+        token = issue_pass(7, PASS_DATE, [2])
+    client = app.test_client()
+
+    response = client.get(f'/api/verify-pass/{token}?date={PASS_DATE.isoformat()}')
+    assert response.status_code == 200
+    assert response.json['user_id'] == 7
+    assert [meal['meal_type_id'] for meal in response.json['meals'] if meal['opted_in']] == [2]
+
+    response = client.get(f'/api/verify-pass/{token}?date={(PASS_DATE + timedelta(days=1)).isoformat()}')
+    assert response.status_code == 409
+    assert client.get(f'/api/verify-pass/{tampered(token)}?date={PASS_DATE.isoformat()}').status_code == 404
+
+def test_verify_pass_endpoint_needs_no_database(app, count_statements, monkeypatch):
+    with app.app_context():
+        token = issue_pass(7, PASS_DATE, [2])
+        # Any earlier request in the worker has loaded the meal types
+        get_meal_type_registry()
+    client = app.test_client()
+    url = f'/api/verify-pass/{token}?date={PASS_DATE.isoformat()}'
+    assert client.get(url).status_code == 200
+
+    # Past CACHE_MAX_STALENESS, with the database gone
+    def unreachable(name):
+        raise RuntimeError('database unreachable')
+    monkeypatch.setattr(caching, 'get_cache_version', unreachable)
+    monkeypatch.setattr(meal_type_cache, '_checked_at', 0.0)
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert statements == []
+    names = {meal['meal_type_id']: meal['name'] for meal in response.json['meals']}
+    assert names[2] == 'Lunch'
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from pooling import MeteredNullPool, MeteredQueuePool, engine_options, pool_stats
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=MeteredQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    yield engine
+    engine.dispose()
+
+def test_exhausted_pool_counts_waits_and_timeouts(engine):
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+        assert engine.pool.exhausted()
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    assert not engine.pool.exhausted()
+
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+    stats = pool_stats(engine)
+    assert stats['class'] == 'MeteredQueuePool'
+    assert (stats['connects'], stats['checkouts'], stats['waits'], stats['timeouts']) == (1, 2, 1, 1)
+    assert stats['wait_seconds_max'] >= 0.05
+    assert (stats['size'], stats['max_overflow'], stats['checked_out']) == (1, 0, 0)
+
+def test_counters_survive_dispose(engine):
+    with engine.connect():
+        pass
+    engine.dispose()
+    with engine.connect():
+        pass
+
+    # The recreated pool keeps its size and does not count checkouts twice
+    stats = pool_stats(engine)
+    assert (stats['connects'], stats['checkouts'], stats['max_overflow']) == (2, 2, 0)
+
+def test_null_pool_counts_every_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'null.db'}", poolclass=MeteredNullPool)
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    stats = pool_stats(engine)
+    assert (stats['connects'], stats['checkouts'], stats['waits']) == (3, 3, 0)
+
+def test_queue_profile_splits_max_connections_across_workers():
+    options = engine_options('queue', threads=8, workers=3, max_connections=20)
+    assert (options['pool_size'], options['max_overflow']) == (6, 0)
+    options = engine_options('queue', threads=4, workers=2, max_connections=20)
+    assert (options['pool_size'], options['max_overflow']) == (4, 6)
+    assert engine_options('pgbouncer', threads=4) == {'poolclass': MeteredNullPool}
+    with pytest.raises(ValueError):
+        engine_options('bogus', threads=4)
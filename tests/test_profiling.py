@@ -0,0 +1,48 @@
+from collections import Counter
+
+import pytest
+
+from profiling import request_profiler
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(request_profiler, 'directory', str(tmp_path))
+    return tmp_path
+
+def test_admin_can_profile_a_request_and_download_it(login, profile_dir):
+    client = login()
+    response = client.get('/api/meals', headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    name = response.headers['X-Profile-Id']
+    assert '-main.get_meal_types-' in name
+    assert (profile_dir / name).exists()
+
+    assert [p['name'] for p in client.get('/api/admin/profiles').json['profiles']] == [name]
+    response = client.get(f'/api/admin/profiles/{name}')
+    assert response.status_code == 200
+    assert response.data == (profile_dir / name).read_bytes()
+
+    # Without the header nothing is profiled
+    assert 'X-Profile-Id' not in client.get('/api/meals').headers
+
+def test_users_cannot_profile_or_download(login, profile_dir):
+    name = request_profiler.save(Counter({'main;handler': 3}), 'main.get_meal_types', 0.01)
+
+    client = login('john@example.com', 'password123')
+    response = client.get('/api/meals', headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    assert 'X-Profile-Id' not in response.headers
+    assert client.get('/api/admin/profiles').status_code == 403
+    assert client.get(f'/api/admin/profiles/{name}').status_code == 403
+
+@pytest.mark.parametrize('name', ['secret.txt', '..%2Fsecret.folded', 'missing.folded'])
+def test_only_stored_profiles_can_be_downloaded(login, profile_dir, name):
+    (profile_dir.parent / 'secret.folded').write_text('secret')
+    (profile_dir / 'secret.txt').write_text('secret')
+    assert login().get(f'/api/admin/profiles/{name}').status_code == 404
+
+def test_oldest_profiles_are_dropped_beyond_the_limit(profile_dir, monkeypatch):
+    monkeypatch.setattr(request_profiler, 'max_files', 2)
+    names = [request_profiler.save(Counter({'a;b': 1}), 'endpoint', 0.001) for _ in range(3)]
+    assert [p['name'] for p in request_profiler.list_profiles()] == names[:0:-1]
+    assert (profile_dir / names[2]).read_text() == 'a;b 1\n'
@@ -0,0 +1,40 @@
+import pytest
+
+@pytest.mark.parametrize('image_format', ['json', 'png', 'svg'])
+def test_user_qr_code_revalidates_with_etag(login, image_format):
+    client = login('john@example.com', 'password123')
+    response = client.get(f'/api/qr-code?format={image_format}')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    response = client.get(f'/api/qr-code?format={image_format}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_qr_code_etag_differs_per_user_and_format(login):
+    john = login('john@example.com', 'password123')
+    jane = login('jane@example.com', 'password123')
+    john_png = john.get('/api/qr-code?format=png').headers['ETag']
+    assert john.get('/api/qr-code?format=svg').headers['ETag'] != john_png
+
+    # Another user's ETag gets the full image
+    response = jane.get('/api/qr-code?format=png', headers={'If-None-Match': john_png})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != john_png
+
+def test_daily_qr_image_revalidates_with_etag(login):
+    client = login()
+    image_url = client.get('/api/admin/daily-qr').json['qr_code_url']
+
+    response = client.get(image_url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.headers['Cache-Control'] == 'private, max-age=86400'
+
+    response = client.get(image_url, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+def test_daily_qr_image_with_unknown_token_is_not_found(login):
+    response = login().get('/api/admin/daily-qr/2030-01-01/not-a-token.png')
+    assert response.status_code == 404
@@ -0,0 +1,66 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from __init__ import db
+from models import MealRedemption
+from redemptions import RedemptionLedger
+
+@pytest.fixture
+def ledger(app):
+    ledger = RedemptionLedger('test_redemptions')
+    ledger.init_app(app)
+    return ledger
+
+def queued(user_id, meal_type_id, for_date):
+    return {
+        'user_id': user_id,
+        'meal_type_id': meal_type_id,
+        'date': for_date,
+        'redeemed_at': datetime.utcnow(),
+        'scanned_by': None
+    }
+
+def test_rows_that_fail_alone_are_dropped(app, ledger):
+    for_date = date(2030, 1, 1)
+    ledger._pending = [queued(1, 1, for_date), queued(2, 1, for_date), queued(None, 1, for_date), queued(3, 1, for_date)]
+
+    assert ledger.flush() == 3
+    assert ledger.stats()['pending'] == 0
+    assert ledger.stats()['dropped'] == 1
+    with app.app_context():
+        stored = db.session.query(MealRedemption.user_id).filter_by(date=for_date).order_by(MealRedemption.user_id).all()
+    assert [row.user_id for row in stored] == [1, 2, 3]
+
+def test_unreachable_database_keeps_newest_rows_up_to_the_cap(ledger, monkeypatch):
+    def unreachable(rows):
+        raise OperationalError('INSERT', {}, Exception('connection refused'))
+    monkeypatch.setattr(ledger, '_insert', unreachable)
+    ledger.max_pending = 3
+    for_date = date(2030, 1, 2)
+    ledger._pending = [queued(user_id, 1, for_date) for user_id in range(1, 6)]
+
+    assert ledger.flush() == 0
+    assert [row['user_id'] for row in ledger._pending] == [3, 4, 5]
+    assert ledger.stats()['dropped'] == 2
+
+def test_load_keeps_rows_flushed_while_querying(app, ledger):
+    for_date = date(2030, 1, 3)
+    ledger._pending = [queued(2, 1, for_date)]
+
+    def flush_during_query(state):
+        # The flusher commits right after the SELECT has read the table
+        result = state.invoke_statement()
+        ledger._pending = []
+        return result
+
+    with app.test_request_context():
+        event.listen(Session, 'do_orm_execute', flush_during_query)
+        try:
+            redeemed = ledger.redeemed_meal_type_ids(2, for_date)
+        finally:
+            event.remove(Session, 'do_orm_execute', flush_during_query)
+    assert redeemed == {1}
@@ -0,0 +1,105 @@
+from datetime import date
+
+import pytest
+
+from __init__ import db
+from materialize import materialize_weekly_opt_ins
+from models import DailyMealCount, User
+from opt_ins import set_opt_ins, set_weekly_preferences
+from rollups import backfill_daily_counts, check_daily_counts, period_start
+
+MON, WED, NEXT_WED, MONTH_END, NEXT_MONTH = (
+    date(2031, 3, 3), date(2031, 3, 5), date(2031, 3, 12), date(2031, 3, 31), date(2031, 4, 2)
+)
+
+@pytest.fixture(scope='module')
+def user_ids(app):
+    with app.app_context():
+        return [user.id for user in User.query.order_by(User.id).limit(3)]
+
+@pytest.fixture(scope='module')
+def opt_ins(app, user_ids):
+    """Lunch: 3 on MON, 2 on WED, 1 on NEXT_WED, 1 on MONTH_END, 2 on NEXT_MONTH; dinner: 1 on WED"""
+    counts = {MON: 3, WED: 2, NEXT_WED: 1, MONTH_END: 1, NEXT_MONTH: 2}
+    with app.app_context():
+        for i, user_id in enumerate(user_ids):
+            changes = {(2, day): True for day, count in counts.items() if i < count}
+            if i == 0:
+                changes[(3, WED)] = True
+            set_opt_ins(user_id, changes)
+        db.session.commit()
+
+def test_counts_follow_toggles(app, user_ids):
+    day = date(2031, 5, 7)
+    with app.app_context():
+        for opted_in in (True, True, False, True, False, False):
+            set_opt_ins(user_ids[0], {(1, day): opted_in, (2, day): not opted_in})
+            db.session.commit()
+        set_opt_ins(user_ids[1], {(1, day): True})
+        db.session.commit()
+        assert check_daily_counts(day, day) == []
+        assert DailyMealCount.query.filter_by(date=day, meal_type_id=2).one().count == 1
+
+def test_counts_follow_materialized_opt_ins(app, user_ids):
+    day = date(2031, 5, 14)  # A Wednesday
+    with app.app_context():
+        set_opt_ins(user_ids[0], {(1, day): False})
+        for user_id in user_ids:
+            set_weekly_preferences(user_id, 1, {'wednesday': True})
+        db.session.commit()
+        materialize_weekly_opt_ins(day)
+        assert check_daily_counts(day, day) == []
+        # The explicit opt-out is kept
+        assert DailyMealCount.query.filter_by(date=day, meal_type_id=1).one().count == len(user_ids) - 1
+
+@pytest.mark.parametrize('day, granularity, start', [
+    (WED, 'day', WED),
+    (WED, 'week', MON),
+    (date(2031, 3, 9), 'week', MON),
+    (WED, 'month', date(2031, 3, 1)),
+])
+def test_period_start(day, granularity, start):
+    assert period_start(day, granularity) == start
+
+def history(client, granularity, **params):
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    response = client.get(f'/api/admin/historical-data?start_date={MON}&end_date={NEXT_MONTH}&granularity={granularity}&{query}')
+    assert response.status_code == 200
+    return {
+        period['date']: {meal['meal_type_id']: meal['count'] for meal in period['meals']}
+        for period in response.json['data']
+    }
+
+def test_history_buckets(login, opt_ins):
+    client = login()
+    assert history(client, 'day') == {
+        '2031-03-03': {2: 3},
+        '2031-03-05': {2: 2, 3: 1},
+        '2031-03-12': {2: 1},
+        '2031-03-31': {2: 1},
+        '2031-04-02': {2: 2}
+    }
+    assert history(client, 'week') == {
+        '2031-03-03': {2: 5, 3: 1},
+        '2031-03-10': {2: 1},
+        '2031-03-31': {2: 3}
+    }
+    assert history(client, 'month') == {
+        '2031-03-01': {2: 7, 3: 1},
+        '2031-04-01': {2: 2}
+    }
+    assert history(client, 'week', meal_type_id=3) == {'2031-03-03': {3: 1}}
+
+def test_history_range_is_inclusive(login, opt_ins):
+    response = login().get(f'/api/admin/historical-data?start_date={WED}&end_date={NEXT_WED}')
+    assert [period['date'] for period in response.json['data']] == ['2031-03-05', '2031-03-12']
+
+def test_backfill_fills_an_empty_table_once(app, opt_ins):
+    with app.app_context():
+        DailyMealCount.query.delete()
+        db.session.commit()
+
+        assert backfill_daily_counts()
+        assert check_daily_counts() == []
+        assert DailyMealCount.query.filter_by(date=MON, meal_type_id=2).one().count == 3
+        assert not backfill_daily_counts()
@@ -0,0 +1,92 @@
+from datetime import date, datetime
+
+import roster
+import routes
+from models import MealRedemption, User
+from schedules import IST
+
+# A Tuesday evening, when opt-in for Wednesday is open
+NOW = IST.localize(datetime(2030, 2, 5, 21))
+ROSTER_DATE = date(2030, 2, 6)
+
+def user_id(app, email):
+    with app.app_context():
+        return User.query.filter_by(email=email).one().id
+
+def opt_in(client, opted_in):
+    response = client.post('/api/meals/opt-in/batch', json={'items': [
+        {'meal_type_id': 2, 'date': ROSTER_DATE.isoformat(), 'opted_in': opted_in}
+    ]})
+    assert response.json['applied'] == 1
+
+def get_roster(client, since=None):
+    url = f'/api/admin/roster?date={ROSTER_DATE.isoformat()}&meal_type_id=2'
+    if since is not None:
+        url += f'&since={since}'
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.json
+
+def test_roster_deltas_apply_changes_after_the_full_version(app, login, monkeypatch):
+    monkeypatch.setattr(routes, 'get_ist_now', lambda: NOW)
+    admin = login()
+    john = login('john@example.com', 'password123')
+    jane = login('jane@example.com', 'password123')
+    john_id = user_id(app, 'john@example.com')
+    jane_id = user_id(app, 'jane@example.com')
+
+    # Changes are settled as soon as they are written
+    monkeypatch.setattr(roster, 'ROSTER_SETTLE_SECONDS', 0)
+    opt_in(john, True)
+    full = get_roster(admin)
+    assert full['full'] is True
+    assert [user[0] for user in full['users']] == [john_id]
+
+    opt_in(jane, True)
+    opt_in(john, False)
+    delta = get_roster(admin, full['version'])
+    assert delta['full'] is False
+    assert delta['version'] > full['version']
+    assert [user[0] for user in delta['added']] == [jane_id]
+    assert delta['removed'] == [john_id]
+
+    # Nothing changed since the delta
+    empty = get_roster(admin, delta['version'])
+    assert (empty['version'], empty['added'], empty['removed']) == (delta['version'], [], [])
+
+    # Unsettled changes are sent but the version stays behind them
+    monkeypatch.setattr(roster, 'ROSTER_SETTLE_SECONDS', 60)
+    opt_in(jane, False)
+    unsettled = get_roster(admin, delta['version'])
+    assert unsettled['version'] == delta['version']
+    assert unsettled['removed'] == [jane_id]
+    assert get_roster(admin, unsettled['version'])['removed'] == [jane_id]
+
+def test_roster_rejects_invalid_version(login):
+    response = login().get('/api/admin/roster?meal_type_id=2&since=latest')
+    assert response.status_code == 400
+
+def test_uploading_the_same_scan_again_is_a_duplicate(app, login):
+    admin = login()
+    john_id = user_id(app, 'john@example.com')
+    scan = {'user_id': john_id, 'meal_type_id': 1, 'date': '2030-02-07', 'scanned_at': '2030-02-07T02:30:00Z'}
+
+    response = admin.post('/api/admin/scans', json={'scans': [scan, scan, {'user_id': john_id}]})
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['results']] == ['recorded', 'duplicate', 'invalid']
+
+    # Uploading again after the scans were written is still harmless
+    routes.redemption_ledger.flush()
+    response = admin.post('/api/admin/scans', json={'scans': [scan]})
+    assert [r['status'] for r in response.json['results']] == ['duplicate']
+
+    routes.redemption_ledger.flush()
+    with app.app_context():
+        redemptions = MealRedemption.query.filter_by(user_id=john_id, date=date(2030, 2, 7)).all()
+    assert len(redemptions) == 1
+    assert redemptions[0].redeemed_at == datetime(2030, 2, 7, 2, 30)
+
+def test_scans_require_admin(login):
+    client = login('john@example.com', 'password123')
+    assert client.post('/api/admin/scans', json={'scans': [{}]}).status_code == 403
+    assert client.get('/api/admin/roster?meal_type_id=2').status_code == 403
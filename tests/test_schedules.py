@@ -0,0 +1,76 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+import routes
+from schedules import IST, ScheduleRule, compile_timeline
+
+# The schedules init_db creates
+RULES = tuple(
+    [ScheduleRule(day + 1, day, time(20), time(9), False) for day in range(5)] + [
+        ScheduleRule(6, 5, time(20), time(16), True),
+        ScheduleRule(7, 6, time(16), time(20), True)
+    ]
+)
+
+# A week starting on Monday
+MON, TUE, WED, THU, FRI, SAT, SUN, NEXT_MON, NEXT_TUE = (date(2030, 1, 7) + timedelta(days=i) for i in range(9))
+
+def at(day, hour, minute=0):
+    return IST.localize(datetime.combine(day, time(hour, minute)))
+
+@pytest.fixture(scope='module')
+def timeline():
+    return compile_timeline(RULES, MON - timedelta(days=1))
+
+@pytest.mark.parametrize('moment, open_dates', [
+    # A weekday's meals open at 8 PM the day before and close at 9 AM on the day
+    (at(TUE, 8, 59), {TUE}),
+    (at(TUE, 9), set()),
+    (at(TUE, 19, 59), set()),
+    (at(TUE, 20), {WED}),
+    (at(WED, 0, 30), {WED}),
+    # From Friday 8 PM the weekend and Monday are open together
+    (at(FRI, 8, 59), {FRI}),
+    (at(FRI, 19, 59), set()),
+    (at(FRI, 20), {SAT, SUN, NEXT_MON}),
+    (at(SAT, 12), {SAT, SUN, NEXT_MON}),
+    (at(SUN, 0), {SUN, NEXT_MON}),
+    # Until Sunday 4 PM, after which Monday stays closed
+    (at(SUN, 15, 59), {SUN, NEXT_MON}),
+    (at(SUN, 16), set()),
+    (at(NEXT_MON, 8), set()),
+    (at(NEXT_MON, 20), {NEXT_TUE}),
+])
+def test_open_dates(timeline, moment, open_dates):
+    assert timeline.open_dates(moment) == open_dates
+
+def test_next_transition(timeline):
+    assert timeline.next_transition(at(TUE, 12), WED) == at(TUE, 20)
+    assert timeline.next_transition(at(TUE, 21), WED) == at(WED, 9)
+    assert timeline.next_transition(at(SAT, 12), NEXT_MON) == at(SUN, 16)
+    assert timeline.next_transition(at(TUE, 12)) == at(TUE, 20)
+
+def test_is_final(timeline):
+    assert not timeline.is_final(WED, at(TUE, 12))
+    assert timeline.is_final(WED, at(WED, 9))
+    assert timeline.is_final(NEXT_MON, at(SUN, 16))
+
+def test_weekday_rule_closing_later_the_same_day():
+    rules = (ScheduleRule(1, MON.weekday(), time(8), time(18), False),)
+    timeline = compile_timeline(rules, MON - timedelta(days=1))
+    assert timeline.open_dates(at(MON, 7, 59)) == set()
+    assert timeline.open_dates(at(MON, 8)) == {TUE}
+    assert timeline.open_dates(at(MON, 18)) == set()
+
+@pytest.mark.parametrize('moment, target_date, expected', [
+    (at(TUE, 8, 59), TUE, True),
+    (at(TUE, 8, 59), WED, False),
+    (at(TUE, 20), WED, True),
+    (at(FRI, 20), NEXT_MON, True),
+    (at(SUN, 16), NEXT_MON, False),
+])
+def test_is_opt_in_open_uses_the_stored_schedules(app, monkeypatch, moment, target_date, expected):
+    monkeypatch.setattr(routes, 'get_ist_now', lambda: moment)
+    with app.app_context():
+        assert routes.is_opt_in_open(target_date) is expected
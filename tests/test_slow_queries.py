@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+from slow_queries import fingerprint, parameter_shape, slow_query_log
+
+@pytest.mark.parametrize('statement, expected', [
+    ("SELECT * FROM user WHERE id = 5 AND name = 'O''Brien'", "SELECT * FROM user WHERE id = ? AND name = ?"),
+    ("SELECT * FROM t WHERE a = %(a_1)s AND b = %s AND c = ? AND d = :d AND e = $1",
+     "SELECT * FROM t WHERE a = ? AND b = ? AND c = ? AND d = ? AND e = ?"),
+    ("SELECT * FROM t WHERE id IN (1, 2, 3)", "SELECT * FROM t WHERE id IN (...)"),
+    ("SELECT * FROM t WHERE id IN (?)", "SELECT * FROM t WHERE id IN (...)"),
+    ("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO t (a, b) VALUES (...)"),
+    ("SELECT  x::date,\n\tcol1 FROM t2 WHERE y > -1.5", "SELECT x::date, col1 FROM t2 WHERE y > ?"),
+])
+def test_fingerprint_replaces_values(statement, expected):
+    assert fingerprint(statement) == expected
+
+def test_statements_differing_only_in_values_share_a_fingerprint():
+    assert fingerprint("SELECT * FROM t WHERE id IN (1, 2) AND day = '2030-01-01'") \
+        == fingerprint("SELECT * FROM t WHERE id IN (7, 8, 9, 10) AND day = '2031-12-31'")
+    assert fingerprint("SELECT * FROM t WHERE a = 1") != fingerprint("SELECT * FROM t WHERE b = 1")
+
+def test_parameter_shape_lists_types_not_values():
+    assert parameter_shape({'id_1': 3, 'date_1': date(2030, 1, 1)}) == '{id_1: int, date_1: date}'
+    assert parameter_shape((3, 'secret')) == '[int, str]'
+    assert parameter_shape([(1, 'a'), (2, 'b')], executemany=True) == '2 x [int, str]'
+    assert parameter_shape([], executemany=True) == '0 x []'
+
+@pytest.fixture
+def record_everything(monkeypatch):
+    slow_query_log.reset()
+    monkeypatch.setattr(slow_query_log, 'threshold', 0)
+    yield
+    slow_query_log.reset()
+
+def test_slow_queries_are_aggregated_per_fingerprint(login, record_everything):
+    client = login()
+    for meal_type_id in (1, 2):
+        client.get(f'/api/admin/roster?date=2030-03-01&meal_type_id={meal_type_id}')
+
+    queries = client.get('/api/admin/slow-queries').json['queries']
+    assert queries
+    for query in queries:
+        assert "'" not in query['fingerprint']
+        assert 'admin@example.com' not in query['parameters']
+        assert query['plan'] is None
+    assert any(query['endpoints'].get('main.get_roster') == 2 for query in queries)
+
+    assert client.delete('/api/admin/slow-queries').status_code == 200
+    slow_query_log.threshold = None
+    assert client.get('/api/admin/slow-queries').json['queries'] == []
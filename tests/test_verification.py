@@ -0,0 +1,71 @@
+import os
+import random
+import time
+from datetime import date
+
+from __init__ import db
+from models import User, UserMealOptIn
+
+# Users seeded for the benchmark and scans timed
+BENCHMARK_USERS = 200
+BENCHMARK_SCANS = 500
+
+# p99 target for one scan through the test client; override for slower machines
+VERIFY_P99_TARGET_MS = float(os.environ.get('VERIFY_P99_TARGET_MS', 25))
+
+def daily_token(app, login):
+    login().get('/api/admin/daily-qr')
+    from models import DailyQRCode
+    with app.app_context():
+        return DailyQRCode.query.filter_by(date=date.today()).one().token
+
+def test_non_ascii_token_is_rejected(app, login):
+    daily_token(app, login)
+    response = app.test_client().get(f'/api/verify-meal/{date.today().isoformat()}/%C3%A9')
+    assert response.status_code == 404
+
+def seed_users(app):
+    today = date.today()
+    with app.app_context():
+        users = [
+            User(name=f'Bench {i}', email=f'bench{i}@example.com', password_hash='-')
+            for i in range(BENCHMARK_USERS)
+        ]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(
+            UserMealOptIn(user_id=user.id, meal_type_id=meal_type_id, date=today, opted_in=True)
+            for user in users for meal_type_id in (1, 2) if user.id % 3
+        )
+        db.session.commit()
+        return [user.id for user in users]
+
+def test_verify_meal_latency(app, login, count_statements):
+    """Latency benchmark for the scan path; run with -s to see the percentiles"""
+    token = daily_token(app, login)
+    user_ids = seed_users(app)
+    client = app.test_client()
+    url = f'/api/verify-meal/{date.today().isoformat()}/{token}'
+
+    # Warm the per-worker caches like a running worker
+    assert client.get(f'{url}?user_id={user_ids[0]}').status_code == 200
+
+    timings = []
+    with count_statements() as statements:
+        for _ in range(BENCHMARK_SCANS):
+            user_id = random.choice(user_ids)
+            started = time.perf_counter()
+            response = client.get(f'{url}?user_id={user_id}')
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200
+            assert response.json['user']['name'] == f'Bench {user_ids.index(user_id)}'
+
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f'\nverify-meal: {BENCHMARK_SCANS} scans, p50 {p50:.2f} ms, p99 {p99:.2f} ms, '
+          f'{len(statements) / BENCHMARK_SCANS:.2f} statements per scan')
+
+    # One projected query per scan, plus the odd cache version check
+    assert len(statements) / BENCHMARK_SCANS < 1.1
+    assert p99 < VERIFY_P99_TARGET_MS
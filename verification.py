@@ -0,0 +1,76 @@
+import hmac
+from datetime import date, timedelta
+from types import MappingProxyType
+
+from __init__ import db
+from caching import VersionedCache, bump_cache_version
+from identity import load_user_snapshot
+from models import DailyQRCode, User, UserMealOptIn
+from snapshots import get_frozen_day
+
+DAILY_QR_TOKEN_CACHE = 'daily_qr_tokens'
+
+# Scans are for today, so only recent and upcoming codes are kept in memory
+DAILY_QR_TOKEN_DAYS = 7
+
+def load_daily_qr_tokens():
+    """Load the token of every recent daily QR code, by date"""
+    rows = db.session.query(DailyQRCode.date, DailyQRCode.token)\
+        .filter(DailyQRCode.date >= date.today() - timedelta(days=DAILY_QR_TOKEN_DAYS))\
+        .all()
+    return MappingProxyType({row.date: row.token for row in rows})
+
+daily_qr_token_cache = VersionedCache(DAILY_QR_TOKEN_CACHE, load_daily_qr_tokens)
+
+def invalidate_daily_qr_tokens():
+    """Mark the daily QR codes as changed in every worker (call before committing)"""
+    bump_cache_version(DAILY_QR_TOKEN_CACHE)
+
+def is_valid_daily_qr(for_date, token):
+    """Check a scanned (date, token) pair, usually without touching the database.
+
+    A token missing from the snapshot or different from it falls back to a
+    query, so a code created or regenerated in another worker is accepted
+    before this worker's snapshot is refreshed.
+    """
+    known = daily_qr_token_cache.get().get(for_date)
+    # Compared as bytes: compare_digest rejects non-ASCII str
+    if known is not None and hmac.compare_digest(known.encode(), token.encode()):
+        return True
+
+    return db.session.query(DailyQRCode.id)\
+        .filter_by(date=for_date, token=token)\
+        .first() is not None
+
+def get_user_meal_status(user_id, for_date):
+    """Get a user's name, email and {meal_type_id: opted_in} for a date.
+
+    One query: the user left-joined to their opt-ins for the date, plain
+    columns only. Frozen dates are answered from memory instead. Returns
+    None if the user doesn't exist.
+    """
+    frozen = get_frozen_day(for_date)
+    if frozen:
+        user = load_user_snapshot(user_id)
+        return (user.name, user.email, frozen.opt_in_map(user_id)) if user else None
+
+    rows = db.session.query(
+            User.name,
+            User.email,
+            UserMealOptIn.meal_type_id,
+            UserMealOptIn.opted_in
+        )\
+        .outerjoin(UserMealOptIn, db.and_(
+            UserMealOptIn.user_id == User.id,
+            UserMealOptIn.date == for_date
+        ))\
+        .filter(User.id == user_id)\
+        .all()
+    if not rows:
+        return None
+
+    opt_in_map = {
+        row.meal_type_id: bool(row.opted_in)
+        for row in rows if row.meal_type_id is not None
+    }
+    return rows[0].name, rows[0].email, opt_in_map